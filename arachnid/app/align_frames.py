@@ -89,6 +89,14 @@ Tunable Options
     
     Gap between pairs for L1/L2 alignment
 
+.. option:: --fft-single <BOOL>
+    
+    Calculate the FFT of the frames in single precision (complex64), halves the memory for the cached spectra
+
+.. option:: --frame-batch <INT>
+    
+    Number of frames read and transformed together
+
 Diagnostic Options
 ==================
 
@@ -149,10 +157,17 @@ from ..core.util import drawing
 from ..core.util import plotting
 import scipy.fftpack
 import scipy.ndimage
+import multiprocessing.pool
 import numpy
 import logging
 import os
 
+try:
+    import pyfftw.interfaces.scipy_fftpack as fftw_fftpack #@UnresolvedImport
+    fftw_fftpack;
+except:
+    fftw_fftpack=None
+
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
 
@@ -175,21 +190,27 @@ def process(filename, benchmark=False, **extra):
     '''
     
     spider_utility.update_spider_files(extra, filename, *extra['outfile_deps'])
+    spectra, shape = None, None
     if benchmark:
         coords = benchmark_in_memory(filename, **extra)
     else:
-        coords = align_in_memory(filename, **extra)
+        coords, spectra, shape = align_in_memory(filename, keep_spectra=True, **extra)
         
     if len(coords) > 0:
         _logger.info("Writing average")
-        write_average(filename, coords, **extra)
+        write_average(filename, coords, spectra=spectra, frame_shape=shape, **extra)
         _logger.info("Writing average - finished")
         write_coordinates(coords, **extra)
     return filename, coords
 
-def fft_in_memory(filename, gain_file="", bin_factor=1.0, **extra):
+def fft_in_memory(filename, gain_file="", bin_factor=1.0, fft_single=True, keep_spectra=False, frame_batch=4, thread_count=1, **extra):
     ''' Precalculate the FFT of each frame in the movie stack.
     
+    The movie is read once in batches of contiguous float32 frames, the gain
+    reference is applied in place and each batch is transformed with a single
+    FFT call. The spectra used for alignment are normalized, windowed and binned,
+    while the spectra of the gain corrected frames can be kept for averaging.
+    
     :Parameters:
     
         filename : str
@@ -198,33 +219,126 @@ def fft_in_memory(filename, gain_file="", bin_factor=1.0, **extra):
                     Filename for gain normalization image
         bin_factor : float
                      Factor to downsample frame images
+        fft_single : bool
+                     Calculate the FFT in single precision (complex64)
+        keep_spectra : bool
+                       Keep the half spectra of the gain corrected frames for averaging
+        frame_batch : int
+                      Number of frames transformed together
+        thread_count : int
+                       Number of threads used by the FFT (requires pyFFTW)
         extra : dict
                 Unused keyword arguments
     
     :Returns:
     
-        fourier_frames : list
-                         List of Fourier transforms of each frame
+        fourier_frames : array
+                         Fourier transforms of each frame
+        spectra : array, optional
+                  Half spectra (`numpy.fft.rfft2` layout) of each gain corrected frame, 
+                  if `keep_spectra` is True
+        shape : tuple, optional
+                Shape of each frame, if `keep_spectra` is True
     
     .. codeauthor:: Robert Langlois <rl2528@columbia.edu>
     .. codeauthor:: Ryan Hyde Smith <rhs2132@columbia.edu>
     '''
     
-    gain = ndimage_file.read_image(gain_file) if gain_file != "" else None
-    fourier_frames = []
+    gain = ndimage_file.read_image(gain_file).astype(numpy.float32) if gain_file != "" else None
+    count = ndimage_file.count_images(filename)
+    fourier_frames = None
+    spectra = None
     _logger.info("Caching FFT in memory")
-    for frame in ndimage_file.iter_images(filename):
-        frame = frame.astype(numpy.float)
-        if gain is not None: numpy.multiply(frame, gain, frame)
-        x, y, w, h = get_window(frame, **extra)
-        frame = frame[y:y+h, x:x+w].copy()
-        enhance_image.normalize_standard(frame, var_one=True, out=frame)
-        frame = scipy.fftpack.fft2(frame)
-        if bin_factor > 1.0: frame = ndimage_interpolate.resample_fft_fast(frame, bin_factor, True)
-        fourier_frames.append(frame)
+    for beg, batch in iter_frame_batches(filename, frame_batch):
+        if gain is not None: numpy.multiply(batch, gain, batch)
+        if not fft_single: batch = batch.astype(numpy.float)
+        end = beg+len(batch)
+        x, y, w, h = get_window(batch[0], **extra)
+        full_window = x == 0 and y == 0 and w == batch.shape[2] and h == batch.shape[1]
+        if keep_spectra or full_window:
+            fbatch = fft2_batch(batch, thread_count)
+            if keep_spectra:
+                if spectra is None: spectra = numpy.empty((count, batch.shape[1], batch.shape[2]/2+1), dtype=fbatch.dtype)
+                spectra[beg:end] = fbatch[:, :, :batch.shape[2]/2+1]
+        if full_window:
+            # Equivalent to normalize_standard in real space
+            std = batch.reshape((len(batch), -1)).std(axis=1, dtype=numpy.float)
+            std[std == 0.0] = 1.0
+            fbatch[:, 0, 0] = 0
+            fbatch /= std.astype(batch.dtype)[:, numpy.newaxis, numpy.newaxis]
+        else:
+            window = batch[:, y:y+h, x:x+w].copy()
+            for frame in window: enhance_image.normalize_standard(frame, var_one=True, out=frame)
+            fbatch = fft2_batch(window, thread_count)
+        for i, frame in enumerate(fbatch):
+            if bin_factor > 1.0: frame = ndimage_interpolate.resample_fft_fast(frame, bin_factor, True)
+            if fourier_frames is None: fourier_frames = numpy.empty((count, )+frame.shape, dtype=frame.dtype)
+            fourier_frames[beg+i] = frame
+    if keep_spectra: return fourier_frames, spectra, (spectra.shape[1], batch.shape[2])
     return fourier_frames
 
-def align_in_memory(filename, mode=0, **extra):
+def iter_frame_batches(filename, frame_batch=4):
+    ''' Read a movie stack in batches of contiguous float32 frames
+    
+    The batch buffer is reused; the yielded array is only valid until
+    the next batch is read.
+    
+    :Parameters:
+        
+        filename : str
+                   Filename for movie stack
+        frame_batch : int
+                      Number of frames in each batch
+    
+    :Returns:
+        
+        beg : int
+              Index of the first frame in the batch
+        batch : array
+                Frames in the batch
+    '''
+    
+    stack = ndimage_file.open_stack(filename)
+    buf = None
+    if stack is not None:
+        buf = numpy.empty((min(frame_batch, len(stack)), )+stack.shape[1:], dtype=numpy.float32)
+        for beg in xrange(0, len(stack), frame_batch):
+            end = min(beg+frame_batch, len(stack))
+            buf[:end-beg] = stack[beg:end]
+            yield beg, buf[:end-beg]
+        return
+    beg, n = 0, 0
+    for frame in ndimage_file.iter_images(filename):
+        if buf is None: buf = numpy.empty((frame_batch, )+frame.shape, dtype=numpy.float32)
+        buf[n] = frame
+        n += 1
+        if n == frame_batch:
+            yield beg, buf
+            beg += n
+            n = 0
+    if n > 0: yield beg, buf[:n]
+
+def fft2_batch(batch, thread_count=1):
+    ''' Calculate the 2D FFT of each frame in a batch
+    
+    :Parameters:
+        
+        batch : array
+                Stack of frames (nframes, ny, nx)
+        thread_count : int
+                       Number of threads (requires pyFFTW)
+    
+    :Returns:
+        
+        fbatch : array
+                 Fourier transform of each frame, complex64 for float32 input
+    '''
+    
+    if fftw_fftpack is not None:
+        return fftw_fftpack.fft2(batch, axes=(-2, -1), threads=max(1, thread_count))
+    return scipy.fftpack.fft2(batch, axes=(-2, -1))
+
+def align_in_memory(filename, mode=0, keep_spectra=False, **extra):
     ''' Align frames from a movie stack in memory
     
     This function supports the following alignment algorithms:
@@ -238,6 +352,8 @@ def align_in_memory(filename, mode=0, **extra):
                    Filename for movie stack
         mode : int
                Alignment mode: 0) Sequential, 1) L2
+        keep_spectra : bool
+                       Return the spectra of the frames for averaging
         extra : dict
                 Unused keyword arguments
     
@@ -245,13 +361,18 @@ def align_in_memory(filename, mode=0, **extra):
     
         trans : array
                 Shifts for each movie frame
+        spectra : array, optional
+                  Half spectra of each gain corrected frame, see :py:func:`fft_in_memory`
+        shape : tuple, optional
+                Shape of each frame
     
     
     .. codeauthor:: Robert Langlois <rl2528@columbia.edu>
     .. codeauthor:: Ryan Hyde Smith <rhs2132@columbia.edu>
     '''
     
-    fourier_frames = fft_in_memory(filename, **extra)
+    fourier_frames = fft_in_memory(filename, keep_spectra=keep_spectra, **extra)
+    if keep_spectra: fourier_frames, spectra, shape = fourier_frames
     if mode == 0:
         _logger.info("Sequential alignment")
         trans = align_sequential(fourier_frames, **extra)
@@ -261,6 +382,7 @@ def align_in_memory(filename, mode=0, **extra):
     _logger.info("Alignment finished")
     write_perdiogram(fourier_frames, 0, trans, **extra)
     trans *= extra['bin_factor']
+    if keep_spectra: return trans, spectra, shape
     return trans
 
 def benchmark_in_memory(filename, **extra):
@@ -311,18 +433,12 @@ def align_mean_displacement(fourier_frames, upsampling=2, search_radius=50, lowp
     '''
     '''
     
-    filter_kernel=None
-    if lowpass_sigma is not None:
-        filter_kernel = scipy.fftpack.ifftshift(ndimage_filter.gaussian_lowpass_kernel(fourier_frames[0].shape, lowpass_sigma, numpy.float))
-    else: filter_kernel=1.0
-    
     index = numpy.triu_indices(len(fourier_frames), 1)
     cache = numpy.zeros((len(fourier_frames), len(fourier_frames), 3))
     
-    for i, j in zip(*index):
-        y, x, p = alignment.xcorr_dft_peak(fourier_frames[i]*filter_kernel, fourier_frames[j], upsampling, search_radius)
-        cache[i, j] = (x,y,p)
-        cache[j, i] = (-x,-y,p)
+    peaks = xcorr_pairs(fourier_frames, numpy.column_stack(index), upsampling, search_radius, lowpass_sigma, **extra)
+    cache[index] = peaks[:, (1, 0, 2)]
+    cache[index[1], index[0]] = peaks[:, (1, 0, 2)]*(-1, -1, 1)
     
     trans = numpy.zeros((len(fourier_frames), 2))
     idx = numpy.arange(1, len(fourier_frames), dtype=numpy.int)
@@ -360,11 +476,6 @@ def align_l2(fourier_frames, upsampling=2, search_radius=50, lowpass_sigma=None,
     .. codeauthor:: Ryan Hyde Smith <rhs2132@columbia.edu>
     '''
     
-    filter_kernel=None
-    if lowpass_sigma is not None:
-        filter_kernel = scipy.fftpack.ifftshift(ndimage_filter.gaussian_lowpass_kernel(fourier_frames[0].shape, lowpass_sigma, numpy.float))
-    else: filter_kernel=1.0
-    
     pairs = []
     for i in xrange(len(fourier_frames)-1):
         for j in xrange(i+gap, len(fourier_frames)):
@@ -374,8 +485,8 @@ def align_l2(fourier_frames, upsampling=2, search_radius=50, lowpass_sigma=None,
     for i, p in enumerate(pairs):
         A[i, p[0]:p[1]] = 1
     b = numpy.zeros((len(pairs), 2))
-    for i, p in enumerate(pairs):
-        b[i, 1], b[i, 0] = alignment.xcorr_dft_peak(fourier_frames[p[0]]*filter_kernel, fourier_frames[p[1]], upsampling, search_radius)[:2]
+    if len(pairs) > 0:
+        b[:, ::-1] = xcorr_pairs(fourier_frames, numpy.asarray(pairs), upsampling, search_radius, lowpass_sigma, **extra)[:, :2]
     x0 = numpy.linalg.lstsq(A, b)[0]
     trans = numpy.zeros((len(fourier_frames), 2))
     trans[1:] = x0.cumsum(axis=0)
@@ -388,6 +499,88 @@ def align_l2(fourier_frames, upsampling=2, search_radius=50, lowpass_sigma=None,
     '''
     return trans
 
+def xcorr_pairs(fourier_frames, pairs, upsampling=2, search_radius=50, lowpass_sigma=None, pair_block=0, thread_count=1, **extra):
+    ''' Find the cross-correlation peak for each pair of frames
+    
+    This gives the same result as calling :py:func:`alignment.xcorr_dft_peak` for each
+    pair. The lowpass filter is applied to each frame once, then the pairs are
+    evaluated in blocks with :py:func:`alignment.xcorr_dft_peaks` on a pool of threads.
+    
+    :Parameters:
+        
+        fourier_frames : array
+                         Fourier transforms of each frame
+        pairs : array
+                Index of the first and second frame in each pair
+        upsampling : int
+                     Upsampling factor
+        search_radius : float
+                        Maximum search radius
+        lowpass_sigma : float
+                        Gaussian lowpass filter applied to the first frame of each pair
+        pair_block : int
+                     Number of pairs evaluated together by each thread, if 0 then
+                     chosen by :py:func:`pair_block_size`. Each pair in a block needs
+                     about 16 bytes per pixel more than a Fourier frame, e.g. 1.4 GB
+                     for a 7676x7420 super-resolution frame in single precision
+        thread_count : int
+                       Number of threads
+        extra : dict
+                Unused keyword arguments
+    
+    :Returns:
+        
+        peaks : array
+                Peak (y, x, value) for each pair
+    '''
+    
+    pairs = numpy.asarray(pairs)
+    if pair_block < 1: pair_block = pair_block_size(fourier_frames[0], thread_count)
+    filtered = fourier_frames
+    if lowpass_sigma is not None:
+        filter_kernel = scipy.fftpack.ifftshift(ndimage_filter.gaussian_lowpass_kernel(fourier_frames[0].shape, lowpass_sigma, numpy.float))
+        filtered = fourier_frames*filter_kernel.astype(fourier_frames[0].real.dtype)
+    peaks = numpy.zeros((len(pairs), 3))
+    
+    def process_block(beg):
+        end = min(beg+pair_block, len(pairs))
+        f3 = numpy.asarray([filtered[i]*fourier_frames[j].conj() for i, j in pairs[beg:end]])
+        peaks[beg:end] = alignment.xcorr_dft_peaks(f3, upsampling, search_radius)
+    
+    blocks = xrange(0, len(pairs), pair_block)
+    if thread_count > 1 and len(blocks) > 1:
+        pool = multiprocessing.pool.ThreadPool(min(thread_count, len(blocks)))
+        try: pool.map(process_block, blocks)
+        finally: pool.close()
+    else:
+        for beg in blocks: process_block(beg)
+    return peaks
+
+def pair_block_size(frame, thread_count=1, max_block=8):
+    ''' Find the number of pairs of frames each thread evaluates together
+    that fit in half of the free memory
+    
+    :Parameters:
+        
+        frame : array
+                Fourier transform of a frame
+        thread_count : int
+                       Number of threads
+        max_block : int
+                    Maximum number of pairs
+    
+    :Returns:
+        
+        pair_block : int
+                     Number of pairs evaluated together
+    '''
+    
+    # Cross-power spectrum and its double precision copy in the DFT
+    nbytes = frame.size*(frame.itemsize+16)
+    try: free = os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_AVPHYS_PAGES')
+    except (ValueError, OSError, AttributeError): return max_block
+    return int(max(1, min(max_block, free/2/max(1, thread_count)/nbytes)))
+
 def average_fft(fourier_frames, trans=None, do_ifft=True):
     '''
     '''
@@ -472,7 +665,7 @@ def write_perdiogram(avg, index=0, trans=None, diagnostic_file="", **extra):
     '''
     
     if diagnostic_file == "": return
-    if isinstance(avg, list) and trans is not None:
+    if (isinstance(avg, list) or avg.ndim == 3) and trans is not None:
         avg = average_fft(avg, trans)
     pow = perdiogram(avg, **extra)
     write_pow(pow, index, diagnostic_file, **extra)
@@ -486,23 +679,29 @@ def write_coordinates(coords, translation_file="", **extra):
     coords = numpy.hstack((numpy.arange(len(coords))[:, numpy.newaxis], coords))
     format.write(translation_file, coords, header='id,x,y'.split(','))
 
-def write_average(filename, coords, output, frame_beg=0, frame_end=0, gain_file="", diagnostic_file="", crop=[], line_width=10, **extra):
+def write_average(filename, coords, output, frame_beg=0, frame_end=0, gain_file="", diagnostic_file="", crop=[], line_width=10, spectra=None, frame_shape=None, **extra):
     ''' Average the frames in the stack using the given 
     translation coordinates.
+    
+    If the spectra of the frames are given (see :py:func:`fft_in_memory`), then
+    the average is calculated from them without reading the movie again.
     '''
     
-    gain = ndimage_file.read_image(gain_file) if gain_file != "" else None
-    #frame_beg=0, frame_end=0
-    if gain is not None:
-        avg = gain.copy()
-        avg[:]=0
-    else: avg = None
-    for i, frame in enumerate(ndimage_file.iter_images(filename)):
-        frame = frame.astype(numpy.float)
-        if gain is not None: frame *= gain
-        frame = affine_transform.fourier_shift(frame, -coords[i, 0], -coords[i, 1])
-        if avg is None: avg = frame
-        else: avg += frame
+    if spectra is not None:
+        avg = average_spectra(spectra, coords, frame_shape)
+    else:
+        gain = ndimage_file.read_image(gain_file) if gain_file != "" else None
+        #frame_beg=0, frame_end=0
+        if gain is not None:
+            avg = gain.copy()
+            avg[:]=0
+        else: avg = None
+        for i, frame in enumerate(ndimage_file.iter_images(filename)):
+            frame = frame.astype(numpy.float)
+            if gain is not None: frame *= gain
+            frame = affine_transform.fourier_shift(frame, -coords[i, 0], -coords[i, 1])
+            if avg is None: avg = frame
+            else: avg += frame
     avg /= len(coords)
     ndimage_file.write_image(output, avg, header=dict(apix=extra['apix']))
     
@@ -521,6 +720,42 @@ def write_average(filename, coords, output, frame_beg=0, frame_end=0, gain_file=
         
         ndimage_file.write_image(output, avg)
 
+def average_spectra(spectra, trans, shape):
+    ''' Sum the frames shifted by the translations using their half spectra
+    
+    This gives the same result as shifting each frame with :py:func:`affine_transform.fourier_shift`
+    and summing in real space.
+    
+    :Parameters:
+        
+        spectra : array
+                  Half spectra (`numpy.fft.rfft2` layout) of each frame
+        trans : array
+                Translation (x, y) of each frame
+        shape : tuple
+                Shape of each frame
+    
+    :Returns:
+        
+        avg : array
+              Sum of the shifted frames
+    '''
+    
+    ny, nx = shape
+    fy = numpy.fft.fftfreq(ny)*(-2j*numpy.pi)
+    fx = numpy.arange(spectra.shape[2])*(-2j*numpy.pi/nx)
+    avg = numpy.zeros(spectra.shape[1:], dtype=numpy.complex128)
+    for i, frame in enumerate(spectra):
+        dx, dy = -trans[i, 0], -trans[i, 1]
+        py, px = numpy.exp(fy*dy), numpy.exp(fx*dx)
+        # Match the real part of a full complex shift at the Nyquist frequencies
+        if ny%2 == 0: py[ny/2] = numpy.cos(numpy.pi*dy)
+        if nx%2 == 0: px[nx/2] = numpy.cos(numpy.pi*dx)
+        phase = py[:, numpy.newaxis]*px
+        if ny%2 == 0 and nx%2 == 0: phase[ny/2, nx/2] = numpy.cos(numpy.pi*(dy+dx))
+        avg += frame*phase
+    return numpy.fft.irfft2(avg, s=shape)
+
 def get_window(avg, crop=[], **extra):
     '''
     '''
@@ -665,6 +900,9 @@ def setup_options(parser, pgroup=None, main_option=False):
     group.add_option("", gap=5,             help="Gap between pairs for L1/L2 alignment")
     group.add_option("", mode=("Sequential", "L2"), help="Alignment mode", default=1)
     group.add_option("", crop=[0, 0, -1, -1], help="Window size for the alignment")
+    group.add_option("", fft_single=True,   help="Calculate the FFT of the frames in single precision (complex64), halves the memory for the cached spectra")
+    group.add_option("", frame_batch=4,     help="Number of frames read and transformed together", gui=dict(minimum=1, singleStep=1))
+    group.add_option("", pair_block=0,      help="Number of frame pairs cross-correlated together by each thread, each needs about 16 bytes per pixel more than a frame spectrum, 0 chooses up to 8 that fit in half the free memory", gui=dict(minimum=0, singleStep=1))
     
     dgroup = OptionGroup(parser, "Diagnostic", "Options to control diagnostic output",  id=__name__)
     dgroup.add_option("", benchmark=False,   help="Run every alignment algorithm on the same set of micrographs for benchmarking")
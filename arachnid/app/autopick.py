@@ -125,6 +125,10 @@ selection.
     
     Selection file for a subset of micrographs
 
+.. option:: --window-batch <int>
+    
+    Number of particle windows extracted and processed together, trades memory for speed
+
 Other Options
 =============
 
@@ -147,9 +151,9 @@ from ..core.metadata import format_utility, format, spider_utility, spider_param
 from ..core.parallel import mpi_utility
 from ..core.util import drawing
 from ..core.image import ndimage_file
+from ..core.image import spatial_index
 #import numpy # pylint: disable=W0611
 import numpy.linalg
-import scipy.spatial
 import scipy.stats
 import lfcpick
 import logging
@@ -235,6 +239,35 @@ def search(img, disable_prune=False, limit_template=0, limit=0, experimental=Fal
     
     template = lfcpick.create_template(**extra)
     peaks = template_match(img, template, **extra)
+    return prune_peaks(img, peaks, disable_prune, limit_template, limit, experimental, **extra)
+
+def prune_peaks(img, peaks, disable_prune=False, limit_template=0, limit=0, experimental=False, **extra):
+    ''' Remove peaks outside the boundary, limit the number of peaks
+    and classify the remaining windows
+    
+    Args:
+        
+        img : array
+              Micrograph image
+        peaks : array
+                List of peaks including peak size, x-coordinate, y-coordinate
+        disable_prune : bool
+                        Disable the removal of bad particles
+        limit_template : int
+                         Maximum number of peaks to classify
+        limit : int
+                Maximum number of peaks to return
+        experimental : bool
+                       Use the experimental classifier
+        extra : dict
+                Unused key word arguments
+    
+    Returns:
+        
+        peaks : array
+                List of peaks: height and coordinates
+    '''
+    
     peaks=cull_boundary(peaks, img.shape, **extra)
     if len(peaks.squeeze())==0: return []
     index = numpy.argsort(peaks[:,0])[::-1]
@@ -260,7 +293,12 @@ def search(img, disable_prune=False, limit_template=0, limit=0, experimental=Fal
     return peaks[::-1]
 
 def search_range(img, disk_mult_range, **extra):
-    ''' Search a micrograph for particles using a template
+    ''' Search a micrograph for particles using a bank of templates, one
+    for each disk multiplier
+    
+    The micrograph is filtered and transformed once, each template is
+    correlated with it and the maximum over all templates is searched
+    for peaks.
     
     Args:
         
@@ -277,21 +315,83 @@ def search_range(img, disk_mult_range, **extra):
                 List of peaks: height and coordinates
     '''
     
-    #del extra['mask_mult']
-    coords_last = None
-    disk_mult_range = numpy.asarray(disk_mult_range)
-    #max_mult = disk_mult_range.max()
+    bank = template_bank(img.shape, img.dtype, disk_mult_range, **extra)
+    peaks = template_match_bank(img, bank, **extra)
+    return prune_peaks(img, peaks, **extra)
+
+_template_bank = (None, None)
+
+def template_bank(shape, dtype, disk_mult_range, template="", **extra):
+    ''' Create the conjugate spectra of the templates for each disk multiplier
+    
+    With more than one template, each is scaled to unit energy. The last bank
+    is cached, so it is reused for micrographs of the same size.
+    
+    Args:
+        
+        shape : tuple
+                Shape of the micrograph
+        dtype : dtype
+                Data type of the micrograph
+        disk_mult_range : list
+                          List of disk multipliers
+        template : str
+                   Filename of the template, if not empty, the disk multipliers are ignored
+        extra : dict
+                Unused key word arguments
+    
+    Returns:
+        
+        bank : list
+               List of conjugate template spectra
+    '''
+    
+    global _template_bank
+    
+    if template != "": disk_mult_range = disk_mult_range[:1]
+    key = (tuple(shape), numpy.dtype(dtype).str, tuple(disk_mult_range), template, extra.get('window'), extra.get('pixel_diameter'), extra.get('bin_factor'))
+    if _template_bank[0] == key: return _template_bank[1]
+    bank = []
+    param = dict(extra)
     for disk_mult in disk_mult_range:
-        try:
-            #coords = search(img, mask_mult=float(disk_mult)/max_mult, **extra)[::-1]
-            coords = search(img, **extra)[::-1]
-        except:
-            _logger.error("Error for disk_mult=%f"%(disk_mult))
-            raise
-        coords[:, 1:3] /= extra['bin_factor']
-        coords_last = merge_coords(coords_last, coords, **extra) if coords_last is not None else coords
-    coords_last[:, 1:3] *= extra['bin_factor']
-    return coords_last[::-1]
+        param['disk_mult'] = float(disk_mult)
+        img = lfcpick.create_template(template, **param)
+        # Unit energy templates, so the correlation with different sizes can be compared
+        if len(disk_mult_range) > 1: img = img/numpy.sqrt(numpy.sum(numpy.square(img, dtype=numpy.float)))
+        bank.append(ndimage_utility.template_spectrum(img, shape, dtype))
+    _template_bank = (key, bank)
+    return bank
+
+def template_match_bank(img, bank, pixel_diameter, **extra):
+    ''' Find peaks using the maximum correlation over a bank of templates
+    
+    Args:
+        
+        img : array
+              Micrograph
+        bank : list
+               List of conjugate template spectra
+        pixel_diameter : int
+                         Diameter of particle in pixels
+        extra : dict
+                Unused key word arguments
+    
+    Returns:
+        
+        peaks : array
+                List of peaks including peak size, x-coordinate, y-coordinate
+    '''
+    
+    _logger.debug("Filter micrograph")
+    img = ndimage_filter.gaussian_highpass(img, 0.25/(pixel_diameter/2.0), 2)
+    _logger.debug("Template-matching with %d templates"%len(bank))
+    cc_map, index = ndimage_utility.cross_correlate_bank(img, bank)
+    _logger.debug("Find peaks")
+    peaks = lfcpick.search_peaks(cc_map, pixel_diameter, **extra)
+    if peaks.ndim == 1: peaks = numpy.asarray(peaks).reshape((len(peaks)/3, 3))
+    if len(peaks) > 0:
+        _logger.debug("Peaks per template: %s"%str(numpy.bincount(index[peaks[:, 2].astype(numpy.int), peaks[:, 1].astype(numpy.int)], minlength=len(bank))))
+    return peaks
 
 def template_match(img, template_image, pixel_diameter, **extra):
     ''' Find peaks using given template in the micrograph
@@ -327,14 +427,10 @@ def merge_coords(coords1, coords2, pixel_diameter, **extra):
     '''
     
     pixel_radius = pixel_diameter/2
-    pixel_radius = pixel_radius*pixel_radius
-    selected = []
-    for i, f in enumerate(coords2):
-        dist = f[1:3]-coords1[:, 1:3]
-        numpy.square(dist, dist)
-        dist = numpy.sum(dist, axis=1)
-        if not (dist.min() < pixel_radius):
-            selected.append(i)
+    qi, j, d2 = spatial_index.neighbors_within(coords2[:, 1:3], coords1[:, 1:3], pixel_radius)
+    overlap = numpy.zeros(len(coords2), dtype=numpy.bool)
+    overlap[qi[d2 < pixel_radius*pixel_radius]] = True
+    selected = numpy.flatnonzero(numpy.logical_not(overlap))
     coords3 = numpy.zeros((coords1.shape[0]+len(selected), coords1.shape[1]))
     coords3[:coords1.shape[0]]=coords1
     coords3[coords1.shape[0]:]=coords2[selected]
@@ -383,7 +479,7 @@ def cull_boundary(peaks, shape, boundary=[], bin_factor=1.0, **extra):
     _logger.debug("Kept: %d of %d"%(j, len(peaks)))
     return peaks[:j]
 
-def classify_windows(mic, scoords, dust_sigma=4.0, xray_sigma=4.0, disable_threshold=False, remove_aggregates=False, pca_mode=0, iter_threshold=1, real_space_nstd=2.5, nstd_pw=4.0, mask_mult=1.0, window=None, pixel_diameter=None, threshold_minimum=25, **extra):
+def classify_windows(mic, scoords, dust_sigma=4.0, xray_sigma=4.0, disable_threshold=False, remove_aggregates=False, pca_mode=0, iter_threshold=1, real_space_nstd=2.5, nstd_pw=4.0, mask_mult=1.0, window=None, pixel_diameter=None, threshold_minimum=25, window_batch=256, **extra):
     ''' Classify particle windows from non-particle windows
     
     Args:
@@ -412,6 +508,8 @@ def classify_windows(mic, scoords, dust_sigma=4.0, xray_sigma=4.0, disable_thres
                          Diameter of particle in pixels
         threshold_minimum : int
                             Minimum number of consider success
+        window_batch : int
+                       Number of windows extracted and processed together
         extra : dict
                 Unused key word arguments
         
@@ -431,26 +529,14 @@ def classify_windows(mic, scoords, dust_sigma=4.0, xray_sigma=4.0, disable_thres
     data = numpy.zeros((len(scoords), numpy.sum(masksm>0.5)))
     
     mask = ndimage_utility.model_disk(int(radius*1.2+1), (window, window)) * (ndimage_utility.model_disk(int(radius*0.9), win_shape)*-1+1)
-    datar=None
-    
-    imgs=[]
+    datar = numpy.zeros((len(scoords), numpy.sum(mask>0.5)))
     _logger.debug("Windowing %d particles"%len(scoords))
-    for i, win in enumerate(ndimage_utility.for_each_window(mic, scoords, window, 1.0)):
-        if (i%10)==0: _logger.debug("Windowing particle: %d"%i)
-        #win=ndimage_filter.ramp(win)
-        imgs.append(win.copy())
-        
-        ndimage_utility.replace_outlier(win, dust_sigma, xray_sigma, None, win)
-        ar = ndimage_utility.compress_image(ndimage_utility.normalize_standard(win, mask, False), mask)
-        
-        if datar is None: datar=numpy.zeros((len(scoords), ar.shape[0])) 
-        datar[i, :] = ar
-        if vfeat is not None:
-            vfeat[i] = numpy.sum(ndimage_utility.segment(ndimage_utility.dog(win, radius), 1024)*dgmask)
-        amp=ndimage_utility.fftamp(win)*maskap
-        ndimage_utility.vst(amp, amp)
-        ndimage_utility.normalize_standard(amp, masksm, out=amp)
-        ndimage_utility.compress_image(amp, masksm, data[i])
+    for beg in xrange(0, len(scoords), window_batch):
+        end = min(beg+window_batch, len(scoords))
+        _logger.debug("Windowing particle: %d"%beg)
+        wins = ndimage_utility.crop_windows(mic, scoords[beg:end], window)
+        window_features(wins, radius, mask, masksm, maskap, dgmask, dust_sigma, xray_sigma, datar[beg:end], data[beg:end], vfeat[beg:end])
+        del wins
     
     _logger.debug("Performing PCA")
     feat, idx = dimensionality_reduction.pca(data, data, 1)[:2]
@@ -497,6 +583,87 @@ def classify_windows(mic, scoords, dust_sigma=4.0, xray_sigma=4.0, disable_thres
     #else: remove_overlap(scoords, radius, sel)
     return sel
 
+def window_features(wins, radius, mask, masksm, maskap, dgmask, dust_sigma, xray_sigma, datar, data, vfeat):
+    ''' Calculate the real space, Fourier amplitude and difference of Gaussian
+    features for a stack of windows
+    
+    Each step is applied to the whole stack, including a single FFT
+    for the amplitude features. The windows are modified in-place.
+    
+    Args:
+        
+        wins : array
+               Stack of windows (n, window, window)
+        radius : float
+                 Radius of the particle in pixels
+        mask : array
+               Mask for the real space features
+        masksm : array
+                 Mask for the Fourier amplitude features
+        maskap : array
+                 Mask to remove the center of the Fourier amplitude
+        dgmask : array
+                 Mask for the difference of Gaussian feature
+        dust_sigma : float
+                     Number of standard deviations for removal of outlier dark pixels
+        xray_sigma : float
+                     Number of standard deviations for removal of outlier light pixels
+        datar : array
+                Output real space features (n, number of pixels in mask)
+        data : array
+               Output Fourier amplitude features (n, number of pixels in masksm)
+        vfeat : array
+                Output difference of Gaussian feature (n)
+    '''
+    
+    n = len(wins)
+    ndimage_utility.replace_outlier_stack(wins, dust_sigma, xray_sigma)
+    flat = wins.reshape((n, -1))
+    
+    datar[:] = normalize_compress(flat, mask.ravel()>0.5, False)
+    
+    dogs = ndimage_utility.dog(wins, (0, radius, radius))
+    th = unary_classification.otsu_batch(dogs, 1024)
+    vfeat[:] = numpy.sum((dogs > th[:, numpy.newaxis, numpy.newaxis])*dgmask, axis=(1, 2))
+    del dogs
+    
+    amp = numpy.fft.fftshift(numpy.fft.fftn(wins, axes=(1, 2)), axes=(1, 2))
+    amp = numpy.abs(amp*amp.conjugate())*maskap
+    vmin = amp.reshape((n, -1)).min(axis=1)
+    if numpy.any(vmin < 0): amp -= numpy.minimum(vmin, 0)[:, numpy.newaxis, numpy.newaxis]
+    amp = numpy.sqrt(amp)+numpy.sqrt(amp+1)
+    data[:] = normalize_compress(amp.reshape((n, -1)), masksm.ravel()>0.5, True)
+
+def normalize_compress(flat, sel, var_one=True):
+    ''' Normalize each row to zero mean (and unit variance) over the masked
+    pixels and keep only those pixels, same as :py:func:`ndimage_utility.normalize_standard`
+    followed by :py:func:`ndimage_utility.compress_image`
+    
+    Args:
+        
+        flat : array
+               Flattened images, one per row
+        sel : array
+              Boolean mask of the valid pixels
+        var_one : bool
+                  Set False to disable variance one normalization
+    
+    Returns:
+        
+        out : array
+              Normalized valid pixels, one row per image
+    '''
+    
+    out = flat[:, sel]
+    valid = out.max(axis=1) != out.min(axis=1)
+    avg = numpy.where(valid, out.mean(axis=1), 0)
+    out -= avg[:, numpy.newaxis]
+    if var_one:
+        std = out.std(axis=1)
+        std[numpy.logical_or(std == 0, numpy.logical_not(valid))] = 1.0
+        out /= std[:, numpy.newaxis]
+    return out
+
 def classify_windows_experimental(mic, scoords, dust_sigma=4.0, xray_sigma=4.0, disable_threshold=False, remove_aggregates=False, pca_mode=0, iter_threshold=1, real_space_nstd=2.5, window=None, pixel_diameter=None, threshold_minimum=25, **extra):
     ''' Classify particle windows from non-particle windows
     
@@ -682,11 +849,11 @@ def classify_aggregates(scoords, offset, sel):
     '''
     
     cutoff = offset*2
-    coords = scoords[sel, 1:3]
-    off = numpy.argwhere(sel).squeeze()
-    dist = scipy.spatial.distance.squareform(scipy.spatial.distance.pdist(coords, 'euclidean'))
-    dist = numpy.unique(numpy.argwhere(numpy.logical_and(dist > 0, dist <= cutoff)).ravel())
-    sel[off[dist]] = 0
+    off = numpy.flatnonzero(sel)
+    i, j, d2 = spatial_index.pairs_within(scoords[off, 1:3], cutoff)
+    agg = d2 > 0
+    sel[off[i[agg]]] = 0
+    sel[off[j[agg]]] = 0
     return sel
 
 def remove_overlap(scoords, radius, sel):
@@ -704,21 +871,10 @@ def remove_overlap(scoords, radius, sel):
     
     '''
     
-    coords = scoords[:, 1:3]
-    i=0
     radius *= 1.1
-    idx = numpy.argwhere(sel).squeeze()
-    while i < len(idx):
-        dist = scipy.spatial.distance.cdist(coords[idx[i+1:]], coords[idx[i]].reshape((1, len(coords[idx[i]]))), metric='euclidean').ravel()
-        osel = dist < radius
-        if numpy.sum(osel) > 0:
-            if numpy.alltrue(scoords[idx[i], 0] > scoords[idx[i+1:], 0]):
-                sel[idx[i+1:][osel]]=0
-                idx = numpy.argwhere(sel).squeeze()
-            else:
-                sel[idx[i]]=0
-        else:
-            i+=1
+    idx = numpy.flatnonzero(sel)
+    keep = spatial_index.non_maximum_suppression(scoords[idx, 1:3], scoords[idx, 0], radius)
+    sel[idx[numpy.logical_not(keep)]]=0
 
 def write_example(mic, coords, filename, box_image="", bin_factor=1.0, pixel_diameter=None, window=None, **extra):
     ''' Write out an image with the particles boxed
@@ -824,6 +980,7 @@ def setup_options(parser, pgroup=None, main_option=False):
     group.add_option("",   disk_mult_range=[],          help="Experimental parameter to search range of template sizes")
     group.add_option("",   nstd_pw=4.0,                 help="Cutoff for Fourier space PCA")
     group.add_option("",   mask_mult=1.0,               help="Change the size of the real space PCA mask")
+    group.add_option("",   window_batch=256,            help="Number of particle windows processed together, trades memory for speed", gui=dict(minimum=1))
     
     pgroup.add_option_group(group)
     if main_option:
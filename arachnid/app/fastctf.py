@@ -230,9 +230,10 @@ def estimate_defocus_2D(powspec, astig_limit=5000.0, **extra):
     mask[:, :mask.shape[0]/2+beg]=0
     mask = numpy.nonzero(mask)
     
-    args = (powspec, mask, extra['ampcont'], extra['cs'], extra['voltage'], extra['apix'], extra.get('bfactor', 0))
-    defu, defv, defa = scipy.optimize.leastsq(model_fit_error_2d,[defu, defv, defa],args=args)[0]
-    error = numpy.sqrt(numpy.sum(numpy.square(model_fit_error_2d([defu, defv, defa], *args))))
+    model = ctf_model.CTFModel2D(powspec.shape, mask, extra['ampcont'], extra['cs'], extra['voltage'], extra['apix'], extra.get('bfactor', 0))
+    data = powspec[mask].ravel()
+    defu, defv, defa = scipy.optimize.leastsq(model.error,[defu, defv, defa],args=(data, ), Dfun=model.jacobian)[0]
+    error = numpy.sqrt(numpy.sum(numpy.square(model.error([defu, defv, defa], data))))
     return defu, defv, defa, error, beg, end, window
     
 def model_fit_error_2d(p, powspec, mask, ampcont, cs, voltage, apix, bfactor):
@@ -371,8 +372,8 @@ def esimate_defocus_range(powspec, awindow_size=64, overlap=0.9, **extra):
     roo = subtract_background(ppow.mean(axis=0), window)
     beg = first_zero(roo)
     end = energy_cutoff(roo[beg:])+beg
-    for i in xrange(len(raw)):
-        defocus[i] = estimate_1D(subtract_background(raw[i], window), beg, end, **extra)
+    roos = numpy.asarray([subtract_background(raw[i], window) for i in xrange(len(raw))])
+    defocus[:] = estimate_1D_batch(roos, beg, end, **extra)
     
     min_defocus = defocus.min()
     max_defocus = defocus.max()
@@ -587,6 +588,153 @@ def estimate_1D(roo, beg, end, ampcont, cs, voltage, apix, bfactor=0.0, defocus_
     dz1, = scipy.optimize.leastsq(model_fit_error_1d,p0,args=(roo, beg, end, ampcont, cs, voltage, apix, bfactor))[0]
     return dz1
     
+def estimate_1D_batch(roos, beg, end, ampcont, cs, voltage, apix, bfactor=0.0, defocus_start=0.1, defocus_end=8.0, maxiter=200, xtol=1.49012e-08, **extra):
+    ''' Find the defocus for a set of background-subtracted 1D power spectra
+    
+    This is a batched version of :py:func:`estimate_1D`: the squared error of every
+    line for every defocus on the grid is calculated as a single matrix
+    product, then the best defocus of each line is refined with Levenberg-Marquardt
+    iterations that update every line at once using the analytic derivative.
+    
+    :Parameters:
+        
+        roos : array
+               1D, background-subtracted power spectra, one per row
+        beg : int
+              Starting ring
+        end : int
+              Last ring
+        ampcont : float
+                  Amplitude contrast in percent
+        cs : float
+             Spherical abberation in mm
+        voltage : float
+                  Electron energy in kV
+        apix : float
+               Pixel size
+        bfactor : float
+                  Fall off in angstroms^2
+        defocus_start : float
+                        Start of the defocus search in microns
+        defocus_end : float
+                      End of the defocus search in microns
+        maxiter : int
+                  Maximum number of refinement iterations
+        xtol : float
+               Relative change in defocus that stops the refinement
+        extra : dict
+                Unused keyword arguments
+    
+    :Returns:
+        
+        defocus : array
+                  Defocus of each line
+    '''
+    
+    roos = numpy.asarray(roos, dtype=numpy.float)
+    freq = (numpy.arange(roos.shape[1], dtype=numpy.float)/float(roos.shape[1])/2.0)**2
+    freq = freq[beg:end]
+    data = roos[:, beg:end]
+    grid = numpy.arange(defocus_start, defocus_end, 0.1, dtype=numpy.float)*1e4
+    basis = ctf_model.transfer_function(freq[numpy.newaxis, :], grid[:, numpy.newaxis], ampcont, cs, voltage, apix, bfactor)**2
+    # |model-roo|^2 = |model|^2 - 2 roo.model + |roo|^2, the last term does not change the best defocus
+    err = numpy.square(basis).sum(axis=1)[numpy.newaxis, :] - 2*numpy.dot(data, basis.T)
+    p = grid[err.argmin(axis=1)]
+    
+    # Levenberg-Marquardt on all lines at once, each line has its own damping
+    args = (data, freq, ampcont, cs, voltage, apix, bfactor)
+    res = model_fit_error_1d_batch(p, *args)
+    err = numpy.square(res).sum(axis=1)
+    damping = numpy.zeros(len(p))+1e-3
+    active = numpy.ones(len(p), dtype=numpy.bool)
+    for i in xrange(maxiter):
+        jac = model_fit_jacobian_1d_batch(p, *args)
+        hess = numpy.square(jac).sum(axis=1)
+        hess[hess == 0] = 1.0
+        step = -(jac*res).sum(axis=1)/(hess*(1.0+damping))
+        step[~active] = 0
+        pn = p+step
+        resn = model_fit_error_1d_batch(pn, *args)
+        errn = numpy.square(resn).sum(axis=1)
+        better = numpy.logical_and(errn < err, active)
+        p[better], res[better], err[better] = pn[better], resn[better], errn[better]
+        damping[better] *= 0.1
+        damping[~better] *= 10.0
+        active = numpy.logical_and(numpy.abs(step) > xtol*(numpy.abs(p)+xtol), damping < 1e10)
+        if not numpy.any(active): break
+    return p
+
+def model_fit_error_1d_batch(p, data, freq, ampcont, cs, voltage, apix, bfactor):
+    ''' Compute the error between a set of 1D power spectra and the model CTF
+    
+    :Parameters:
+        
+        p : array
+            Defocus for each line
+        data : array
+               1D, background-subtracted power spectra in the valid range, one per row
+        freq : array
+               Squared radial frequency of each value in the valid range
+        ampcont : float
+                  Amplitude contrast in percent
+        cs : float
+             Spherical abberation in mm
+        voltage : float
+                  Electron energy in kV
+        apix : float
+               Pixel size
+        bfactor : float
+                  Fall off in angstroms^2
+    
+    :Returns:
+        
+        error : array
+                Error for each value (column) of each line (row)
+    '''
+    
+    model = ctf_model.transfer_function(freq[numpy.newaxis, :], numpy.asarray(p)[:, numpy.newaxis], ampcont, cs, voltage, apix, bfactor)**2
+    return model-data
+
+def model_fit_jacobian_1d_batch(p, data, freq, ampcont, cs, voltage, apix, bfactor):
+    ''' Compute the derivative of :py:func:`model_fit_error_1d_batch` with
+    respect to the defocus of each line
+    
+    :Parameters:
+        
+        p : array
+            Defocus for each line
+        data : array
+               1D, background-subtracted power spectra in the valid range, one per row
+        freq : array
+               Squared radial frequency of each value in the valid range
+        ampcont : float
+                  Amplitude contrast in percent
+        cs : float
+             Spherical abberation in mm
+        voltage : float
+                  Electron energy in kV
+        apix : float
+               Pixel size
+        bfactor : float
+                  Fall off in angstroms^2
+    
+    :Returns:
+        
+        jac : array
+              Derivative of each error (column) with respect to the defocus of its line (row)
+    '''
+    
+    p = numpy.asarray(p)[:, numpy.newaxis]
+    f0 = 1.0/apix
+    lam = 12.398 / numpy.sqrt(voltage * (1022.0 + voltage))
+    alpha = numpy.arctan((ampcont/(1.0-ampcont)))
+    k2 = -numpy.pi*lam*f0**2
+    k4 = 0.5*numpy.pi*lam**3*(cs*1e7)*f0**4
+    phase = k2*p*freq+k4*freq*freq-alpha
+    env = numpy.exp(-f0**2*bfactor*freq) if bfactor != 0.0 else 1.0
+    # d/dp (env*sin(phase))^2 = 2 env^2 sin(phase) cos(phase) k2 freq
+    return (env**2*numpy.sin(2*phase)*k2)*freq
+
 def generate_powerspectra(filename, bin_factor, window_size, overlap, pad=1, offset=0, from_power=False, **extra):
     ''' Generate a power spectra using a perdiogram
     
@@ -631,14 +779,15 @@ def _perdiogram(mic, window_size=256, pad=1, overlap=0.5, offset=0.1, shift=True
     rwin = ndimage_utility.rolling_window(mic[offset:mic.shape[0]-offset, offset:mic.shape[1]-offset], (window_size, window_size), (step, step))
     rwin = rwin.reshape((rwin.shape[0]*rwin.shape[1], rwin.shape[2], rwin.shape[3]))
     gwin=[]
-    for win in rwin:
+    for i, win in enumerate(rwin):
         win1 = win.copy()
         win1 = ndimage_utility.normalize_standard(win1)
         fstep = max(1, feature_size*overlap)
         fwin = ndimage_utility.rolling_window(win1, (feature_size, feature_size), (fstep, fstep))
-        if numpy.std(fwin, axis=0).min() > 0.5: gwin.append(win)
+        if numpy.std(fwin, axis=0).min() > 0.5: gwin.append(i)
     _logger.debug("Using %d of %d windows"%(len(gwin), len(rwin)))
-    return ndimage_utility.powerspec_avg(gwin, pad, shift)
+    avg, total = ndimage_utility.powerspec_batch(rwin, pad, numpy.asarray(gwin, dtype=numpy.int))
+    return ndimage_utility.powerspec_fin(avg, total, shift)
 
 def plot_scatter(output, x, x_label, y, y_label, dpi=72):
     ''' Plot a histogram of the distribution
@@ -243,7 +243,7 @@ def scf_center(img, template, mask):
     cc_map = lfc(img, template, mask)
     template = ndimage_utility.acf(template)
     map2 = lfc(cc_map, template, mask)
-    cc_map.mult(map2)
+    cc_map *= map2
     return cc_map
 
 def lfc(img, template, mask):
@@ -251,8 +251,8 @@ def lfc(img, template, mask):
     
     :Parameters:
             
-        img : array
-              Micrograph
+        img : array or MicrographSpectrum
+              Micrograph or its spectrum
         template : array
               Template
         mask : array
@@ -264,9 +264,8 @@ def lfc(img, template, mask):
                  Cross-correlation map
     '''
     
-    cc_map = ndimage_utility.cross_correlate(img, template)
-    cc_map /= ndimage_utility.local_variance(img, mask)
-    return cc_map
+    if not isinstance(img, ndimage_utility.MicrographSpectrum): img = ndimage_utility.MicrographSpectrum(img)
+    return img.lfc(template, mask)
 
 def read_micrograph(filename, bin_factor=1.0, sigma=1.0, disable_bin=False, invert=False, ds_kernel=None, **extra):
     ''' Read a micrograph from a file and perform preprocessing
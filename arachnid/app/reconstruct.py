@@ -40,6 +40,7 @@ def batch(files, image_file, output, rand_subset=0, experimental=False, experime
     
     if experimental: _logger.info("Experimental shared memory: enabled")
     if experimental_2d: _logger.info("Experimental 2D aligned images: enabled")
+    if extra.get('shared_volume', False): _logger.info("Threads share a single Fourier volume: enabled")
     if image_file: _logger.info("Using image file: %s"%image_file)
     if rand_subset: _logger.info("Drawing random subset: %d"%rand_subset)
     if extra['scale_spi']: _logger.info("Scaling translations for pySPIDER")
@@ -64,8 +65,6 @@ def batch(files, image_file, output, rand_subset=0, experimental=False, experime
     if rand_subset > 0:
         selection = numpy.random.choice(selection, rand_subset, False)
     curr_slice = mpi_utility.mpi_slice(len(align), **extra)
-    even = numpy.arange(0, len(selection[curr_slice]), 2, dtype=numpy.int)
-    odd = numpy.arange(1, len(selection[curr_slice]), 2, dtype=numpy.int)
     if isinstance(files, tuple):
         _logger.debug("Supports stacks with SPIDER filenames")
         image_file, label = files
@@ -75,8 +74,7 @@ def batch(files, image_file, output, rand_subset=0, experimental=False, experime
         idx = numpy.argsort(label[:, 0]).squeeze()
         label = label[idx].copy()
         align = align[idx].copy()
-        iter_single_images1 = ndimage_file.iter_images(image_file, label[even])
-        iter_single_images2 = ndimage_file.iter_images(image_file, label[odd])
+        iter_single_images = ndimage_file.iter_images(image_file, label[curr_slice])
         # todo support multiple spider prefixes
     else:
         _logger.debug("Supports stacks non-SPIDER filenames")
@@ -84,19 +82,17 @@ def batch(files, image_file, output, rand_subset=0, experimental=False, experime
             files = [files[i] for i in selection]
             align = align[selection].copy()
         
-        iter_single_images1 = ndimage_file.iter_images([files[i] for i in even])
-        iter_single_images2 = ndimage_file.iter_images([files[i] for i in odd])
+        iter_single_images = ndimage_file.iter_images(files[curr_slice])
     align_curr = align[curr_slice].copy()
     if negate_trans:
         align_curr[:, 4:6] = -align_curr[:, 4:6]
     #if neg_trans:
     #    align_curr[:, ]
-    align1 = align_curr[even]
-    align2 = align_curr[odd]
+    half = numpy.arange(len(align_curr), dtype=numpy.int)%2
     if experimental_2d:
-        vol = reconstruct.reconstruct3_bp3f_mp(image_size, iter_single_images1, iter_single_images2, align1, align2, process_image=preprocess_utility.phaseflip_align2d, shared=experimental, **extra)
+        vol = reconstruct.reconstruct3_bp3f_split_mp(image_size, iter_single_images, align_curr, half, process_image=preprocess_utility.phaseflip_align2d, shared=experimental, **extra)
     else:
-        vol = reconstruct.reconstruct3_bp3f_mp(image_size, iter_single_images1, iter_single_images2, align1, align2, process_image=preprocess_utility.phaseflip_shift, shared=experimental, **extra)
+        vol = reconstruct.reconstruct3_bp3f_split_mp(image_size, iter_single_images, align_curr, half, process_image=preprocess_utility.phaseflip_shift, shared=experimental, **extra)
     if vol is not None: 
         ndimage_file.write_image(output, vol[0].T.copy(), header=dict(apix=extra['apix']))
         ndimage_file.write_image(format_utility.add_prefix(output, 'h1_'), vol[1].T.copy(), header=dict(apix=extra['apix']))
@@ -113,6 +109,8 @@ def setup_options(parser, pgroup=None, main_option=False):
     group.add_option("-t",   thread_count=1,            help="Number of processes per machine", gui=dict(minimum=0), dependent=False)
     group.add_option("-r",   rand_subset=0,             help="Reconstruct a random subset of the given size", gui=dict(minimum=0), dependent=False)
     group.add_option("",     experimental=False,        help="Test experimental shared memory")
+    group.add_option("",     shared_volume=False,       help="Backproject with threads sharing a single Fourier volume, each updating its own z-planes, so memory does not grow with the number of threads")
+    group.add_option("",     max_memory=0.0,            help="Maximum memory in GB for the half volumes of all processes, each holding both half volumes, before switching to --shared-volume (0 means the physical memory)")
     group.add_option("",     experimental_2d=False,     help="Test 2d representation of alignment")
     group.add_option("",     class_index=0,             help="Select a specifc class within the alignment file")
     group.add_option("",     negate_trans=False,        help="Negate the translations")
@@ -12,4 +12,5 @@
     tracing
     file_processor
     progress
+    prefetch
 '''
\ No newline at end of file
@@ -103,6 +103,30 @@ program architecture.
     
     Test if the program will restart
 
+.. option:: --dynamic-schedule <bool>
+    
+    Hand out files to the MPI nodes on demand rather than in fixed blocks
+
+.. option:: --schedule-chunk <int>
+    
+    Number of files handed out per request with --dynamic-schedule (0 means the number of workers)
+
+.. option:: --root-process <bool>
+    
+    Root node also processes files with --dynamic-schedule
+
+.. option:: --prefetch <int>
+    
+    Number of input files to read ahead on background threads while processing (0 disables)
+
+.. option:: --prefetch-memory <float>
+    
+    Maximum megabytes of input files read ahead
+
+.. option:: --prefetch-threads <int>
+    
+    Number of threads reading input files ahead
+
 .. end-options
 
 ..todo:: 
@@ -128,6 +152,7 @@ program architecture.
 from ..parallel import mpi_utility
 from ..metadata import spider_utility
 import tracing
+import prefetch
 from progress import progress
 import multiprocessing
 import os
@@ -227,7 +252,10 @@ def main(files, module, **extra):
     current = 0
     _logger.debug("Start processing")
     ignored_errors=[0]
-    for index, filename in mpi_utility.mpi_reduce(process, files, init_process=init_process, ignored_errors=ignored_errors, **extra):
+    prefetcher=None
+    if extra.get('prefetch', 0) > 0:
+        prefetcher = prefetch.Prefetcher(extra['prefetch']+max(1, extra['worker_count']), extra.get('prefetch_memory', 1024), extra.get('prefetch_threads', 2))
+    for index, filename in mpi_utility.mpi_reduce(process, files, init_process=init_process, ignored_errors=ignored_errors, prefetcher=prefetcher, **extra):
         if mpi_utility.is_root(**extra):
             try:
                 monitor.update()
@@ -255,6 +283,7 @@ def main(files, module, **extra):
                     if spider_utility.is_spider_filename(filename): filename=spider_utility.spider_id(filename)
                     restart_fout.write(str(filename)+'\n')
                     restart_fout.flush()
+    if prefetcher is not None: prefetcher.close()
     if ignored_errors[0] > 0:
         see_also="\n\nSee .%s.crash_report for more details"%os.path.basename(sys.argv[0])
         _logger.warn("Errors occurred during run"+see_also)
@@ -408,6 +437,12 @@ def setup_options(parser, pgroup=None):
     group.add_option("",   force=False,       help="Force the program to run from the start", dependent=False)
     group.add_option("",   restart_test=False,help="Test if the program will restart", dependent=False)
     group.add_option("",   disable_restart_file=False,help="Disable restart file checking", dependent=False)
+    group.add_option("",   dynamic_schedule=False,help="Hand out files to the MPI nodes on demand rather than in fixed blocks", dependent=False)
+    group.add_option("",   schedule_chunk=0,  help="Number of files handed out per request with --dynamic-schedule (0 means the number of workers)", gui=dict(minimum=0), dependent=False)
+    group.add_option("",   root_process=False,help="Root node also processes files with --dynamic-schedule", dependent=False)
+    group.add_option("",   prefetch=0,        help="Number of input files to read ahead on background threads while processing (0 disables)", gui=dict(minimum=0), dependent=False)
+    group.add_option("",   prefetch_memory=1024.0, help="Maximum megabytes of input files read ahead", gui=dict(minimum=0), dependent=False)
+    group.add_option("",   prefetch_threads=2,help="Number of threads reading input files ahead", gui=dict(minimum=1), dependent=False)
     pgroup.add_option_group(group)
 
 def check_options(options):
@@ -0,0 +1,182 @@
+''' Read input files ahead of processing on background threads
+
+The prefetcher reads the next few input files on a small pool of I/O threads
+while the current files are being processed. The data is discarded after
+it is read; the goal is to pull the file into the page cache of the
+node, so the subsequent read by the (possibly separate) worker process
+does not wait on slow (e.g. network) storage.
+
+.. sourcecode:: py
+    
+    >>> from arachnid.core.app.prefetch import *
+    >>> prefetcher = Prefetcher(4, 1024)
+    >>> prefetcher.add(['mic_001.spi', 'mic_002.spi', 'mic_003.spi'])
+    >>> # Process mic_001.spi
+    >>> prefetcher.done('mic_001.spi')
+    >>> prefetcher.close()
+
+.. Created on Oct 17, 2026
+'''
+import threading
+import collections
+import logging
+import os
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+class Prefetcher(object):
+    ''' Read files ahead of processing on background threads
+    
+    :Parameters:
+    
+    count : int
+            Maximum number of files read ahead and not yet processed
+    memory : float
+             Maximum number of megabytes read ahead and not yet processed
+    thread_count : int
+                   Number of I/O threads
+    block_size : int
+                 Size of each read in bytes
+    '''
+    
+    def __init__(self, count, memory=1024, thread_count=2, block_size=8*1024*1024):
+        '''Start the I/O threads
+        '''
+        
+        self.count = max(1, count)
+        self.memory = memory*1024*1024
+        self.block_size = block_size
+        self.pending = collections.deque()
+        self.loaded = {}
+        self.used = 0
+        self.closed = False
+        self.cond = threading.Condition()
+        self.threads = []
+        for i in xrange(max(1, thread_count)):
+            thread = threading.Thread(target=self._worker)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+    
+    def __enter__(self):
+        '''Use the prefetcher in a with statement
+        '''
+        
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        '''Stop the I/O threads when leaving the with statement
+        '''
+        
+        self.close()
+    
+    def add(self, vals):
+        ''' Add input values in the order they will be processed
+        
+        :Parameters:
+        
+        vals : list
+               List of filenames, tuple groups or lists of filenames
+        '''
+        
+        self.cond.acquire()
+        try:
+            for val in vals:
+                self.pending.extend(input_files(val))
+            self.cond.notify_all()
+        finally: self.cond.release()
+    
+    def done(self, val):
+        ''' Mark an input value as processed, freeing its part of the budget
+        
+        :Parameters:
+        
+        val : object
+              Filename, tuple group or list of filenames
+        '''
+        
+        self.cond.acquire()
+        try:
+            for filename in input_files(val):
+                if filename in self.loaded:
+                    self.used -= self.loaded.pop(filename)
+                else:
+                    try: self.pending.remove(filename)
+                    except ValueError: pass
+            self.cond.notify_all()
+        finally: self.cond.release()
+    
+    def close(self):
+        ''' Stop the I/O threads
+        '''
+        
+        self.cond.acquire()
+        try:
+            self.closed = True
+            self.pending.clear()
+            self.cond.notify_all()
+        finally: self.cond.release()
+        for thread in self.threads: thread.join()
+        self.threads = []
+    
+    def _next(self):
+        ''' Wait for the next file that fits in the budget
+        
+        :Returns:
+        
+        filename : str
+                   Next file to read or None if closed
+        '''
+        
+        self.cond.acquire()
+        try:
+            while True:
+                if self.closed: return None
+                if len(self.pending) > 0 and len(self.loaded) < self.count:
+                    filename = self.pending[0]
+                    try: size = os.path.getsize(filename)
+                    except OSError: size = 0
+                    if len(self.loaded) == 0 or self.used+size <= self.memory:
+                        self.pending.popleft()
+                        self.loaded[filename] = size
+                        self.used += size
+                        return filename
+                self.cond.wait()
+        finally: self.cond.release()
+    
+    def _worker(self):
+        ''' Read files as long as the prefetcher is open
+        '''
+        
+        while True:
+            filename = self._next()
+            if filename is None: break
+            try:
+                fin = open(filename, 'rb')
+                try:
+                    while not self.closed and fin.read(self.block_size): pass
+                finally: fin.close()
+            except:
+                _logger.debug("Failed to prefetch: %s"%filename)
+
+def input_files(val):
+    ''' Get the existing files from an input value
+    
+    :Parameters:
+    
+    val : object
+          Filename, tuple group or list of filenames
+    
+    :Returns:
+    
+    files : list
+            List of filenames that exist
+    '''
+    
+    if isinstance(val, str): return [val] if os.path.isfile(val) else []
+    if isinstance(val, (tuple, list)):
+        files = []
+        for v in val: files.extend(input_files(v))
+        return files
+    return []
@@ -145,6 +145,14 @@ The following parameters are added to a script using the program architecture.
     
     Display the graphical user interface
 
+.. option:: --metadata-cache <BOOL>
+    
+    Cache parsed numeric metadata files in a binary sidecar file, which is read instead of the text file while it is unchanged
+
+.. option:: --metadata-cache-dir <FILENAME>
+    
+    Directory for the metadata cache files, empty means a hidden file next to each metadata file
+
 .. end-program-options
 .. beg-openmp-options
 
@@ -194,6 +202,7 @@ The following parameters are added to a script using the program architecture.
 import tracing
 import settings
 from ..parallel import mpi_utility, openmp
+from ..metadata import format
 from ..gui import autogui_loader
 import logging, sys, os, traceback,psutil
 import arachnid as root_module # TODO: This needs to be found in run_hybrid_program
@@ -259,6 +268,7 @@ def launch_program(main_module, main_template, args, options, parser, supports_O
     mpi_utility.mpi_init(param, **param)
     #_logger.removeHandler(_logger.handlers[0])
     tracing.configure_logging(**param)
+    if param.get('metadata_cache', False): format.enable_cache(param.get('metadata_cache_dir', ""))
     '''
     # do not use these anymore - consider removing
     for org in dependents:
@@ -1006,6 +1016,8 @@ def setup_program_options(parser, main_template, supports_MPI=False, supports_OM
     gen_group = settings.OptionGroup(parser, "General", "Options to general program features",  id=__name__)
     prg_group = settings.OptionGroup(parser, "Program", "Options to program features",  id=__name__)
     prg_group.add_option("",   prog_version=root_module.__version__, help="Select version of the program (set `latest` to use the lastest version`)")
+    prg_group.add_option("",   metadata_cache=False, help="Cache parsed numeric metadata files in a binary sidecar file, which is read instead of the text file while it is unchanged", dependent=False)
+    prg_group.add_option("",   metadata_cache_dir="", help="Directory for the metadata cache files, empty means a hidden file next to each metadata file", gui=dict(filetype="open"), dependent=False)
     if supports_MPI and mpi_utility.supports_MPI():
         group = settings.OptionGroup(parser, "MPI", "Options to control MPI",  id=__name__, dependent=False)
         group.add_option("",   use_MPI=False,          help="Set this flag True when using mpirun or mpiexec")
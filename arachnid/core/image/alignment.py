@@ -4,9 +4,15 @@
 .. codeauthor:: Robert Langlois <rl2528@columbia.edu>
 .. codeauthor:: Ryan Hyde Smith <rhs2132@columbia.edu>
 '''
+import collections
+import threading
 import numpy
 import scipy.fftpack
 
+_kernel_cache = collections.OrderedDict()
+_kernel_cache_size = 16
+_kernel_lock = threading.Lock()
+
 
 def xcorr_dft_peak(f1, f2, usfac, search_radius, y0=0, x0=0):
     '''
@@ -29,13 +35,7 @@ def _xcorr_dft_peak(f3, usfac, search_radius, y0=0, x0=0):
     .. codeauthor:: Ryan Hyde Smith <rhs2132@columbia.edu>
     '''
     
-    ny, nx = f3.shape
-    noyx = numpy.ceil(search_radius*usfac)
-    dftshift = numpy.fix(numpy.ceil(search_radius*usfac)/2)
-    yoff = dftshift - numpy.rint(usfac*y0)
-    xoff = dftshift - numpy.rint(usfac*x0)
-    kerny = numpy.exp((-2j*numpy.pi/(ny*usfac)*(numpy.arange(noyx).T - yoff)[:, numpy.newaxis])*(scipy.fftpack.ifftshift(numpy.arange(ny) - numpy.floor(ny/2)).T[numpy.newaxis, :]))
-    kernx = numpy.exp((-2j*numpy.pi/(nx*usfac)*(numpy.arange(noyx).T - xoff)[:, numpy.newaxis])*(scipy.fftpack.ifftshift(numpy.arange(nx) - numpy.floor(nx/2)).T[numpy.newaxis, :])).T
+    kerny, kernx, dftshift = dft_kernels(f3.shape, usfac, search_radius, y0, x0)
     CC = numpy.dot(numpy.dot(kerny, f3), kernx)
     dy, dx = numpy.unravel_index(numpy.argmax(CC), CC.shape)
     peak=CC[dy,dx].real
@@ -43,3 +43,186 @@ def _xcorr_dft_peak(f3, usfac, search_radius, y0=0, x0=0):
     dx = (float(dx) - dftshift)/usfac
     return dy, dx, peak
 
+def xcorr_dft_peaks(f3, usfac, search_radius, y0=0, x0=0):
+    ''' Find the upsampled cross-correlation peak for a stack of
+    cross-power spectra in one call
+    
+    This gives the same result as :py:func:`xcorr_dft_peak` for each
+    cross-power spectrum `f1*f2.conj()`.
+    
+    :Parameters:
+        
+        f3 : array
+             Stack of cross-power spectra (n, ny, nx)
+        usfac : int
+                Upsampling factor
+        search_radius : float
+                        Size of the search window
+        y0 : float or array
+             Center of the search window on the y-axis for all or each spectrum
+        x0 : float or array
+             Center of the search window on the x-axis for all or each spectrum
+    
+    :Returns:
+        
+        peaks : array
+                Peak (y, x, value) for each spectrum
+    '''
+    
+    f3 = numpy.asarray(f3)
+    y0 = numpy.zeros(len(f3))+y0
+    x0 = numpy.zeros(len(f3))+x0
+    y, x, p = _xcorr_dft_peaks(f3, min(2, usfac), search_radius, y0, x0)
+    y += y0
+    x += x0
+    if usfac > 2:
+        dy, dx, p = _xcorr_dft_peaks(f3, usfac, 1.5, y, x)
+        y += dy
+        x += dx
+    return numpy.column_stack((y, x, p))
+
+def _xcorr_dft_peaks(f3, usfac, search_radius, y0, x0):
+    ''' Find the upsampled cross-correlation peak for a stack of
+    cross-power spectra, each in its own window
+    
+    :Parameters:
+        
+        f3 : array
+             Stack of cross-power spectra (n, ny, nx)
+        usfac : int
+                Upsampling factor
+        search_radius : float
+                        Size of the search window
+        y0 : array
+             Center of the search window on the y-axis for each spectrum
+        x0 : array
+             Center of the search window on the x-axis for each spectrum
+    
+    :Returns:
+        
+        dy : array
+             Offset of each peak on the y-axis
+        dx : array
+             Offset of each peak on the x-axis
+        peak : array
+               Value of each peak
+    '''
+    
+    n, ny, nx = f3.shape
+    noyx = numpy.ceil(search_radius*usfac)
+    dftshift = numpy.fix(noyx/2)
+    basey, freqy = _dft_kernel(ny, usfac, noyx)
+    basex, freqx = _dft_kernel(nx, usfac, noyx)
+    yoff = dftshift - numpy.rint(usfac*y0)
+    xoff = dftshift - numpy.rint(usfac*x0)
+    if numpy.all(yoff == yoff[0]) and numpy.all(xoff == xoff[0]):
+        kerny = basey*_dft_phase(ny, usfac, yoff[0], freqy)
+        kernx = (basex*_dft_phase(nx, usfac, xoff[0], freqx)).T
+    else:
+        kerny = basey*_dft_phase(ny, usfac, yoff[:, numpy.newaxis], freqy)[:, numpy.newaxis, :]
+        kernx = (basex*_dft_phase(nx, usfac, xoff[:, numpy.newaxis], freqx)[:, numpy.newaxis, :]).transpose((0, 2, 1))
+    cc = numpy.matmul(numpy.matmul(kerny, f3), kernx).reshape((n, -1))
+    idx = cc.argmax(axis=1)
+    peak = cc[numpy.arange(n), idx].real
+    dy, dx = numpy.unravel_index(idx, (int(noyx), int(noyx)))
+    dy = (dy - dftshift)/usfac
+    dx = (dx - dftshift)/usfac
+    return dy, dx, peak
+
+def dft_kernels(shape, usfac, search_radius, y0=0, x0=0):
+    ''' Create the matrices for the upsampled DFT of a cross-correlation
+    spectrum in a window around (y0, x0)
+    
+    The upsampled cross-correlation is `numpy.dot(numpy.dot(kerny, f3), kernx)`. The
+    part of each matrix that does not depend on the window center is cached, so
+    a new center only costs a phase multiply.
+    
+    :Parameters:
+        
+        shape : tuple
+                Shape of the cross-correlation spectrum
+        usfac : int
+                Upsampling factor
+        search_radius : float
+                        Size of the search window
+        y0 : float
+             Center of the window on the y-axis
+        x0 : float
+             Center of the window on the x-axis
+    
+    :Returns:
+        
+        kerny : array
+                DFT matrix for the y-axis
+        kernx : array
+                DFT matrix for the x-axis
+        dftshift : float
+                   Offset of the center of the window in upsampled pixels
+    '''
+    
+    ny, nx = shape
+    noyx = numpy.ceil(search_radius*usfac)
+    dftshift = numpy.fix(noyx/2)
+    basey, freqy = _dft_kernel(ny, usfac, noyx)
+    basex, freqx = _dft_kernel(nx, usfac, noyx)
+    kerny = basey*_dft_phase(ny, usfac, dftshift - numpy.rint(usfac*y0), freqy)
+    kernx = (basex*_dft_phase(nx, usfac, dftshift - numpy.rint(usfac*x0), freqx)).T
+    return kerny, kernx, dftshift
+
+def _dft_kernel(n, usfac, noyx):
+    ''' Get the cached upsampled DFT matrix for one axis, centered on
+    the origin
+    
+    :Parameters:
+        
+        n : int
+            Length of the axis
+        usfac : int
+                Upsampling factor
+        noyx : float
+               Number of upsampled pixels in the window
+    
+    :Returns:
+        
+        kern : array
+               Read-only DFT matrix (noyx, n)
+        freq : array
+               Read-only frequency of each column
+    '''
+    
+    key = (n, usfac, noyx)
+    with _kernel_lock:
+        val = _kernel_cache.pop(key, None)
+        if val is not None: _kernel_cache[key] = val
+    if val is None:
+        freq = scipy.fftpack.ifftshift(numpy.arange(n) - numpy.floor(n/2))
+        kern = numpy.exp((-2j*numpy.pi/(n*usfac)*numpy.arange(noyx)[:, numpy.newaxis])*freq[numpy.newaxis, :])
+        kern.flags.writeable = False
+        freq.flags.writeable = False
+        val = (kern, freq)
+        with _kernel_lock:
+            _kernel_cache[key] = val
+            while len(_kernel_cache) > _kernel_cache_size: _kernel_cache.popitem(last=False)
+    return val
+
+def _dft_phase(n, usfac, off, freq):
+    ''' Phase that shifts the window of an upsampled DFT matrix
+    
+    :Parameters:
+        
+        n : int
+            Length of the axis
+        usfac : int
+                Upsampling factor
+        off : float or array
+              Offset of the window in upsampled pixels
+        freq : array
+               Frequency of each column
+    
+    :Returns:
+        
+        phase : array
+                Phase for each column
+    '''
+    
+    return numpy.exp((2j*numpy.pi/(n*usfac)*off)*freq)
@@ -173,6 +173,153 @@ def transfer_function_2D_full(n, defocus_u, defocus_v, defocus_ang, ampcont, cs,
     out[:] = transfer_function(out, defocus, ampcont, cs, voltage, apix, bfactor)
     return out
 
+class CTFModel2D(object):
+    ''' Astigmatic CTF model evaluated on a subset of the pixels of a 2D
+    power spectra
+    
+    The squared spatial frequency and the angle of each pixel in the mask are
+    computed once, so the model (squared CTF) and its analytic Jacobian with
+    respect to (defocus_u, defocus_v, defocus_ang) can be evaluated cheaply, e.g.
+    for `scipy.optimize.leastsq`:
+    
+    .. sourcecode:: py
+        
+        >>> model = CTFModel2D(powspec.shape, mask, ampcont, cs, voltage, apix)
+        >>> p = scipy.optimize.leastsq(model.error, p0, args=(powspec[mask],), Dfun=model.jacobian)[0]
+    
+    :Parameters:
+    
+    shape : tuple
+            Shape of the power spectra
+    mask : array
+           Boolean mask or index of the pixels to model
+    ampcont : float
+              Amplitude contrast in percent
+    cs : float
+         Spherical abberation in mm
+    voltage : float
+              Electron energy in kV
+    apix : float
+           Pixel size
+    bfactor : float
+              Fall off in angstroms^2
+    '''
+    
+    def __init__(self, shape, mask, ampcont, cs, voltage, apix, bfactor=0.0):
+        ''' Compute the frequency and angle of each pixel in the mask
+        '''
+        
+        if not isinstance(shape, tuple): shape = (shape, shape)
+        self.freq = ndimage_utility.radial_image_fft(shape, norm=True)[mask].ravel()
+        self.ang = ndimage_utility.angular_image(shape)[mask].ravel()
+        f0 = 1.0/apix
+        lam = 12.398 / numpy.sqrt(voltage * (1022.0 + voltage))
+        self.alpha = numpy.arctan((ampcont/(1.0-ampcont)))
+        self.k2 = numpy.pi*lam*f0**2
+        self.k4 = 0.5*numpy.pi*lam**3*(cs*1e7)*f0**4 if cs != 0.0 else 0.0
+        self.k4freq = self.k4*self.freq*self.freq-self.alpha
+        self.env = numpy.exp(-(f0**2*bfactor)*self.freq) if bfactor != 0.0 else None
+    
+    def defocus(self, p):
+        ''' Defocus of each pixel
+        
+        :Parameters:
+        
+        p : array
+            A 3-element array with defu, defv and defa
+        
+        :Returns:
+        
+        defocus : array
+                  Defocus of each pixel
+        cos2 : array
+               Cosine of twice the angle between each pixel and the minor axis
+        '''
+        
+        cos2 = numpy.cos(2.0*(numpy.deg2rad(p[2])-self.ang))
+        return 0.5*((p[0]+p[1]) + cos2*(p[0]-p[1])), cos2
+    
+    def phase(self, p):
+        ''' Phase of the CTF at each pixel
+        
+        :Parameters:
+        
+        p : array
+            A 3-element array with defu, defv and defa
+        
+        :Returns:
+        
+        phase : array
+                Phase of each pixel
+        cos2 : array
+               Cosine of twice the angle between each pixel and the minor axis
+        '''
+        
+        defocus, cos2 = self.defocus(p)
+        return (-defocus*self.k2)*self.freq+self.k4freq, cos2
+    
+    def model(self, p):
+        ''' Squared CTF at each pixel, same as the masked square of :py:func:`transfer_function_2D_full`
+        
+        :Parameters:
+        
+        p : array
+            A 3-element array with defu, defv and defa
+        
+        :Returns:
+        
+        model : array
+                Squared CTF of each pixel
+        '''
+        
+        h = numpy.sin(self.phase(p)[0])
+        if self.env is not None: h *= self.env
+        return h*h
+    
+    def error(self, p, data):
+        ''' Error between the model and the data
+        
+        :Parameters:
+        
+        p : array
+            A 3-element array with defu, defv and defa
+        data : array
+               Power spectra at each pixel in the mask
+        
+        :Returns:
+        
+        error : array
+                Error for each pixel
+        '''
+        
+        return self.model(p)-data
+    
+    def jacobian(self, p, data=None):
+        ''' Derivative of the error with respect to each parameter
+        
+        :Parameters:
+        
+        p : array
+            A 3-element array with defu, defv and defa
+        data : array
+               Unused, the Jacobian does not depend on the data
+        
+        :Returns:
+        
+        jac : array
+              Derivative (npixels, 3) of the error at each pixel
+        '''
+        
+        phase, cos2 = self.phase(p)
+        # d/d defocus (env*sin(phase))^2
+        dd = numpy.sin(2*phase)*(-self.k2)*self.freq
+        if self.env is not None: dd *= self.env*self.env
+        jac = numpy.empty((len(dd), 3))
+        jac[:, 0] = dd*0.5*(1.0+cos2)
+        jac[:, 1] = dd*0.5*(1.0-cos2)
+        jac[:, 2] = dd*(-(p[0]-p[1])*numpy.pi/180.0)*numpy.sin(2.0*(numpy.deg2rad(p[2])-self.ang))
+        return jac
+
 def model(defocus, sfreq, n, ampcont, cs, voltage, apix):
     ''' CTF model with non-generalized variables dependent on voltage
     
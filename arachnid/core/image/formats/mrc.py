@@ -172,23 +172,57 @@ ara2mrc=dict([(val, key) for key,val in mrc2ara.iteritems()])
 def create_header(shape, dtype, order='C', header=None):
     ''' Create a header for the MRC image format
     
-    @todo support header parameters
-    
     :Parameters:
     
     shape : tuple
             Shape of the array 
     dtype : numpy.dtype 
             Data type for NumPy ndarray
+    order : str
+            Order of the array (ignored)
     header : dict
              Header values  for image
     :Returns:
     
-    h : dtype
-        Data type for NumPy ndarray describing the header
+    h : array
+        Array with header information for the image
     '''
     
-    pass
+    h = numpy.zeros(1, header_image_dtype)
+    util.update_header(h, mrc_defaults, ara2mrc)
+    pix = header.get('apix', 1.0) if header is not None else 1.0
+    header=util.update_header(h, header, ara2mrc, 'mrc')
+    header['nx'] = shape[::-1][0]
+    header['ny'] = shape[::-1][1] if len(shape) > 1 else 1
+    if header['nz'] == 0:
+        header['nz'] = shape[2] if len(shape) > 2 else 1
+    header['mode'] = numpy2mrc[numpy.dtype(dtype).type]
+    header['mx'] = header['nx']
+    header['my'] = header['ny']
+    header['mz'] = header['nz']
+    header['xlen'] = header['nx']*pix
+    header['ylen'] = header['ny']*pix
+    header['zlen'] = header['nz']*pix
+    header['alpha'] = 90
+    header['beta'] = 90
+    header['gamma'] = 90
+    header['mapc'] = 1
+    header['mapr'] = 2
+    header['maps'] = 3
+    
+    header['map'] = 'MAP'
+    header['byteorder'] = byteorderint2[sys.byteorder] #'DA\x00\x00'
+    header['nlabels'] = 1
+    header['label0'] = 'Created by Arachnid'
+    
+    #header['byteorder'] = numpy.fromstring('\x44\x41\x00\x00', dtype=header['byteorder'].dtype)
+    
+    #header['rms'] = numpy.std(img)
+    if len(shape) == 3:
+        header['nxstart'] = header['nx'] / -2
+        header['nystart'] = header['ny'] / -2
+        header['nzstart'] = header['nz'] / -2
+    return header
 
 def array_from_header(header):
     ''' Convert header information to array parameters
@@ -456,6 +490,37 @@ def iter_images(filename, index=None, header=None, no_strict_mrc=False):
     finally:
         util.close(filename, f)
 
+def open_stack(filename, no_strict_mrc=False, **extra):
+    ''' Map the images in an MRC file to an array without reading
+    them into memory
+    
+    :Parameters:
+    
+    filename : str
+               Input filename
+    no_strict_mrc : bool
+                    Perform strict MRC header checking (recommended) - Only
+                    EPU MRC files and Yifan's frame alignment require this
+                    to be off.
+    extra : dict
+            Unused keyword arguments
+    
+    :Returns:
+    
+    out : numpy.memmap
+          Array of shape (nz, ny, nx) with the byte order of the file,
+          None if the file cannot be mapped
+    '''
+    
+    if not hasattr(filename, 'find') or os.path.splitext(filename)[1]=='.bz2': return None
+    h = read_mrc_header(filename, no_strict_mrc)
+    if int(h['mode'][0]) == 3: return None
+    dtype = numpy.dtype(mrc2numpy[h['mode'][0]]).newbyteorder(h.dtype['nx'].byteorder)
+    offset = 1024+int(h['nsymbt'])
+    shape = (int(h['nz'][0]), int(h['ny'][0]), int(h['nx'][0]))
+    if os.path.getsize(filename) != (offset+numpy.prod(shape)*dtype.itemsize): return None
+    return numpy.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape)
+
 def valid_image(filename, no_strict_mrc=False):
     ''' Test if the image is valid
     
@@ -619,43 +684,10 @@ def write_image(filename, img, index=None, header=None, inplace=False):
     mode = 'rb+' if index is not None and (index > 0 or inplace and index > -1) else 'wb+'
     f = util.uopen(filename, mode)
     if header is None or not hasattr(header, 'dtype') or not is_format_header(header):
-        h = numpy.zeros(1, header_image_dtype)
-        util.update_header(h, mrc_defaults, ara2mrc)
-        pix = header.get('apix', 1.0) if header is not None else 1.0
-        header=util.update_header(h, header, ara2mrc, 'mrc')
-        header['nx'] = img.T.shape[0]
-        header['ny'] = img.T.shape[1] if img.ndim > 1 else 1
-        if header['nz'] == 0:
-            header['nz'] = img.shape[2] if img.ndim > 2 else 1
-        header['mode'] = numpy2mrc[img.dtype.type]
-        header['mx'] = header['nx']
-        header['my'] = header['ny']
-        header['mz'] = header['nz']
-        header['xlen'] = header['nx']*pix
-        header['ylen'] = header['ny']*pix
-        header['zlen'] = header['nz']*pix
-        header['alpha'] = 90
-        header['beta'] = 90
-        header['gamma'] = 90
-        header['mapc'] = 1
-        header['mapr'] = 2
-        header['maps'] = 3
+        header = create_header(img.shape, img.dtype, header=header)
         header['amin'] = numpy.min(img)
         header['amax'] = numpy.max(img)
         header['amean'] = numpy.mean(img)
-        
-        header['map'] = 'MAP'
-        header['byteorder'] = byteorderint2[sys.byteorder] #'DA\x00\x00'
-        header['nlabels'] = 1
-        header['label0'] = 'Created by Arachnid'
-        
-        #header['byteorder'] = numpy.fromstring('\x44\x41\x00\x00', dtype=header['byteorder'].dtype)
-        
-        #header['rms'] = numpy.std(img)
-        if img.ndim == 3:
-            header['nxstart'] = header['nx'] / -2
-            header['nystart'] = header['ny'] / -2
-            header['nzstart'] = header['nz'] / -2
         if index is not None:
             stack_count = index+1
             header['nz'] = stack_count
@@ -665,14 +697,65 @@ def write_image(filename, img, index=None, header=None, inplace=False):
     
     try:
         if inplace:
-            f.seek(int(1024+int(h['nsymbt'])+index*img.ravel().shape[0]*img.dtype.itemsize))
+            f.seek(int(1024+int(header['nsymbt'])+index*img.ravel().shape[0]*img.dtype.itemsize))
         elif f != filename:
             f.seek(0)
             header.tofile(f)
-            if index > 0: f.seek(int(1024+int(h['nsymbt'])+index*img.ravel().shape[0]*img.dtype.itemsize))
+            if index > 0: f.seek(int(1024+int(header['nsymbt'])+index*img.ravel().shape[0]*img.dtype.itemsize))
         img.tofile(f)
     finally:
         util.close(filename, f)
+
+def write_images(f, imgs, index, header):
+    ''' Write a contiguous batch of images to an open MRC stack
+    
+    The intensity statistics in the header are updated assuming
+    the images before `index` have already been written.
+    
+    :Parameters:
+    
+    f : file object
+        Open stream for the stack
+    imgs : array
+           Array of images, first dimension is the image number
+    index : int
+            Index of the first image in the stack
+    header : array
+             Stack header from `create_header`
+    '''
+    
+    imgs = numpy.asarray(imgs, dtype=mrc2numpy[int(header['mode'][0])])
+    if index > 0:
+        header['amin'] = min(float(header['amin'][0]), numpy.min(imgs))
+        header['amax'] = max(float(header['amax'][0]), numpy.max(imgs))
+        header['amean'] = (float(header['amean'][0])*index + numpy.mean(imgs)*len(imgs))/(index+len(imgs))
+    else:
+        header['amin'] = numpy.min(imgs)
+        header['amax'] = numpy.max(imgs)
+        header['amean'] = numpy.mean(imgs)
+    f.seek(int(1024+int(header['nsymbt'])+index*imgs[0].ravel().shape[0]*imgs.dtype.itemsize))
+    imgs.tofile(f)
+
+def write_stack_header(f, header, count):
+    ''' Write the header of an open MRC stack and resize the
+    file to hold the given number of images
+    
+    :Parameters:
+    
+    f : file object
+        Open stream for the stack
+    header : array
+             Stack header from `create_header`
+    count : int
+            Number of images in the stack
+    '''
+    
+    header['nz'] = count
+    header['mz'] = count
+    header['zlen'] = count
+    f.seek(0)
+    header.tofile(f)
+    f.truncate(1024+int(header['nsymbt'])+count*int(header['nx'][0])*int(header['ny'][0])*numpy.dtype(mrc2numpy[int(header['mode'][0])]).itemsize)
         
 
 
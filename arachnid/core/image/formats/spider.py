@@ -61,23 +61,54 @@ header_dtype = _create_header_dtype()
 def create_header(shape, dtype, order='C', header=None):
     ''' Create a header for the SPIDER image format
     
-    @todo support header parameters
-    
     :Parameters:
     
     shape : tuple
             Shape of the array 
     dtype : numpy.dtype 
             Data type for NumPy ndarray
+    order : str
+            Order of the array (ignored)
     header : dict
              Header values  for image
     :Returns:
     
-    h : dtype
-        Data type for NumPy ndarray describing the header
+    h : array
+        Array with header information for the image
     '''
     
-    pass
+    h = numpy.zeros(1, header_dtype)
+    even = header['fourier_even'] if header is not None and 'fourier_even' in header else None
+    util.update_header(h, spi_defaults, ara2spi)
+    header=util.update_header(h, header, ara2spi, 'spi')
+    ndim = len(shape)
+    
+    # Image size in header
+    header['nx'] = shape[::-1][0]
+    header['ny'] = shape[::-1][1] if ndim > 1 else 1
+    header['nz'] = shape[::-1][2] if ndim > 2 else 1
+    
+    header['lenbyt'] = shape[0]*4
+    header['labrec'] = 1024 / int(header['lenbyt'])
+    if 1024%int(header['lenbyt']) != 0: 
+        header['labrec'] = int(header['labrec'])+1
+    header['labbyt'] = int(header['labrec'] ) * int(header['lenbyt'])
+    header['irec'] = header['labrec']+header['nx']
+    
+    if numpy.issubdtype(dtype, numpy.complexfloating):
+        header['iform'] = 3 if ndim == 3 else 1
+        # determine even or odd Fourier - assumes other dim are padded appropriately
+        if even is None:
+            v = int(round(float(shape[1])/shape[0]))
+            v = shape[1]/v
+            even = (v%2)==0
+        if even:
+            header['iform'] = -22  if ndim == 3 else -12 
+        else:
+            header['iform'] = -21  if ndim == 3 else -11 
+    else:
+        header['iform'] = 3 if ndim == 3 else 1 
+    return header
 
 def array_from_header(header):
     ''' Convert header information to array parameters
@@ -419,6 +450,47 @@ def iter_images(filename, index=None, header=None):
     finally:
         util.close(filename, f)
 
+def open_stack(filename, **extra):
+    ''' Map the images in a SPIDER file to an array without reading
+    them into memory
+    
+    The header is parsed once and the pixel data of every image is
+    exposed as a strided view of the file, which skips the interleaved
+    image headers. Indexing the returned array only touches the pages
+    holding the selected images.
+    
+    :Parameters:
+    
+    filename : str
+               Input filename
+    extra : dict
+            Unused keyword arguments
+    
+    :Returns:
+    
+    out : numpy.memmap
+          Array of shape (n, ny, nx) or (n, nz, ny, nx) with the byte
+          order of the file, None if the file cannot be mapped
+    '''
+    
+    if not hasattr(filename, 'find') or os.path.splitext(filename)[1]=='.bz2': return None
+    h = read_spider_header(filename)
+    if int(h['iform']) not in (1, 3): return None
+    dtype = h.dtype[0]
+    h_len = int(h['labbyt'])
+    d_len = int(h['nx']) * int(h['ny']) * int(h['nz'])
+    i_len = d_len * dtype.itemsize
+    count = count_images(h)
+    if int(h['nz']) > 1:   shape = (int(h['nz']), int(h['ny']), int(h['nx']))
+    elif int(h['ny']) > 1: shape = (int(h['ny']), int(h['nx']))
+    else:                  shape = (int(h['nx']), )
+    if int(h['istack']) > 0:
+        if os.path.getsize(filename) != (h_len + count * (h_len+i_len)): return None
+        dtype = numpy.dtype([('header', 'V%d'%h_len), ('data', dtype, shape)])
+        return numpy.memmap(filename, dtype=dtype, mode='r', offset=h_len, shape=(count, ))['data']
+    if count > 1 or os.path.getsize(filename) != (h_len + i_len): return None
+    return numpy.memmap(filename, dtype=dtype, mode='r', offset=h_len, shape=(1, )+shape)
+
 def count_images(filename):
     ''' Count the number of images in the file
     
@@ -488,44 +560,10 @@ def write_image(filename, img, index=None, header=None, inplace=False):
         raise
     try:
         if header is None or not hasattr(header, 'dtype') or not is_format_header(header):
-            h = numpy.zeros(1, header_dtype)
-            even = header['fourier_even'] if header is not None and 'fourier_even' in header else None
-            util.update_header(h, spi_defaults, ara2spi)
-            header=util.update_header(h, header, ara2spi, 'spi')
-            
-            # Image size in header
-            header['nx'] = img.T.shape[0]
-            header['ny'] = img.T.shape[1] if img.ndim > 1 else 1
-            header['nz'] = img.T.shape[2] if img.ndim > 2 else 1
-            
-            header['lenbyt'] = img.shape[0]*4
-            header['labrec'] = 1024 / int(header['lenbyt'])
-            if 1024%int(header['lenbyt']) != 0: 
-                header['labrec'] = int(header['labrec'])+1
-            header['labbyt'] = int(header['labrec'] ) * int(header['lenbyt'])
-            imgsize = img.ravel().shape[0]*4
-            headsize = int(header['labbyt'])
-            header['irec'] = header['labrec']+header['nx']
-            
-            # 
-            #header['irec']
-            if numpy.iscomplexobj(img):
-                header['iform'] = 3 if img.ndim == 3 else 1
-                # determine even or odd Fourier - assumes other dim are padded appropriately
-                if even is None:
-                    v = int(round(float(img.shape[1])/img.shape[0]))
-                    v = img.shape[1]/v
-                    even = (v%2)==0
-                if even:
-                    header['iform'] = -22  if img.ndim == 3 else -12 
-                else:
-                    header['iform'] = -21  if img.ndim == 3 else -11 
-            else:
-                header['iform'] = 3 if img.ndim == 3 else 1 
-        
-        fheader = numpy.zeros(int(header['labbyt'])/4, dtype=numpy.float32)
-        for name, idx in _header_map.iteritems(): 
-            fheader[idx-1]=float(header[name])
+            header = create_header(img.shape, img.dtype, header=header)
+        imgsize = img.ravel().shape[0]*4
+        headsize = int(header['labbyt'])
+        fheader = _header_record(header)
         
         if inplace:
             f.seek(index * (imgsize + headsize)+headsize+headsize)
@@ -546,6 +584,78 @@ def write_image(filename, img, index=None, header=None, inplace=False):
         util.close(filename, f)
 
 
+def write_images(f, imgs, index, header):
+    ''' Write a contiguous batch of images to an open SPIDER stack
+    
+    Each image is written with its own header in a single call.
+    
+    :Parameters:
+    
+    f : file object
+        Open stream for the stack
+    imgs : array
+           Array of images, first dimension is the image number
+    index : int
+            Index of the first image in the stack
+    header : array
+             Stack header from `create_header`
+    '''
+    
+    dtype = numpy.complex64 if int(header['iform']) < 0 else numpy.float32
+    fheader = _header_record(header)
+    fheader[_header_map['maxim']-1] = 0
+    fheader[_header_map['istack']-1] = 0
+    h_len = int(header['labbyt'])
+    rec = numpy.empty(len(imgs), dtype=[('header', numpy.float32, (fheader.shape[0], )), ('data', dtype, imgs.shape[1:])])
+    rec['header'] = fheader
+    rec['header'][:, _header_map['imgnum']-1] = numpy.arange(index+1, index+len(imgs)+1)
+    rec['data'] = imgs
+    f.seek(h_len + index * rec.itemsize)
+    rec.tofile(f)
+
+def write_stack_header(f, header, count):
+    ''' Write the header of an open SPIDER stack and resize the
+    file to hold the given number of images
+    
+    :Parameters:
+    
+    f : file object
+        Open stream for the stack
+    header : array
+             Stack header from `create_header`
+    count : int
+            Number of images in the stack
+    '''
+    
+    fheader = _header_record(header)
+    fheader[_header_map['maxim']-1] = count
+    fheader[_header_map['imgnum']-1] = count
+    fheader[_header_map['istack']-1] = 2
+    h_len = int(header['labbyt'])
+    i_len = int(header['nx']) * int(header['ny']) * int(header['nz']) * (8 if int(header['iform']) < 0 else 4)
+    f.seek(0)
+    fheader.tofile(f)
+    f.truncate(h_len + count * (h_len+i_len))
+
+def _header_record(header):
+    ''' Convert the header to the on-disk SPIDER header record
+    
+    :Parameters:
+    
+    header : array
+             Array with header information
+    
+    :Returns:
+    
+    fheader : array
+              Header record padded to `labbyt` bytes
+    '''
+    
+    fheader = numpy.zeros(int(header['labbyt'])/4, dtype=numpy.float32)
+    for name, idx in _header_map.iteritems(): 
+        fheader[idx-1]=float(header[name])
+    return fheader
+
 def file_size(fileobject):
     fileobject.seek(0,2) # move the cursor to the end of the file
     size = fileobject.tell()
@@ -83,4 +83,38 @@ def test_write_image():
     numpy.testing.assert_allclose(empty_image, eman_format.read_image(test_file))
     os.unlink(test_file)
 
+def test_open_stack():
+    '''
+    '''
+    
+    imgs = numpy.random.rand(3,78,200).astype('<f4')
+    for i in xrange(imgs.shape[0]):
+        mrc.write_image(test_file, imgs[i], i)
+    stack = mrc.open_stack(test_file)
+    assert(stack.shape == imgs.shape)
+    numpy.testing.assert_allclose(imgs, stack)
+    numpy.testing.assert_allclose(imgs[[2, 0]], stack[[2, 0]])
+    del stack
+    os.unlink(test_file)
+
+def test_write_images():
+    '''
+    '''
+    
+    imgs = numpy.random.rand(5,78,200).astype('<f4')
+    header = mrc.create_header(imgs.shape[1:], imgs.dtype)
+    f = open(test_file, 'wb+')
+    try:
+        mrc.write_stack_header(f, header, 8)
+        mrc.write_images(f, imgs[:2], 0, header)
+        mrc.write_images(f, imgs[2:], 2, header)
+        mrc.write_stack_header(f, header, len(imgs))
+    finally:
+        f.close()
+    assert(mrc.valid_image(test_file))
+    assert(mrc.count_images(test_file) == len(imgs))
+    numpy.testing.assert_allclose(imgs.mean(), mrc.read_mrc_header(test_file)['amean'][0], rtol=1e-5)
+    for i, img in enumerate(mrc.iter_images(test_file)):
+        numpy.testing.assert_allclose(imgs[i], img)
+    os.unlink(test_file)
 
@@ -114,5 +114,53 @@ def test_write_stack():
     finally:
         os.unlink(test_file)
 
+def test_open_stack():
+    '''
+    '''
+    
+    try:
+        imgs = numpy.random.rand(4,78,200).astype('<f4')
+        for i in xrange(imgs.shape[0]):
+            spider.write_image(test_file, imgs[i], i)
+        stack = spider.open_stack(test_file)
+        assert(stack.shape == imgs.shape)
+        numpy.testing.assert_allclose(imgs, stack)
+        numpy.testing.assert_allclose(imgs[[3, 1]], stack[[3, 1]])
+    finally:
+        os.unlink(test_file)
 
+def test_open_stack_single():
+    '''
+    '''
+    
+    try:
+        empty_image = numpy.random.rand(78,200).astype('<f4')
+        spider.write_image(test_file, empty_image)
+        stack = spider.open_stack(test_file)
+        assert(stack.shape == (1, )+empty_image.shape)
+        numpy.testing.assert_allclose(empty_image, stack[0])
+    finally:
+        os.unlink(test_file)
+
+def test_write_images():
+    '''
+    '''
+    
+    try:
+        imgs = numpy.random.rand(5,78,200).astype('<f4')
+        header = spider.create_header(imgs.shape[1:], imgs.dtype)
+        f = open(test_file, 'wb+')
+        try:
+            spider.write_stack_header(f, header, 8)
+            spider.write_images(f, imgs[:2], 0, header)
+            spider.write_images(f, imgs[2:], 2, header)
+            spider.write_stack_header(f, header, len(imgs))
+        finally:
+            f.close()
+        assert(spider.valid_image(test_file))
+        assert(spider.count_images(test_file) == len(imgs))
+        for i, img in enumerate(spider.iter_images(test_file)):
+            numpy.testing.assert_allclose(imgs[i], img)
+    finally:
+        os.unlink(test_file)
 
@@ -169,10 +169,10 @@ def array_from_header(header):
     
     dtype = numpy.dtype(header['dtype'][0]+str(header['byte_num'][0]))
     shape = (header['nx'][0], header['ny'][0], header['nz'][0])
-    if header_dtype.newbyteorder()[0]==header.dtype[0]: dtype = dtype.newbyteorder()
+    if header_dtype.newbyteorder()['nx']==header.dtype['nx']: dtype = dtype.newbyteorder()
     return (int(header_dtype.itemsize+int(header['extended'])),
            (imheader, dtype, numpy.prod(shape), shape, 
-           header_dtype.newbyteorder()[0]==header.dtype[0], header['order'][0],) )
+           header_dtype.newbyteorder()['nx']==header.dtype['nx'], header['order'][0],) )
 
 def cache_data():
     ''' Get keywords to be added as data cache
@@ -257,8 +257,8 @@ def is_readable(filename):
     
     if h['magic'] != 'WEBFORMAT': return False
     if not numpy.alltrue([h[v][0] > 0 for v in ('nx', 'ny', 'nz', 'count')]): return False
-    if h['dtype'][0] not in ('<', '>', '|'): return False
-    if h['dtype'][1] not in ('t', 'b', 'i', 'u', 'f', 'c', 'o', 'S', 'U', 'V'): return False
+    if h['dtype'][0][0] not in ('<', '>', '|'): return False
+    if h['dtype'][0][1] not in ('t', 'b', 'i', 'u', 'f', 'c', 'o', 'S', 'U', 'V'): return False
     if h['order'][0] not in ('C', 'F'): return False
     if not (h['byte_num'][0] > 0): return False
     return True
@@ -400,6 +400,34 @@ def iter_images(filename, index=None, header=None):
     finally:
         util.close(filename, f)
 
+def open_stack(filename, **extra):
+    ''' Map the images in a WEB file to an array without reading
+    them into memory
+    
+    :Parameters:
+    
+    filename : str
+               Input filename
+    extra : dict
+            Unused keyword arguments
+    
+    :Returns:
+    
+    out : numpy.memmap
+          Array with the number of images as the first dimension, None
+          if the file cannot be mapped
+    '''
+    
+    if not hasattr(filename, 'find') or os.path.splitext(filename)[1]=='.bz2': return None
+    h = read_web_header(filename)[0]
+    offset, ar_args = array_from_header(h)
+    dtype, dlen, shape, order = ar_args[1], ar_args[2], ar_args[3], ar_args[5]
+    if order != 'C': return None
+    count = int(h['count'][0])
+    if os.path.getsize(filename) != (offset + count * dlen * dtype.itemsize): return None
+    shape = tuple([int(s) for s in shape if s != 1])
+    return numpy.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=(count, )+shape)
+
 def is_writable(filename):
     ''' Test if the image extension of the given filename is understood
     as a writable format.
@@ -451,4 +479,43 @@ def write_image(filename, img, index=None, header=None, inplace=False):
     finally:
         util.close(filename, f)
 
+def write_images(f, imgs, index, header):
+    ''' Write a contiguous batch of images to an open WEB stack
+    
+    :Parameters:
+    
+    f : file object
+        Open stream for the stack
+    imgs : array
+           Array of images, first dimension is the image number
+    index : int
+            Index of the first image in the stack
+    header : array
+             Stack header from `create_header`
+    '''
+    
+    offset, ar_args = array_from_header(header)
+    imgs = numpy.asarray(imgs, dtype=ar_args[1])
+    f.seek(int(offset+index*ar_args[2]*imgs.dtype.itemsize))
+    imgs.tofile(f)
+
+def write_stack_header(f, header, count):
+    ''' Write the header of an open WEB stack and resize the
+    file to hold the given number of images
+    
+    :Parameters:
+    
+    f : file object
+        Open stream for the stack
+    header : array
+             Stack header from `create_header`
+    count : int
+            Number of images in the stack
+    '''
+    
+    header['count'] = count
+    offset, ar_args = array_from_header(header)
+    f.seek(0)
+    header.tofile(f)
+    f.truncate(int(offset+count*ar_args[2]*ar_args[1].itemsize))
 
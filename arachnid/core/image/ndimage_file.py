@@ -53,12 +53,16 @@ import ndimage_utility
 import numpy
 import logging
 import os
+import collections
 from formats.util import InvalidHeaderException
 InvalidHeaderException;
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
 
+_stack_cache = collections.OrderedDict()
+_stack_cache_size = 8
+
 def copy_local(filename, selection, local_file, **extra):
     ''' Copy a stack or set of stacks to a single stack on a remote drive.
     MPI only
@@ -175,6 +179,10 @@ def read_image(filename, index=None, **extra):
     
     if isinstance(filename, tuple): filename,index=filename
     filename = readlinkabs(filename)
+    if index is not None and extra.get('header') is None and not extra.get('force_volume', False):
+        stack = _cached_stack(filename, **extra)
+        if stack is not None and index >= 0 and index < len(stack):
+            return numpy.array(stack[index])
     read_format = get_read_format_except(filename)
     cache_keys = read_format.cache_data().keys()
     param = {}
@@ -287,9 +295,113 @@ def iter_images(filename, index=None, header=None):
     if index is not None and hasattr(index, '__iter__') and not hasattr(index, 'ndim'): index = numpy.asarray(index)
     filename = readlinkabs(filename)
     format = get_read_format_except(filename)
+    stack = _open_stack(filename, format)
+    if stack is not None and stack.dtype.isnative:
+        if header is not None: header.update(format.read_header(filename))
+        if index is None: index = 0
+        if not hasattr(index, '__iter__'): index = xrange(index, len(stack))
+        else:
+            index = index.astype(numpy.int)
+            if len(index) > 0 and index.min() < 0: raise ValueError, "Cannot have a negative index"
+            if len(index) > 0 and index.max() >= len(stack): raise IOError, "Index exceeds number of images in stack: %d < %d"%(index.max(), len(stack))
+        for i in index:
+            yield numpy.array(stack[i])
+        return
     for img in format.iter_images(filename, index, header):
         yield img
 
+def open_stack(filename, **extra):
+    ''' Map an image stack to an array without reading it into memory
+    
+    The header is parsed once and the images are paged in from the
+    file as they are accessed, so both random access and fancy indexing,
+    e.g. `stack[index_array]`, only read the selected images. The
+    returned array is read-only.
+    
+    .. sourcecode:: py
+        
+        stack = imfile.open_stack('stack.spi')
+        print "Number of images:", len(stack)
+        avg = stack[selection].mean(axis=0)
+    
+    :Parameters:
+        
+        filename : str
+                   Input filename to read
+        extra : dict
+                Unused keyword arguments
+    
+    :Returns:
+        
+        out : array
+              Array nxm1xm2 where n is the number of images, None
+              if the format does not support mapping
+    '''
+    
+    if isinstance(filename, tuple): filename = filename[0]
+    filename = readlinkabs(filename)
+    return _open_stack(filename, get_read_format_except(filename), **extra)
+
+def _open_stack(filename, format, **extra):
+    ''' Map an image stack using the given format
+    
+    :Parameters:
+        
+        filename : str
+                   Input filename to read
+        format : module
+                 Read format for the file
+        extra : dict
+                Unused keyword arguments
+    
+    :Returns:
+        
+        out : array
+              Array nxm1xm2 where n is the number of images, None
+              if the format does not support mapping
+    '''
+    
+    if not hasattr(format, 'open_stack'): return None
+    try:
+        return format.open_stack(filename, **extra)
+    except:
+        _logger.debug("Unable to map stack: %s"%filename, exc_info=True)
+        return None
+
+def _cached_stack(filename, **extra):
+    ''' Get a mapped stack for the given file from a small cache
+    
+    Entries are invalidated when the size or modification time of the
+    file changes.
+    
+    :Parameters:
+        
+        filename : str
+                   Input filename to read
+        extra : dict
+                Unused keyword arguments
+    
+    :Returns:
+        
+        out : array
+              Array nxm1xm2 where n is the number of images, None
+              if the format does not support mapping or the byte 
+              order is not native
+    '''
+    
+    stat = os.stat(filename)
+    key = (stat.st_size, stat.st_mtime)
+    if filename in _stack_cache:
+        stamp, stack = _stack_cache.pop(filename)
+        if stamp == key:
+            _stack_cache[filename] = (stamp, stack)
+            return stack
+    stack = _open_stack(filename, get_read_format_except(filename), **extra)
+    if stack is not None and not stack.dtype.isnative: stack = None
+    _stack_cache[filename] = (key, stack)
+    while len(_stack_cache) > _stack_cache_size: _stack_cache.popitem(last=False)
+    return stack
+
 def count_images(filename):
     ''' Count the number of images in the file
     
@@ -399,6 +511,138 @@ def write_stack(filename, imgs):
         format.write_image(filename, img, index)
         index += 1
 
+class StackWriter(object):
+    ''' Write a stack of images through a single open file
+    
+    Images are collected into a contiguous buffer and written in large
+    batches, the stack header is written once when the writer is closed
+    and, when the number of images is known in advance, the file is 
+    preallocated. Formats without a stack writer (e.g. EMAN2 formats) are
+    written one image at a time with the format's `write_image`.
+    
+    .. sourcecode:: py
+        
+        with imfile.StackWriter('stack.spi', len(windows), header=dict(apix=apix)) as writer:
+            for win in windows:
+                writer.write(win)
+    
+    :Parameters:
+    
+    filename : str
+               Output filename for the stack
+    count : int, optional
+            Expected number of images used to preallocate the file
+    header : dict, optional
+             Header dictionary
+    buffer_size : int
+                  Size of the write buffer in megabytes
+    '''
+    
+    def __init__(self, filename, count=0, header=None, buffer_size=32):
+        ''' Create a writer for the given filename
+        '''
+        
+        self.format = get_write_format(filename)
+        if self.format is None: 
+            raise IOError, "Could not find format for extension of %s"%filename
+        self.filename = filename
+        self.count = count
+        self.header = header
+        self.buffer_size = buffer_size
+        self.fd = None
+        self.stack_header = None
+        self.buffer = None
+        self.start = 0
+        self.size = 0
+        self.total = 0
+    
+    def __enter__(self):
+        ''' Enter the context of the writer
+        '''
+        
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        ''' Close the writer when leaving the context
+        '''
+        
+        self.close()
+        return False
+    
+    def write(self, img, index=None):
+        ''' Add an image to the stack
+        
+        :Parameters:
+        
+        img : array
+              Image data to write out
+        index : int, optional
+                Index image should be written to in the stack, if None
+                the image follows the last one written
+        '''
+        
+        if index is None: index = self.start+self.size
+        if not hasattr(self.format, 'write_images'):
+            self.format.write_image(self.filename, img, index, self.header)
+            self.start = index+1
+            return
+        if self.fd is None: self._open(img, index)
+        if self.size == len(self.buffer) or index != (self.start+self.size) or img.shape != self.buffer.shape[1:]:
+            self.flush()
+            if img.shape != self.buffer.shape[1:]:
+                raise ValueError, "Image shape does not match stack: %s != %s"%(str(img.shape), str(self.buffer.shape[1:]))
+            self.start = index
+        self.buffer[self.size] = img
+        self.size += 1
+    
+    def flush(self):
+        ''' Write the buffered images to the file
+        '''
+        
+        if self.size == 0: return
+        self.format.write_images(self.fd, self.buffer[:self.size], self.start, self.stack_header)
+        self.total = max(self.total, self.start+self.size)
+        self.start += self.size
+        self.size = 0
+    
+    def close(self):
+        ''' Write the remaining images, update the stack header and
+        close the file
+        '''
+        
+        if self.fd is None: return
+        try:
+            self.flush()
+            self.format.write_stack_header(self.fd, self.stack_header, self.total)
+        finally:
+            self.fd.close()
+            self.fd = None
+            self.buffer = None
+    
+    def _open(self, img, index):
+        ''' Open the file and create the stack header and buffer
+        based on the first image
+        
+        :Parameters:
+        
+        img : array
+              First image written to the stack
+        index : int
+                Index of the first image
+        '''
+        
+        if index > 0 and os.path.exists(self.filename):
+            self.fd = open(self.filename, 'rb+')
+            self.total = index
+        else:
+            self.fd = open(self.filename, 'wb+')
+        self.stack_header = self.format.create_header(img.shape, img.dtype, header=self.header)
+        if self.count > self.total:
+            self.format.write_stack_header(self.fd, self.stack_header, self.count)
+        batch = max(1, int(self.buffer_size*1048576/max(1, img.nbytes)))
+        self.buffer = numpy.empty((batch, )+img.shape, dtype=img.dtype)
+        self.start = index
+
 def get_write_format(filename):
     ''' Get the write format for the image
     
@@ -12,6 +12,8 @@ SPIDER: http://www.wadsworth.org/spider_doc/spider/docs/spider.html
 from ..app import tracing
 import logging, numpy
 import scipy.fftpack
+import collections
+import threading
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
@@ -22,6 +24,17 @@ try:
 except:
     _spider_filter=None
     tracing.log_import_error('Failed to load _spider_filter.so module', _logger)
+
+try:
+    import pyfftw #@UnresolvedImport
+    pyfftw;
+except:
+    pyfftw=None
+
+_cache = collections.OrderedDict()
+_cache_size = 32
+_cache_max_bytes = 512*1024*1024
+_cache_lock = threading.Lock()
     
 def histogram_match(img, mask, ref, bins=0, iter_max=500, out=None):
     ''' Adjust the image intensity to match a standard reference, e.g. noise image
@@ -406,7 +419,7 @@ def gaussian_lowpass(img, low_cutoff, pad=1):
     else: img = img.astype(ctype)
     state = numpy.geterr()
     numpy.seterr(all='ignore')
-    img = filter_image(img, gaussian_lowpass_kernel(img.shape, low_cutoff, img.dtype), pad)
+    img = _filter_image(img, _cached_kernel(gaussian_lowpass_kernel, img.shape, low_cutoff, img.dtype), True)
     if pad > 1: img = depad(img, shape)
     numpy.seterr(**state)
     return img
@@ -472,7 +485,7 @@ def gaussian_highpass(img, high_cutoff, pad=1):
     else: img = img.astype(ctype)
     state = numpy.geterr()
     numpy.seterr(all='ignore')
-    img = filter_image(img, gaussian_highpass_kernel(img.shape, high_cutoff, img.dtype), pad)
+    img = _filter_image(img, _cached_kernel(gaussian_highpass_kernel, img.shape, high_cutoff, img.dtype), True)
     numpy.seterr(**state)
     if pad > 1: img = depad(img, shape)
     return img
@@ -533,24 +546,181 @@ def filter_annular_bp(img, freq1, freq2, pad=1):
         shape = img.shape
         img = pad_image(img.astype(ctype), (int(img.shape[0]*pad), int(img.shape[1]*pad)), 'e')
     else: img = img.astype(ctype)
-    img = filter_image(img, filter_annular_bp_kernel(img.shape, img.dtype, freq1, freq2), pad)
+    img = _filter_image(img, _cached_kernel(filter_annular_bp_kernel, img.shape, img.dtype, freq1, freq2), True)
     if pad > 1: img = depad(img, shape)
     return img
 
 def filter_image(img, kernel, pad=1):
+    ''' Filter an image with a centered Fourier space kernel
+    
+    :Parameters:
+    
+    img : array
+          Image to filter
+    kernel : array
+             Kernel with the origin in the center
+    pad : int
+          Unused
+    
+    :Returns:
+    
+    out : array
+          Filtered image
     '''
+    
+    return _filter_image(img, scipy.fftpack.ifftshift(kernel))
+
+def _filter_image(img, kernel, overwrite=False):
+    ''' Filter an image with a Fourier space kernel with the origin
+    in the corner (i.e. shifted with `ifftshift`)
+    
+    If pyFFTW is available, the transforms are performed with cached plans
+    and buffers.
+    
+    :Parameters:
+    
+    img : array
+          Image to filter
+    kernel : array
+             Kernel with the origin in the corner
+    overwrite : bool
+                Allow the input image to be overwritten
+    
+    :Returns:
+    
+    out : array
+          Filtered image
     '''
     
+    plan = _fft_plan(img.shape, img.dtype) if pyfftw is not None else None
+    if plan is not None:
+        forward, inverse, buf, fbuf = plan
+        buf[...] = img
+        forward()
+        numpy.multiply(fbuf, kernel, fbuf)
+        inverse()
+        return buf.real.copy()
+    fimg = scipy.fftpack.fftn(img, overwrite_x=overwrite)
+    numpy.multiply(fimg, kernel, fimg)
+    return scipy.fftpack.ifftn(fimg, overwrite_x=True).real.copy()
+
+def _cached_kernel(kernel_func, shape, *args):
+    ''' Get a kernel shifted with `ifftshift` from the cache or create it
     
+    :Parameters:
     
-    if img.ndim == 2:
-        fimg = scipy.fftpack.fftshift(scipy.fftpack.fft2(img))
-        numpy.multiply(fimg, kernel, fimg)
-        return scipy.fftpack.ifft2(scipy.fftpack.ifftshift(fimg)).real.copy()
-    else:
-        fimg = scipy.fftpack.fftshift(scipy.fftpack.fftn(img))
-        numpy.multiply(fimg, kernel, fimg)
-        return scipy.fftpack.ifftn(scipy.fftpack.ifftshift(fimg)).real.copy()
+    kernel_func : function
+                  Function that creates the kernel, e.g. :py:func:`gaussian_lowpass_kernel`
+    shape : tuple
+            Shape of the kernel
+    args : list
+           Additional arguments to `kernel_func`, e.g. cutoff and data type
+    
+    :Returns:
+    
+    kernel : array
+             Read-only kernel with the origin in the corner
+    '''
+    
+    shape = tuple(shape)
+    key = (kernel_func.__name__, shape)+args
+    kernel = _cache_get(key)
+    if kernel is None:
+        kernel = scipy.fftpack.ifftshift(kernel_func(shape, *args))
+        kernel.flags.writeable = False
+        _cache_put(key, kernel)
+    return kernel
+
+def _fft_plan(shape, dtype):
+    ''' Get pyFFTW plans and aligned buffers for a complex transform
+    from the cache or create them
+    
+    Plans are cached separately for each thread as they share buffers.
+    
+    :Parameters:
+    
+    shape : tuple
+            Shape of the image
+    dtype : dtype
+            Complex data type of the image
+    
+    :Returns:
+    
+    plan : tuple
+           Forward and inverse plans as well as the image and Fourier buffers,
+           None if the data type is not complex
+    '''
+    
+    dtype = numpy.dtype(dtype)
+    if dtype.kind != 'c': return None
+    key = ('fftw', tuple(shape), dtype.str, threading.current_thread().ident)
+    plan = _cache_get(key)
+    if plan is None:
+        if hasattr(pyfftw, 'empty_aligned'):
+            buf = pyfftw.empty_aligned(shape, dtype=dtype)
+            fbuf = pyfftw.empty_aligned(shape, dtype=dtype)
+        else:
+            buf = pyfftw.n_byte_align_empty(shape, pyfftw.simd_alignment, dtype)
+            fbuf = pyfftw.n_byte_align_empty(shape, pyfftw.simd_alignment, dtype)
+        axes = tuple(range(len(shape)))
+        forward = pyfftw.FFTW(buf, fbuf, axes=axes, direction='FFTW_FORWARD', flags=('FFTW_MEASURE', ))
+        inverse = pyfftw.FFTW(fbuf, buf, axes=axes, direction='FFTW_BACKWARD', flags=('FFTW_MEASURE', ))
+        plan = (forward, inverse, buf, fbuf)
+        _cache_put(key, plan)
+    return plan
+
+def _cache_get(key):
+    ''' Get a value from the LRU cache
+    
+    :Parameters:
+    
+    key : tuple
+          Key of the value
+    
+    :Returns:
+    
+    val : object
+          Cached value or None
+    '''
+    
+    with _cache_lock:
+        val = _cache.pop(key, None)
+        if val is not None: _cache[key] = val
+    return val
+
+def _cache_put(key, val):
+    ''' Add a value to the LRU cache, removing the least recently used
+    values when the cache exceeds the maximum number of entries or bytes
+    
+    :Parameters:
+    
+    key : tuple
+          Key of the value
+    val : object
+          Array or tuple of arrays to cache
+    '''
+    
+    with _cache_lock:
+        _cache[key] = val
+        while len(_cache) > 1 and (len(_cache) > _cache_size or sum([_cache_nbytes(v) for v in _cache.itervalues()]) > _cache_max_bytes):
+            _cache.popitem(last=False)
+
+def _cache_nbytes(val):
+    ''' Estimate the memory used by a cached value
+    
+    :Parameters:
+    
+    val : object
+          Array or tuple of arrays
+    
+    :Returns:
+    
+    nbytes : int
+             Number of bytes held by the arrays
+    '''
+    
+    if isinstance(val, tuple): return sum([_cache_nbytes(v) for v in val])
+    return getattr(val, 'nbytes', 0)
 
 def pad_image(img, shape, fill=0.0, out=None):
     ''' Pad an image with zeros
@@ -758,15 +928,22 @@ def depad_image_2d(img, shape, out=None):
     return out
 
 def grid_image(shape, center=None):
-    '''
+    ''' Create a coordinate grid, the read-only result is cached
     '''
     
     if not hasattr(shape, '__iter__'): shape = (shape, shape)
     if center is None: cx, cy = shape[0]/2, shape[1]/2
     elif not hasattr(center, '__iter__'): cx, cy = center, center
     else: cx, cy = center
-    y, x = numpy.ogrid[-cx: shape[0]-cx, -cy: shape[1]-cy]
-    return x, y
+    key = ('grid_image', shape[0], shape[1], cx, cy)
+    grid = _cache_get(key)
+    if grid is None:
+        y, x = numpy.ogrid[-cx: shape[0]-cx, -cy: shape[1]-cy]
+        x.flags.writeable = False
+        y.flags.writeable = False
+        grid = (x, y)
+        _cache_put(key, grid)
+    return grid
 
 def radial_image(shape, center=None):
     '''
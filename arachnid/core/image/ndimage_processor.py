@@ -40,9 +40,14 @@ def create_matrix_from_file(images, image_processor, dtype=numpy.float, **extra)
     
     img = image_processor(img1, 0, **extra).ravel()
     total = len(images[1]) if isinstance(images, tuple) else len(images)
-    mat = numpy.zeros((total, img.shape[0]), dtype=dtype)
-    for row, data in process_tasks.for_process_mp(ndimage_file.iter_images(images), image_processor, img1.shape, queue_limit=100, **extra):
-        mat[row, :] = data.ravel()[:img.shape[0]]
+    if extra.get('thread_count', 0) > 1:
+        mat = process_tasks.create_shmem_array((total, img.shape[0]), dtype=dtype)
+    else: mat = numpy.zeros((total, img.shape[0]), dtype=dtype)
+    try:
+        for row, data in process_tasks.for_process_mp(ndimage_file.iter_images(images), image_processor, img1.shape, queue_limit=100, out=mat, **extra):
+            pass
+    finally:
+        mat = process_tasks.release_shmem_array(mat)
     openmp.set_thread_count(extra.get('thread_count', 1))
     return mat
 
@@ -70,9 +75,14 @@ def image_array_from_file(images, image_processor, dtype=numpy.float, **extra):
     
     img = image_processor(img1, 0, **extra)
     total = len(images[1]) if isinstance(images, tuple) else len(images)
-    mat = numpy.zeros((total, img.shape[0], img.shape[1]), dtype=dtype)
-    for row, data in process_tasks.for_process_mp(ndimage_file.iter_images(images), image_processor, img1.shape, queue_limit=100, **extra):
-        mat[row, :] = data
+    if extra.get('thread_count', 0) > 1:
+        mat = process_tasks.create_shmem_array((total, img.shape[0], img.shape[1]), dtype=dtype)
+    else: mat = numpy.zeros((total, img.shape[0], img.shape[1]), dtype=dtype)
+    try:
+        for row, data in process_tasks.for_process_mp(ndimage_file.iter_images(images), image_processor, img1.shape, queue_limit=100, out=mat, **extra):
+            pass
+    finally:
+        mat = process_tasks.release_shmem_array(mat)
     return mat
 
 _cache_header = numpy.dtype([('magic', 'S10'), ('dtype', 'S3'), ('byte_num', numpy.int16), ('ndim', numpy.int32), ])
@@ -33,6 +33,12 @@ except:
     tracing.log_import_error('Failed to load _image_utility.so module - certain functions will not be available', _logger)
     _image_utility=None
 
+try:
+    import pyfftw.interfaces.numpy_fft as fftw_numpy_fft #@UnresolvedImport
+    fftw_numpy_fft;
+except:
+    fftw_numpy_fft=None
+
 def mirror(img, out=None):
     ''' Mirror projection (SPIDER convention)
     
@@ -735,6 +741,190 @@ def cross_correlate(img, template, phase=False, out=None):
     
     return scipy.fftpack.fftshift(cross_correlate_raw(img, template, phase, out))
 
+class MicrographSpectrum(object):
+    ''' Fourier transform of a micrograph and of its square, computed once
+    and reused for cross-correlation, local variance and locally normalized
+    cross-correlation maps
+    
+    Every map is the same as the corresponding function, e.g. :py:func:`cross_correlate`
+    and :py:func:`local_variance`, but the micrograph is only transformed once.
+    
+    .. sourcecode:: py
+        
+        >>> spec = MicrographSpectrum(mic)
+        >>> cc_map = spec.lfc(template, mask)
+    
+    :Parameters:
+    
+    img : array
+          Micrograph
+    '''
+    
+    def __init__(self, img):
+        ''' Transform the micrograph
+        '''
+        
+        self.img = img
+        self.shape = img.shape
+        self.dtype = img.dtype
+        self.fimg = scipy.fftpack.fft2(img)
+        self._fimg2 = None
+    
+    def fimg2(self):
+        ''' Fourier transform of the squared micrograph, computed on first use
+        
+        :Returns:
+        
+        fimg2 : array
+                Fourier transform of the squared micrograph
+        '''
+        
+        if self._fimg2 is None: self._fimg2 = scipy.fftpack.fft2(numpy.square(self.img))
+        return self._fimg2
+    
+    def correlate_raw(self, ftemplate, fimg=None):
+        ''' Cross-correlate the micrograph with a template spectrum
+        
+        :Parameters:
+        
+        ftemplate : array
+                    Conjugate template spectra, see :py:func:`template_spectrum`
+        fimg : array, optional
+               Spectrum to correlate, defaults to the micrograph
+        
+        :Returns:
+        
+        cc : array
+             Cross-correlation map with the origin at the corner
+        '''
+        
+        if fimg is None: fimg = self.fimg
+        return scipy.fftpack.ifft2(fimg*ftemplate, overwrite_x=True).real.astype(self.dtype)
+    
+    def cross_correlate(self, template):
+        ''' Cross-correlate the micrograph with a template, same as :py:func:`cross_correlate`
+        
+        :Parameters:
+        
+        template : array
+                   Small template to search with
+        
+        :Returns:
+        
+        cc : array
+             Cross-correlation map (same dim as micrograph)
+        '''
+        
+        return scipy.fftpack.fftshift(self.correlate_raw(template_spectrum(template, self.shape, self.dtype)))
+    
+    def local_variance(self, mask):
+        ''' Esimtate the local variance on the micrograph, under the given mask,
+        same as :py:func:`local_variance`
+        
+        :Parameters:
+        
+        mask : array
+               Small mask under which to estimate variance
+        
+        :Returns:
+        
+        cc : array
+             Local variance map (same dim as micrograph)
+        '''
+        
+        tot = numpy.sum(mask>0)
+        mask=normalize_standard(mask, mask, True)*(mask>0)
+        fmask = template_spectrum(mask, self.shape, self.dtype)
+        img2 = self.correlate_raw(fmask, self.fimg2())
+        avg = self.correlate_raw(fmask).astype(mask.dtype)
+        numpy.divide(avg, tot, avg)
+        numpy.square(avg, avg)
+        numpy.subtract(img2, avg, img2)
+        del avg
+        img2[img2<=0]=9e20
+        numpy.sqrt(img2, img2)
+        return scipy.fftpack.fftshift(img2)
+    
+    def lfc(self, template, mask):
+        ''' Locally normalized fast cross-correlation
+        
+        :Parameters:
+        
+        template : array
+                   Template
+        mask : array
+               Mask for variance map
+        
+        :Returns:
+        
+        cc_map : array
+                 Cross-correlation map
+        '''
+        
+        cc_map = self.cross_correlate(template)
+        cc_map /= self.local_variance(mask)
+        return cc_map
+
+def template_spectrum(template, shape, dtype=numpy.float32):
+    ''' Calculate the conjugate spectrum of a template padded to the size
+    of the image to match
+    
+    :Parameters:
+    
+    template : array
+               Small template to search with
+    shape : tuple
+            Shape of the large image
+    dtype : dtype
+            Data type of the large image
+    
+    :Returns:
+    
+    ftemplate : array
+                Conjugate of the Fourier transform of the padded template
+    '''
+    
+    return scipy.fftpack.fft2(pad_image(template.astype(dtype), shape)).conj()
+
+def cross_correlate_bank(img, ftemplates, phase=False):
+    ''' Cross-correlate an image with a bank of templates, keeping the
+    maximum over templates at each pixel
+    
+    The image is transformed once and each template only costs a product and
+    an inverse transform. Each correlation map is the same as :py:func:`cross_correlate`.
+    
+    :Parameters:
+    
+    img : array
+          Large image to match
+    ftemplates : list
+                 Conjugate template spectra, see :py:func:`template_spectrum`
+    phase : bool
+            Use phase correlation
+    
+    :Returns:
+    
+    cc : array
+         Maximum cross-correlation over templates (same dim as large image)
+    index : array
+            Index of the template with the maximum at each pixel
+    '''
+    
+    fimg = scipy.fftpack.fft2(img)
+    cc = None
+    index = numpy.zeros(img.shape, dtype=numpy.int)
+    for i, ftemplate in enumerate(ftemplates):
+        fp1 = fimg*ftemplate
+        if phase: fp1 /= numpy.abs(fp1)
+        cur = scipy.fftpack.fftshift(scipy.fftpack.ifft2(fp1, overwrite_x=True).real).astype(img.dtype)
+        if cc is None:
+            cc = cur
+            continue
+        sel = cur > cc
+        cc[sel] = cur[sel]
+        index[sel] = i
+    return cc, index
+
 def local_variance(img, mask, out=None):
     ''' Esimtate the local variance on the image, under the given mask
     
@@ -753,23 +943,7 @@ def local_variance(img, mask, out=None):
          Local variance map (same dim as large image)    
     '''
     
-    tot = numpy.sum(mask>0)
-    mask=normalize_standard(mask, mask, True)*(mask>0)
-    mask = pad_image(mask, img.shape)
-    shape = img.shape
-    img2 = numpy.square(img)
-    img2[:,:] = cross_correlate_raw(img2, mask)
-    '''numpy.divide(img2, tot, img2)'''
-    mask[:,:] = cross_correlate_raw(img, mask)
-    del img
-    numpy.divide(mask, tot, mask)
-    numpy.square(mask, mask)
-    numpy.subtract(img2, mask, img2)
-    del mask
-    img2[img2<=0]=9e20
-    numpy.sqrt(img2, img2)
-    img2[:,:] = scipy.fftpack.fftshift(img2)
-    return depad_image(img2, shape, out)
+    return depad_image(MicrographSpectrum(img).local_variance(mask), img.shape, out)
 
 def rolling_window(array, window=(0,), asteps=None, wsteps=None, intersperse=False):
     """Create a view of `array` which for every point gives the n-dimensional
@@ -981,7 +1155,33 @@ def multitaper_power_spectra(mic, half_nbw=9, low_bias=False, shift=True):
 """
 
 def perdiogram(mic, window_size=256, pad=1, overlap=0.5, offset=0.1, shift=True, ret_more=False):
-    '''
+    ''' Calculate an averaged power spectra over overlapping windows of a
+    micrograph
+    
+    The windows are views of the micrograph, which are transformed in
+    batches by :py:func:`powerspec_batch`.
+    
+    :Parameters:
+    
+    mic : array
+          Micrograph image
+    window_size : int
+                  Size of each window
+    pad : int
+          Number of times to pad each window
+    overlap : float
+              Fraction of overlap between windows
+    offset : float
+             Offset from the edge of the micrograph in pixels or fraction of the size
+    shift : bool
+            Shift the origin to the center of the power spectra
+    ret_more : bool
+               Return the number of windows as well
+    
+    :Returns:
+    
+    avg_powspec : array
+                  Averaged power spectra
     '''
     
     if offset > 0 and offset < 1.0: offset = int(offset*mic.shape[0])
@@ -1057,6 +1257,82 @@ def powerspec_sum(imgs, pad, avg=None, total=0.0, do_ramp=False):
         total += 1.0
     return avg, total
 
+def powerspec_batch(imgs, pad, index=None, avg=None, total=0.0, batch_size=16, thread_count=1):
+    ''' Sum the power spectra of a stack of windows in batches
+    
+    This gives the same sum as :py:func:`powerspec_sum` without copying or padding
+    each window separately: a batch of windows is normalized in single precision,
+    transformed with a single real-to-complex FFT (zero padded to the
+    final size) and only the power is accumulated. The edge-average
+    padding only changes the zero frequency, which is corrected analytically.
+    
+    :Parameters:
+    
+    imgs : array
+           Stack of windows (n, ny, nx), e.g. a view created by :py:func:`rolling_window`
+    pad : int
+          Number of times to pad an image
+    index : array, optional
+            Index of the windows to use, all windows if None
+    avg : array, optional
+          Sum of power spectra to add to
+    total : float
+            Number of power spectra in `avg`
+    batch_size : int
+                 Number of windows transformed together
+    thread_count : int
+                   Number of threads for the FFT (requires pyFFTW)
+    
+    :Returns:
+    
+    avg : array
+          Sum of power spectra
+    total : float
+            Number of power spectra in the sum
+    '''
+    
+    if pad is None or pad <= 0: pad = 1
+    ny, nx = imgs.shape[1:]
+    pad_width = ny*pad
+    count = len(imgs) if index is None else len(index)
+    if count == 0: return avg, total
+    psum = numpy.zeros((pad_width, pad_width/2+1))
+    buf = numpy.empty((min(batch_size, count), ny, nx), dtype=numpy.float32)
+    for beg in xrange(0, count, batch_size):
+        end = min(beg+batch_size, count)
+        win = buf[:end-beg]
+        win[:] = imgs[beg:end] if index is None else imgs[index[beg:end]]
+        mean = win.mean(axis=(1, 2), dtype=numpy.float)
+        std = win.std(axis=(1, 2), dtype=numpy.float)
+        std[std == 0] = 1.0
+        win -= mean.astype(numpy.float32)[:, numpy.newaxis, numpy.newaxis]
+        win /= std.astype(numpy.float32)[:, numpy.newaxis, numpy.newaxis]
+        if pad_width != ny or pad_width != nx:
+            # Edge-average fill used by pad_image(..., 'e')
+            fill = (win[:, 0, :].sum(axis=1, dtype=numpy.float)+win[:, :, 0].sum(axis=1, dtype=numpy.float)+
+                    win[:, ny-1, :].sum(axis=1, dtype=numpy.float)+win[:, :, nx-1].sum(axis=1, dtype=numpy.float))/(ny*2+nx*2-4)
+            win -= fill.astype(numpy.float32)[:, numpy.newaxis, numpy.newaxis]
+        if fftw_numpy_fft is not None:
+            fimg = fftw_numpy_fft.rfft2(win, (pad_width, pad_width), threads=max(1, thread_count))
+        else:
+            fimg = numpy.fft.rfft2(win, (pad_width, pad_width))
+        pow = fimg.real**2
+        pow += fimg.imag**2
+        if pad_width != ny or pad_width != nx:
+            pow[:, 0, 0] = (fill*(pad_width*pad_width-ny*nx))**2
+        psum += pow.sum(axis=0)
+    
+    # Expand half spectrum using Hermitian symmetry
+    half = psum.shape[1]
+    full = numpy.empty((pad_width, pad_width))
+    full[:, :half] = psum
+    if pad_width > half:
+        rows = (-numpy.arange(pad_width))%pad_width
+        full[:, half:] = psum[rows][:, pad_width-numpy.arange(half, pad_width)]
+    if avg is None: avg = full
+    else: avg += full
+    return avg, total+count
+
 def powerspec_fin(avg, total, shift=True):
     '''
     '''
@@ -1072,7 +1348,7 @@ def powerspec_avg(imgs, pad, shift=True):
     :Parameters:
     
     imgs : iterable
-           Iterator of images
+           Iterator of images, a stack of windows is transformed in batches
     pad : int
           Number of times to pad an image
     
@@ -1082,7 +1358,10 @@ def powerspec_avg(imgs, pad, shift=True):
                   Averaged power spectra
     '''
     
-    avg, total = powerspec_sum(imgs, pad)
+    if isinstance(imgs, numpy.ndarray) and imgs.ndim == 3:
+        avg, total = powerspec_batch(imgs, pad)
+    else:
+        avg, total = powerspec_sum(imgs, pad)
     return powerspec_fin(avg, total, shift)
 
 def moving_average(img, window=3, out=None):
@@ -1643,8 +1922,9 @@ def dog(img, pixel_radius, dog_width=1.2, out=None):
     
     img : numpy.ndarray
           Input image
-    pixel_radius : int
-                   Radius of the particle in pixels
+    pixel_radius : int or tuple
+                   Radius of the particle in pixels, or a radius for each axis
+                   (e.g. (0, r, r) to filter each image in a stack)
     dog_width : float
                 Width of the difference of Gaussian
     out : numpy.ndarray
@@ -1665,8 +1945,12 @@ def dog(img, pixel_radius, dog_width=1.2, out=None):
     '''
     
     kfact = math.sqrt( (dog_width**2 - 1.0) / (2.0 * dog_width**2 * math.log(dog_width)) )
-    sigma1 = (kfact * pixel_radius)
-    sigmaDiff = sigma1*math.sqrt(dog_width*dog_width-1.0)
+    if hasattr(pixel_radius, '__len__'):
+        sigma1 = tuple([kfact * r for r in pixel_radius])
+        sigmaDiff = tuple([s*math.sqrt(dog_width*dog_width-1.0) for s in sigma1])
+    else:
+        sigma1 = (kfact * pixel_radius)
+        sigmaDiff = sigma1*math.sqrt(dog_width*dog_width-1.0)
     #sigma1 = math.sqrt(sigma1**2 + sigmaDiff**2)
     dlst = scipy.ndimage.gaussian_filter(img, sigma=sigma1)
     dnxt = scipy.ndimage.gaussian_filter(dlst, sigma=sigmaDiff)# C3100-08393194-001
@@ -1880,6 +2164,43 @@ def replace_outlier(img, dust_sigma, xray_sigma=None, replace=None, out=None):
     out[img < vsmin]=vsmin
     return out
 
+def replace_outlier_stack(imgs, dust_sigma, xray_sigma=None):
+    ''' Clamp outlier pixels in each image of a stack, in-place
+    
+    The statistics of every image are calculated at once, and only images with
+    outlier pixels are passed to :py:func:`replace_outlier`, so the result (and the
+    sequence of random numbers) is the same as calling it on each image.
+    
+    :Parameters:
+    
+    imgs : numpy.ndarray
+           Stack of images
+    dust_sigma : float
+                 Number of standard deviations for black pixels
+    xray_sigma : float
+                 Number of standard deviations for white pixels
+    
+    :Returns:
+    
+    imgs : numpy.ndarray
+           Stack of images
+    '''
+    
+    flat = imgs.reshape((len(imgs), -1))
+    avg = flat.mean(axis=1)
+    std = flat.std(axis=1)
+    vmin = flat.min(axis=1)
+    vmax = flat.max(axis=1)
+    if xray_sigma is None: xray_sigma=dust_sigma if dust_sigma > 0 else -dust_sigma
+    lcut = avg-std*abs(dust_sigma)
+    hcut = avg+std*xray_sigma
+    # Compare with a margin, so rounding differences with the per-image statistics cannot skip an image
+    eps = 1e-6*(numpy.abs(avg)+std)
+    sel = numpy.logical_and(vmin != vmax, numpy.logical_or(vmin < lcut+eps, vmax > hcut-eps))
+    for i in numpy.flatnonzero(sel):
+        replace_outlier(imgs[i], dust_sigma, xray_sigma, None, imgs[i])
+    return imgs
+
 @_em2numpy2em
 def crop_window(img, x, y, offset, out=None):
     ''' Extract a square window from an image
@@ -2138,6 +2459,43 @@ def for_each_window(mic, coords, window, bin_factor=1.0):
         yield npdata
     raise StopIteration
 
+def crop_windows(img, coords, window, bin_factor=1.0, out=None):
+    ''' Extract a stack of square windows from a micrograph, one for
+    each coordinate
+    
+    Windows that extend past the edge of the micrograph wrap around to
+    the opposite edge, as in :py:func:`crop_window`.
+    
+    :Parameters:
+    
+    img : numpy.ndarray
+          Micrograph image
+    coords : list
+             List of coordinates to center of particle
+    window : int
+             Size of the window to be cropped
+    bin_factor : float
+                 Number of times to downsample the coordinates
+    out : numpy.ndarray
+          Output stack of windows
+    
+    :Returns:
+    
+    out : numpy.ndarray
+          Stack of windows (n, window, window)
+    '''
+    
+    if len(coords) > 0 and hasattr(coords[0], 'x'):
+        xy = numpy.asarray([(float(c.x), float(c.y)) for c in coords])
+    else:
+        xy = numpy.asarray(coords, dtype=numpy.float).reshape((len(coords), -1))[:, 1:3]
+    xy = (xy/bin_factor).astype(numpy.int)-int(window/2)
+    rows = numpy.mod(xy[:, 1, numpy.newaxis]+numpy.arange(window), img.shape[0])
+    cols = numpy.mod(xy[:, 0, numpy.newaxis]+numpy.arange(window), img.shape[1])
+    if out is None: out = numpy.zeros((len(xy), window, window))
+    out[:] = img[rows[:, :, numpy.newaxis], cols[:, numpy.newaxis, :]]
+    return out
+
 def flatten_solvent(img, threshold=None, out=None):
     ''' Flatten the solven around the structure
     
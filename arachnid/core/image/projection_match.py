@@ -0,0 +1,539 @@
+''' Projection matching against a set of reference projections
+
+This module defines an in-process replacement for SPIDER's AP SH. Each
+reference projection is transformed into polar coordinates and its ring FFT
+is computed once. For every particle and every translation in the search range,
+the particle is sampled on the same polar grid (centered on the translation)
+and correlated against all references at every in-plane rotation with a
+single batched inverse FFT. Optionally, the mirror of the particle is also tested.
+
+The result for each particle follows the layout of the SPIDER AP SH alignment
+document:
+    
+    epsi,theta,phi,ref_num,id,psi,tx,ty,nproj,ang_diff,cc_rot,spsi,sx,sy,mirror
+
+where `psi`, `tx` and `ty` rotate then translate the particle (the same convention as
+:py:func:`rotate.rotate_image`) to match the reference. When the best match is
+mirrored, the reference number is negative, THETA is replaced by 180-THETA and
+PHI by PHI+180, and the rotation and translation apply to the original
+(unmirrored) particle.
+
+.. sourcecode:: py
+    
+    >>> from arachnid.core.image.projection_match import *
+    >>> vals = align_to_references(particles, refs, ref_angles, trans_range=6, ring_last=30)
+    >>> vals[:, 3] # Best reference for each particle
+    >>> bank = PolarReferenceBank(refs.shape[1:], ring_last=30)
+    >>> bank.add(refs)
+    >>> angle, score, index = bank.score(particles[0])
+
+.. Created on Oct 17, 2026
+'''
+import reproject
+import logging
+import numpy
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+def align_to_volume(vol, ref_angles, particles, out=None, pj_radius=-1, pixel_diameter=None, max_ref_proj=300, **extra):
+    ''' Align each particle to the projections of a volume
+    
+    The reference projections are generated in batches of `max_ref_proj` and only
+    their polar spectra are kept.
+    
+    :Parameters:
+    
+    vol : array
+          Reference volume
+    ref_angles : array
+                 Euler angles (n,3) of each reference projection as PSI, THETA, PHI
+    particles : iterable
+                Array or iterable of particle images
+    out : array, optional
+          Alignment values updated in place, see :py:func:`align_to_references`
+    pj_radius : float
+                Radius of sphere to compute projection, if less than one use 0.69 times the
+                diameter of the object in pixels
+    pixel_diameter : int
+                     Diameter of the particle in pixels
+    max_ref_proj : int
+                   Maximum number of reference projections in memory
+    extra : dict
+            Keyword arguments for :py:func:`align_to_references`
+    
+    :Returns:
+    
+    out : array
+          Alignment values for each particle
+    '''
+    
+    ref_angles = numpy.asarray(ref_angles, dtype=numpy.float32).reshape((-1, 3))
+    if pj_radius is None or pj_radius < 1:
+        if pixel_diameter is None: raise ValueError, "Either pj_radius or pixel_diameter must be set"
+        pj_radius = 0.69 * pixel_diameter
+    vol = numpy.asarray(vol, dtype=numpy.float32)
+    bank = PolarReferenceBank(vol.shape[1:], len(ref_angles), pixel_diameter=pixel_diameter, **extra)
+    for beg in xrange(0, len(ref_angles), max(1, max_ref_proj)):
+        end = min(beg+max(1, max_ref_proj), len(ref_angles))
+        bank.add(reproject.reproject_3q(vol, int(pj_radius), numpy.ascontiguousarray(ref_angles[beg:end])))
+    return align_to_bank(particles, bank, ref_angles, out, **extra)
+
+def align_to_references(particles, refs, ref_angles, out=None, pixel_diameter=None, **extra):
+    ''' Align each particle to a set of reference projections
+    
+    :Parameters:
+    
+    particles : iterable
+                Array or iterable of particle images
+    refs : array
+           Reference projections (n, ny, nx)
+    ref_angles : array
+                 Euler angles (n,3) of each reference projection as PSI, THETA, PHI
+    out : array, optional
+          Alignment values (at least 14 columns) updated in place, where a row
+          is only replaced if the new correlation (column 10) is larger in magnitude.
+          The id (column 4) and mirror (column 14) columns are not changed.
+    pixel_diameter : int
+                     Diameter of the particle in pixels, sets the last ring if `ring_last` is 0
+    extra : dict
+            Keyword arguments for :py:func:`polar_grid` and :py:func:`align_to_bank`
+    
+    :Returns:
+    
+    out : array
+          Alignment values for each particle, see module documentation for the layout
+    '''
+    
+    refs = numpy.asarray(refs)
+    bank = PolarReferenceBank(refs.shape[1:], len(refs), pixel_diameter=pixel_diameter, **extra)
+    bank.add(refs)
+    return align_to_bank(particles, bank, ref_angles, out, **extra)
+
+def align_to_bank(particles, bank, ref_angles, out=None, trans_range=24, trans_step=1, test_mirror=True, prev=None, ref_offset=0, block_size=2**22, **extra):
+    ''' Align each particle to the references in a bank
+    
+    :Parameters:
+    
+    particles : iterable
+                Array or iterable of particle images
+    bank : PolarReferenceBank
+           Bank of reference projections
+    ref_angles : array
+                 Euler angles (n,3) of each reference projection as PSI, THETA, PHI
+    out : array, optional
+          Alignment values updated in place, see :py:func:`align_to_references`
+    trans_range : int
+                  Maximum allowed translation, lowered if the last ring plus the translation
+                  exceeds the image
+    trans_step : int
+                 Translation step size
+    test_mirror : bool
+                  If true, test the mirror position of the projection
+    prev : array, optional
+           Previous in-plane rotation and translation (n,3) as PSI, TX, TY already
+           applied to each particle, the reported alignment then includes it
+    ref_offset : int
+                 Offset added to the reference number
+    block_size : int
+                 Maximum number of correlation values computed at once
+    extra : dict
+            Unused keyword arguments
+    
+    :Returns:
+    
+    out : array
+          Alignment values for each particle, see module documentation for the layout
+    '''
+    
+    ref_angles = numpy.asarray(ref_angles, dtype=numpy.float).reshape((-1, 3))
+    if trans_range > bank.max_shift:
+        _logger.debug("Lowering translation range from %d to %d"%(trans_range, bank.max_shift))
+        trans_range = bank.max_shift
+    shifts = shift_grid(trans_range, trans_step)
+    mirrors = (False, True) if test_mirror else (False, )
+    
+    full = out is None
+    if full:
+        if not hasattr(particles, '__len__'): particles = list(particles)
+        out = numpy.zeros((len(particles), 15))
+        out[:, 4] = numpy.arange(1, len(particles)+1)
+    
+    for i, img in enumerate(particles):
+        best = None
+        for mirror in mirrors:
+            angle, score, index = bank.score(img, shifts, mirror, block_size)
+            r = numpy.argmax(score)
+            if best is None or score[r] > best[0]: best = (score[r], angle[r], index[r], r, mirror)
+        cc, ang, s, r, mirror = best
+        sx, sy = shifts[s]
+        if mirror:
+            ang = -ang
+            sx = -sx
+        # Align the particle by rotating by ang then translating by -R(-ang)s
+        rad = numpy.deg2rad(ang)
+        ca, sa = numpy.cos(rad), numpy.sin(rad)
+        tx = -(ca*sx + sa*sy)
+        ty = -(-sa*sx + ca*sy)
+        if prev is not None:
+            tx += ca*prev[i][1] + sa*prev[i][2]
+            ty += -sa*prev[i][1] + ca*prev[i][2]
+            ang += prev[i][0]
+        ang = numpy.mod(ang+180.0, 360.0)-180.0
+        epsi, theta, phi = ref_angles[r]
+        if mirror: theta, phi = 180.0-theta, numpy.mod(phi+180.0, 360.0)
+        ref_num = (ref_offset+r+1)*(-1 if mirror else 1)
+        if not full and abs(cc) <= abs(out[i, 10]): continue
+        out[i, :4] = (epsi, theta, phi, ref_num)
+        out[i, 5:14] = (ang, tx, ty, len(bank), 0.0, cc, ang, tx, ty)
+        if full: out[i, 14] = mirror
+    return out
+
+class PolarReferenceBank(object):
+    ''' Bank of reference images stored as the ring FFT of their polar transform
+    
+    The conjugate ring FFT of every reference is kept in one contiguous
+    float32 buffer (pairs of real and imaginary parts), so a particle is compared
+    to all references at every in-plane rotation with a single batched
+    correlation over the rings.
+    
+    :Parameters:
+    
+    shape : tuple
+            Shape of each reference image (ny, nx)
+    capacity : int
+               Number of references to allocate space for
+    extra : dict
+            Keyword arguments for :py:func:`polar_grid`
+    '''
+    
+    def __init__(self, shape, capacity=0, **extra):
+        '''Create an empty bank
+        '''
+        
+        self.grid = polar_grid(shape, **extra)
+        self.samplers = (polar_sampler(self.grid), polar_sampler(self.grid, True))
+        self.ray_count, self.ring_count = self.grid[1].shape
+        self.max_shift = max(0, min(self.grid[0])/2 - 2 - int(self.grid[3][-1]))
+        self.buffer = numpy.zeros((self.ray_count/2+1, self.ring_count, 2*max(1, capacity)), dtype=numpy.float32)
+        self.count = 0
+    
+    def __len__(self):
+        '''Number of references in the bank
+        '''
+        
+        return self.count
+    
+    @property
+    def spectra(self):
+        ''' Conjugate ring FFT (nfreq, nring, n) of each reference
+        '''
+        
+        return self.buffer.view(numpy.complex64)[:, :, :self.count]
+    
+    def add(self, refs):
+        ''' Add references to the bank
+        
+        :Parameters:
+        
+        refs : array
+               Reference image (ny, nx) or images (n, ny, nx)
+        
+        :Returns:
+        
+        index : array
+                Index of each added reference in the bank
+        '''
+        
+        refs = numpy.asarray(refs)
+        if refs.ndim == 2: refs = refs.reshape((1, )+refs.shape)
+        spectra = reference_spectra(refs, self.grid)
+        capacity = self.buffer.shape[2]/2
+        if self.count+len(refs) > capacity:
+            buffer = numpy.zeros(self.buffer.shape[:2]+(2*max(2*capacity, self.count+len(refs)), ), dtype=numpy.float32)
+            buffer[:, :, :2*self.count] = self.buffer[:, :, :2*self.count]
+            self.buffer = buffer
+        self.buffer.view(numpy.complex64)[:, :, self.count:self.count+len(refs)] = spectra
+        self.count += len(refs)
+        return numpy.arange(self.count-len(refs), self.count)
+    
+    def polar(self, img, shifts=None, mirror=False):
+        ''' Sample an image on the polar grid of the bank
+        
+        :Parameters:
+        
+        img : array
+              Image (ny, nx)
+        shifts : array, optional
+                 Integer translations (n,2) as x, y
+        mirror : bool
+                 Sample the image mirrored over the y-axis
+        
+        :Returns:
+        
+        out : array
+              Polar images (n, nang, nring)
+        '''
+        
+        return polar_transform(img, self.samplers[int(mirror)], shifts)
+    
+    def correlate(self, polar):
+        ''' Correlate polar images against every reference at every in-plane rotation
+        
+        :Parameters:
+        
+        polar : array
+                Polar images (n, nang, nring)
+        
+        :Returns:
+        
+        cc : array
+             Correlation (nang, n, nref)
+        '''
+        
+        return rotational_correlation(polar, self.spectra)
+    
+    def score(self, img, shifts=None, mirror=False, block_size=2**22):
+        ''' Find the best in-plane rotation and translation of an image for each reference
+        
+        :Parameters:
+        
+        img : array
+              Image (ny, nx)
+        shifts : array, optional
+                 Integer translations (n,2) as x, y, each at most `max_shift`
+        mirror : bool
+                 Score the image mirrored over the y-axis
+        block_size : int
+                     Maximum number of correlation values computed at once
+        
+        :Returns:
+        
+        angle : array
+                In-plane rotation in degrees of the image relative to each reference
+        score : array
+                Correlation coefficient for each reference
+        index : array
+                Index of the best translation for each reference
+        '''
+        
+        if shifts is None: shifts = numpy.zeros((1, 2), dtype=numpy.int)
+        shifts = numpy.asarray(shifts).reshape((-1, 2))
+        if numpy.abs(shifts).max() > self.max_shift:
+            raise ValueError, "Translation exceeds the image: %d > %d"%(numpy.abs(shifts).max(), self.max_shift)
+        refs = numpy.arange(self.count)
+        angle = numpy.zeros(self.count)
+        score = numpy.empty(self.count)
+        score[:] = -numpy.inf
+        index = numpy.zeros(self.count, dtype=numpy.int)
+        step = max(1, block_size/(self.ray_count*max(1, self.count)))
+        for beg in xrange(0, len(shifts), step):
+            cc = self.correlate(self.polar(img, shifts[beg:beg+step], mirror))
+            k = cc.argmax(axis=0)
+            peak = cc.max(axis=0)
+            s = peak.argmax(axis=0)
+            val = peak[s, refs]
+            sel = val > score
+            if not numpy.any(sel): continue
+            k = k[s, refs]
+            offset = _parabolic_peak(cc[(k-1)%self.ray_count, s, refs], val, cc[(k+1)%self.ray_count, s, refs])
+            score[sel] = val[sel]
+            angle[sel] = (k+offset)[sel]
+            index[sel] = beg+s[sel]
+        angle = numpy.mod(angle*(360.0/self.ray_count)+180.0, 360.0)-180.0
+        return angle, score, index
+
+def polar_grid(shape, first_ring=1, ring_last=0, ring_step=1, ray_step=1, pixel_diameter=None, **extra):
+    ''' Create a polar grid of sample positions relative to the center of an image
+    
+    :Parameters:
+    
+    shape : tuple
+            Shape of the image (ny, nx)
+    first_ring : int
+                 First polar ring to analyze
+    ring_last : int
+                Last polar ring to analyze; if this value is zero, then it is chosen to be the
+                radius of the particle in pixels (or the largest ring that fits the image)
+    ring_step : int
+                Polar ring step size
+    ray_step : int
+               Step for the radial array
+    pixel_diameter : int
+                     Diameter of the particle in pixels
+    extra : dict
+            Unused keyword arguments
+    
+    :Returns:
+    
+    grid : tuple
+           Shape of the image, x-offset (nang, nring), y-offset (nang, nring) and
+           radius of each ring
+    '''
+    
+    shape = tuple(shape[-2:])
+    max_radius = min(shape)/2 - 2
+    if ring_last <= 0: ring_last = pixel_diameter/2 if pixel_diameter is not None and pixel_diameter > 0 else max_radius
+    ring_last = min(int(ring_last), max_radius)
+    rings = numpy.arange(max(1, first_ring), ring_last+1, max(1, ring_step), dtype=numpy.float)
+    if len(rings) == 0: raise ValueError, "No polar rings between %d and %d"%(first_ring, ring_last)
+    nang = int(2*numpy.pi*rings[-1])/max(1, ray_step)
+    nang += nang%2
+    ang = numpy.arange(nang)*(2*numpy.pi/nang)
+    return shape, numpy.cos(ang)[:, numpy.newaxis]*rings, numpy.sin(ang)[:, numpy.newaxis]*rings, rings
+
+def polar_sampler(grid, mirror=False):
+    ''' Compute the bilinear interpolation of a polar grid at the center of an image
+    
+    :Parameters:
+    
+    grid : tuple
+           Polar grid from :py:func:`polar_grid`
+    mirror : bool
+             Sample the image mirrored over the y-axis
+    
+    :Returns:
+    
+    sampler : tuple
+              Flat index of the upper left neighbor, the weight of the
+              four neighbors (4, nang*nring), the x-direction of a shift,
+              the shape of the grid, and radius of each ring
+    '''
+    
+    shape, dx, dy, rings = grid
+    ny, nx = shape
+    xdir = -1 if mirror else 1
+    x = (nx/2) + xdir*dx.ravel()
+    y = (ny/2) + dy.ravel()
+    x0 = numpy.floor(x)
+    y0 = numpy.floor(y)
+    fx = x-x0
+    fy = y-y0
+    weight = numpy.vstack(((1-fx)*(1-fy), fx*(1-fy), (1-fx)*fy, fx*fy)).astype(numpy.float32)
+    index = y0.astype(numpy.int)*nx + x0.astype(numpy.int)
+    return index, weight, xdir, dx.shape, rings
+
+def shift_grid(trans_range, trans_step=1):
+    ''' Create a list of translations within a circle
+    
+    :Parameters:
+    
+    trans_range : int
+                  Maximum allowed translation
+    trans_step : int
+                 Translation step size
+    
+    :Returns:
+    
+    shifts : array
+             Translations (n,2) as x, y
+    '''
+    
+    trans_range = int(trans_range)
+    steps = numpy.arange(-(trans_range/max(1, int(trans_step))), trans_range/max(1, int(trans_step))+1)*max(1, int(trans_step))
+    y, x = numpy.meshgrid(steps, steps, indexing='ij')
+    sel = (x*x + y*y) <= trans_range*trans_range
+    return numpy.column_stack((x[sel], y[sel]))
+
+def polar_transform(img, sampler, shifts=None):
+    ''' Sample an image on a polar grid centered on each translation
+    
+    The samples are weighted by the square root of the radius and normalized
+    such that the dot product of two polar images is the correlation coefficient
+    of the annulus.
+    
+    :Parameters:
+    
+    img : array
+          Image (ny, nx)
+    sampler : tuple
+              Polar sampler from :py:func:`polar_sampler`
+    shifts : array, optional
+             Integer translations (n,2) as x, y
+    
+    :Returns:
+    
+    out : array
+          Polar images (n, nang, nring)
+    '''
+    
+    index, weight, xdir, shape, rings = sampler
+    img = numpy.asarray(img, dtype=numpy.float32)
+    nx = img.shape[1]
+    if shifts is None: shifts = numpy.zeros((1, 2), dtype=numpy.int)
+    shifts = numpy.asarray(shifts, dtype=numpy.int).reshape((-1, 2))
+    index = index + (shifts[:, 1]*nx + xdir*shifts[:, 0])[:, numpy.newaxis]
+    flat = img.ravel()
+    out = flat[index]*weight[0]
+    out += flat[index+1]*weight[1]
+    out += flat[index+nx]*weight[2]
+    out += flat[index+nx+1]*weight[3]
+    out = out.reshape((len(shifts), )+shape)
+    out -= (numpy.dot(out.sum(axis=1), rings)/(shape[0]*rings.sum()))[:, numpy.newaxis, numpy.newaxis]
+    out *= numpy.sqrt(rings).astype(numpy.float32)
+    norm = numpy.sqrt(numpy.square(out).sum(axis=2).sum(axis=1))
+    norm[norm == 0] = 1.0
+    out /= norm[:, numpy.newaxis, numpy.newaxis]
+    return out
+
+def reference_spectra(refs, grid):
+    ''' Compute the conjugate ring FFT of each reference in polar coordinates
+    
+    :Parameters:
+    
+    refs : array
+           Reference projections (n, ny, nx)
+    grid : tuple
+           Polar grid from :py:func:`polar_grid`
+    
+    :Returns:
+    
+    spectra : array
+              Conjugate spectra (nfreq, nring, n)
+    '''
+    
+    sampler = polar_sampler(grid)
+    polar = numpy.vstack([polar_transform(ref, sampler) for ref in refs])
+    return numpy.fft.rfft(polar, axis=1).transpose((1, 2, 0)).conj().astype(numpy.complex64)
+
+def rotational_correlation(polar, spectra):
+    ''' Correlate polar images against polar reference spectra over all in-plane rotations
+    
+    :Parameters:
+    
+    polar : array
+            Polar images (n, nang, nring)
+    spectra : array
+              Conjugate spectra of the references (nfreq, nring, nref)
+    
+    :Returns:
+    
+    cc : array
+         Correlation (nang, n, nref) for each in-plane rotation,
+         image and reference
+    '''
+    
+    fpolar = numpy.fft.rfft(polar, axis=1).transpose((1, 0, 2)).astype(numpy.complex64)
+    return numpy.fft.irfft(numpy.matmul(fpolar, spectra), polar.shape[1], axis=0)
+
+def _parabolic_peak(ym, y0, yp):
+    ''' Find the offset of the peak of a parabola through three equally spaced points
+    
+    :Parameters:
+    
+    ym : array
+         Value left of the peak
+    y0 : array
+         Value at the peak
+    yp : array
+         Value right of the peak
+    
+    :Returns:
+    
+    offset : array
+             Offset of the peak from the center point
+    '''
+    
+    denom = ym - 2*y0 + yp
+    curved = denom < 0
+    return numpy.where(curved, 0.5*(ym - yp)/numpy.where(curved, denom, 1.0), 0.0)
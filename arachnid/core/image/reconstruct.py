@@ -10,8 +10,8 @@ Supported Reconstruction Methods
 .. codeauthor:: Robert Langlois <rl2528@columbia.edu>
 '''
 from ..app import tracing
-from ..parallel import mpi_utility, process_tasks
-import logging, numpy
+from ..parallel import mpi_utility, process_tasks, openmp
+import logging, numpy, itertools, os
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
@@ -53,6 +53,34 @@ def reconstruct3_bp3f_mp(image_size, gen1, gen2, align1=None, align2=None, **ext
     
     return reconstruct3_mp(backproject_bp3f, finalize_bp3f, backproject_bp3f_array, image_size, gen1, gen2, align1, align2, **extra)
 
+def reconstruct3_bp3f_split_mp(image_size, gen, align, half, **extra):
+    '''Reconstruct three volumes using BP3F reading the images only once
+    
+    :Parameters:
+    
+    image_size : int
+                 Image size
+    gen : array generator
+          Generate a sequence of images in the array format
+    align : array
+            Alignment parameters for each image
+    half : array
+           Half set (0 or 1) of each image
+    extra : dict
+            Unused keyword arguments
+    
+    :Returns:
+    
+    vol : array
+          Reconstruction volume (IF MPI, then only to the root, otherwise None)
+    vol1 : array
+          Reconstruction half volume (IF MPI, then only to the root, otherwise None)
+    vol2 : array
+          Reconstruction half volume (IF MPI, then only to the root, otherwise None)
+    '''
+    
+    return reconstruct3_split_mp(backproject_bp3f, finalize_bp3f, backproject_bp3f_array, image_size, gen, align, half, **extra)
+
 def reconstruct_bp3f_mp(gen, image_size, align, npad=2, cleanup_fft=True, **extra):
     '''Reconstruct a single volume with the given image generator and alignment
     file.
@@ -93,39 +121,58 @@ def finalize_bp3f(fftvol, weight, image_size, cleanup_fft):
         return vol
     if cleanup_fft: _spider_reconstruct.cleanup_bp3f()
     
-def backproject_bp3f(gen, image_size, align, process_number, npad=2, process_image=None, psi='psi', theta='theta', phi='phi', forvol=None, weight=None, **extra):
+def backproject_bp3f(gen, image_size, align, process_number, npad=2, process_image=None, psi='psi', theta='theta', phi='phi', forvol=None, weight=None, half=None, shared_volume=False, **extra):
     '''
     '''
     
+    # Only backproject with multiple threads when they share the volume, see backproject_shared
+    max_threads = openmp.get_max_threads() if not shared_volume and openmp.is_openmp_enabled() else 0
+    if max_threads > 1: openmp.set_thread_count(1)
     try:
         pad_size = image_size*npad
         tabi = numpy.zeros(4999, dtype=numpy.float32)
-        if forvol is None: forvol = numpy.zeros((image_size+1, pad_size, pad_size), order='F', dtype=numpy.complex64)
-        if weight is None: weight = numpy.zeros((image_size+1, pad_size, pad_size), order='F', dtype=tabi.dtype)
-        if not forvol.flags.f_contiguous: forvol = forvol.T
-        if not weight.flags.f_contiguous: weight = weight.T
+        if half is not None:
+            if forvol is None or weight is None:
+                arrays = backproject_bp3f_array(image_size, npad, True)
+                forvol, weight = arrays['forvol'], arrays['weight']
+            vols = [(forvol[h].T, weight[h].T) for h in xrange(2)]
+        else:
+            if forvol is None: forvol = numpy.zeros((image_size+1, pad_size, pad_size), order='F', dtype=numpy.complex64)
+            if weight is None: weight = numpy.zeros((image_size+1, pad_size, pad_size), order='F', dtype=tabi.dtype)
+            if not forvol.flags.f_contiguous: forvol = forvol.T
+            if not weight.flags.f_contiguous: weight = weight.T
+            vols = [(forvol, weight)]
         
         _spider_reconstruct.setup_bp3f(tabi, pad_size)
         if len(align) > 0 and hasattr(align[0], psi):
             for i, img in gen:
                 a = align[i]
+                f, w = vols[half[i]] if half is not None else vols[0]
                 if process_image is not None: img = process_image(img, a, **extra)
-                _spider_reconstruct.backproject_bp3f(img.T, forvol, weight, tabi, getattr(a, psi), getattr(a, theta), getattr(a, phi))
+                _spider_reconstruct.backproject_bp3f(img.T, f, w, tabi, getattr(a, psi), getattr(a, theta), getattr(a, phi))
         else:
             for i, img in gen:
                 a = align[i]
+                f, w = vols[half[i]] if half is not None else vols[0]
                 if process_image is not None: img = process_image(img, a, **extra)
-                _spider_reconstruct.backproject_bp3f(img.T, forvol, weight, tabi, a[0], a[1], a[2])
+                _spider_reconstruct.backproject_bp3f(img.T, f, w, tabi, a[0], a[1], a[2])
     except:
         _logger.exception("Error in backproject worker")
         raise
+    finally:
+        if max_threads > 1: openmp.set_thread_count(max_threads)
     return forvol, weight
 
-def backproject_bp3f_array(image_size, npad=2, **extra):
+def backproject_bp3f_array(image_size, npad=2, halves=False, **extra):
     ''' Get the shape of the Fourier volume use for backprojection
+    
+    If `halves` is True, then the volumes of both half sets are
+    stacked along the first axis, which doubles the memory, see
+    :py:func:`fourier_volume_nbytes`.
     '''
     
     pad_size = image_size*npad
+    if halves: return dict(forvol=numpy.zeros((2, pad_size, pad_size, image_size+1), order='C', dtype=numpy.complex64), weight=numpy.zeros((2, pad_size, pad_size, image_size+1), order='C', dtype=numpy.float32))
     #return dict(forvol=numpy.zeros((image_size+1, pad_size, pad_size), order='C', dtype=numpy.complex64), weight=numpy.zeros((image_size+1, pad_size, pad_size), order='C', dtype=numpy.float32))
     return dict(forvol=numpy.zeros((pad_size, pad_size, image_size+1), order='C', dtype=numpy.complex64), weight=numpy.zeros((pad_size, pad_size, image_size+1), order='C', dtype=numpy.float32))
 
@@ -159,6 +206,34 @@ def reconstruct3_bp3n_mp(image_size, gen1, gen2, align1=None, align2=None, **ext
     
     return reconstruct3_mp(backproject_bp3n, finalize_bp3n, backproject_bp3n_array, image_size, gen1, gen2, align1, align2, **extra)
 
+def reconstruct3_bp3n_split_mp(image_size, gen, align, half, **extra):
+    '''Reconstruct three volumes using BP3N reading the images only once
+    
+    :Parameters:
+    
+    image_size : int
+                 Image size
+    gen : array generator
+          Generate a sequence of images in the array format
+    align : array
+            Alignment parameters for each image
+    half : array
+           Half set (0 or 1) of each image
+    extra : dict
+            Unused keyword arguments
+    
+    :Returns:
+    
+    vol : array
+          Reconstruction volume (IF MPI, then only to the root, otherwise None)
+    vol1 : array
+          Reconstruction half volume (IF MPI, then only to the root, otherwise None)
+    vol2 : array
+          Reconstruction half volume (IF MPI, then only to the root, otherwise None)
+    '''
+    
+    return reconstruct3_split_mp(backproject_bp3n, finalize_bp3n, backproject_bp3n_array, image_size, gen, align, half, **extra)
+
 def reconstruct_bp3n_mp(gen, image_size, align, npad=2, cleanup_fft=True, **extra):
     '''Reconstruct a single volume with the given image generator and alignment
     file.
@@ -196,35 +271,56 @@ def finalize_bp3n(fftvol, weight, image_size, cleanup_fft):
         return vol
     if cleanup_fft: _spider_reconstruct.cleanup_nn4f()
 
-def backproject_bp3n(gen, image_size, align, process_number, npad=2, forvol=None, weight=None, **extra):
+def backproject_bp3n(gen, image_size, align, process_number, npad=2, forvol=None, weight=None, half=None, shared_volume=False, **extra):
     '''
     '''
     
+    # Only backproject with multiple threads when they share the volume, see backproject_shared
+    max_threads = openmp.get_max_threads() if not shared_volume and openmp.is_openmp_enabled() else 0
+    if max_threads > 1: openmp.set_thread_count(1)
     try:
         pad_size = image_size*npad
-        if forvol is None: forvol = numpy.zeros((image_size+1, pad_size, pad_size), order='F', dtype=numpy.complex64)
-        if weight is None: weight = numpy.zeros((image_size+1, pad_size, pad_size), order='F', dtype=numpy.int32)
-        if not forvol.flags.f_contiguous: forvol = forvol.T
-        if not weight.flags.f_contiguous: weight = weight.T
+        if half is not None:
+            if forvol is None or weight is None:
+                arrays = backproject_bp3n_array(image_size, npad, True)
+                forvol, weight = arrays['forvol'], arrays['weight']
+            vols = [(forvol[h].T, weight[h].T) for h in xrange(2)]
+        else:
+            if forvol is None: forvol = numpy.zeros((image_size+1, pad_size, pad_size), order='F', dtype=numpy.complex64)
+            if weight is None: weight = numpy.zeros((image_size+1, pad_size, pad_size), order='F', dtype=numpy.int32)
+            if not forvol.flags.f_contiguous: forvol = forvol.T
+            if not weight.flags.f_contiguous: weight = weight.T
+            vols = [(forvol, weight)]
         
         for i, img in gen:
             a = align[i]
-            _spider_reconstruct.backproject_nn4f(img.T, forvol, weight, a[0], a[1], a[2])
+            f, w = vols[half[i]] if half is not None else vols[0]
+            _spider_reconstruct.backproject_nn4f(img.T, f, w, a[0], a[1], a[2])
     except:
         _logger.exception("Error in backproject worker")
         raise
+    finally:
+        if max_threads > 1: openmp.set_thread_count(max_threads)
     return forvol, weight
 
-def backproject_bp3n_array(image_size, npad=2, **extra):
+def backproject_bp3n_array(image_size, npad=2, halves=False, **extra):
     ''' Get the shape of the Fourier volume use for backprojection
+    
+    If `halves` is True, then the volumes of both half sets are
+    stacked along the first axis, which doubles the memory, see
+    :py:func:`fourier_volume_nbytes`.
     '''
     
     pad_size = image_size*npad
+    if halves: return dict(forvol=numpy.zeros((2, pad_size, pad_size, image_size+1), order='C', dtype=numpy.complex64), weight=numpy.zeros((2, pad_size, pad_size, image_size+1), order='C', dtype=numpy.int32))
     return dict(forvol=numpy.zeros((image_size+1, pad_size, pad_size), order='C', dtype=numpy.complex64), weight=numpy.zeros((image_size+1, pad_size, pad_size), order='C', dtype=numpy.int32))
 
 def reconstruct3_mp(backproject, finalize, make_array, image_size, gen1, gen2, align1=None, align2=None, npad=2, cleanup_fft=True, **extra):
     '''Reconstruct three volumes using BP3F
     
+    The images of both generators are backprojected in a single pass, see
+    :py:func:`reconstruct3_split_mp`.
+    
     :Parameters:
     
     image_size : int
@@ -252,52 +348,215 @@ def reconstruct3_mp(backproject, finalize, make_array, image_size, gen1, gen2, a
           Reconstruction half volume (IF MPI, then only to the root, otherwise None)
     '''
     
-    if mpi_utility.get_size(**extra) > 100 and 1 == 0:
-        rank = mpi_utility.get_rank(**extra)
-        recon = reconstruct_fft(backproject, make_array, gen1, image_size, align1, npad, **extra)#, root=1
-        #mpi_utility.send_to_root(recon[0], 1, **extra)
-        #mpi_utility.send_to_root(recon[1], 1, **extra)
-        recon1 = reconstruct_fft(backproject, make_array, gen2, image_size, align2, npad, **extra)#, root=2
-        #mpi_utility.send_to_root(recon1[0], 2, **extra)
-        #mpi_utility.send_to_root(recon1[1], 2, **extra)
-        hvol1, hvol2 = None, None
-        if rank == 1:
-            hvol1 = finalize(recon[0], recon[1], image_size, cleanup_fft)
-        elif rank == 2:
-            hvol2 = finalize(recon1[0], recon1[1], image_size, cleanup_fft)
-        elif rank == 0:
-            recon[0]+=recon1[0]
-            recon[1]+=recon1[1]
-            del recon1
-            vol = finalize(recon[0], recon[1], image_size, cleanup_fft)
-            hvol1 = vol.copy(order='F') if vol.flags.f_contiguous else vol.copy()
-            hvol2 = vol.copy(order='F') if vol.flags.f_contiguous else vol.copy()
-        else:
-            finalize(None, None, 0)
-        mpi_utility.send_to_root(hvol1, 1, **extra)
-        mpi_utility.send_to_root(hvol2, 2, **extra)
-    else:
-        _logger.info("Started back projection of %d even projections with %d threads on node %s"%(len(align1), extra['thread_count'], mpi_utility.hostname()))
-        recon = reconstruct_fft(backproject, make_array, gen1, image_size, align1, npad, **extra)
-        _logger.info("Started back projection of %d odd projections with %d threads on node %s"%(len(align1), extra['thread_count'], mpi_utility.hostname()))
-        recon1 = reconstruct_fft(backproject, make_array, gen2, image_size, align2, npad, **extra)
+    if hasattr(align1, 'ndim'): align = numpy.concatenate((align1, align2))
+    else: align = list(align1)+list(align2)
+    half = numpy.concatenate((numpy.zeros(len(align1), dtype=numpy.int), numpy.ones(len(align2), dtype=numpy.int)))
+    return reconstruct3_split_mp(backproject, finalize, make_array, image_size, itertools.chain(gen1, gen2), align, half, npad, cleanup_fft, **extra)
+
+def reconstruct3_split_mp(backproject, finalize, make_array, image_size, gen, align, half, npad=2, cleanup_fft=True, max_memory=0.0, **extra):
+    '''Reconstruct the full volume and both half volumes in a single pass
+    over the images
+    
+    Each image is backprojected into the Fourier volume of its half set, and the
+    full volume is finalized from the sum of both half volumes.
+    
+    Each worker process holds the Fourier volumes of both half sets, twice the
+    memory of a single volume, e.g. about 6 GB for a 400 pixel box padded twice.
+    If the volumes of all workers would exceed `max_memory`, then the images are
+    backprojected with threads sharing a single pair of half volumes instead
+    (`shared_volume`, see :py:func:`reconstruct_fft`).
+    
+    :Parameters:
+    
+    image_size : int
+                 Image size
+    gen : array generator
+          Generate a sequence of images in the array format
+    align : array
+            Alignment parameters for each image
+    half : array
+           Half set (0 or 1) of each image
+    npad : int
+           Number of times to pad volume
+    max_memory : float
+                 Maximum memory in GB for the Fourier volumes of all workers,
+                 if 0, then the physical memory of the node
+    extra : dict
+            Unused keyword arguments
+    
+    :Returns:
         
-        if mpi_utility.is_root(**extra):
-            #_logger.error("finalize-1-full")
-            vol = finalize(recon[0]+recon1[0], recon[1]+recon1[1], image_size, cleanup_fft)
-            #_logger.error("finalize-2-half1")
-            hvol1 = finalize(recon[0], recon[1], image_size, cleanup_fft)
-            #_logger.error("finalize-3-half2")
-            hvol2 = finalize(recon1[0], recon1[1], image_size, cleanup_fft)
-            #_logger.error("finalize-3-half2-done")
-            return (vol, hvol1, hvol2)
-        else:
-            finalize(None, None, 0, cleanup_fft)
-        return None
+    vol : array
+          Reconstruction volume (IF MPI, then only to the root, otherwise None)
+    vol1 : array
+          Reconstruction half volume (IF MPI, then only to the root, otherwise None)
+    vol2 : array
+          Reconstruction half volume (IF MPI, then only to the root, otherwise None)
+    '''
+    
+    half = numpy.asarray(half, dtype=numpy.int)
+    worker_count = extra.get('thread_count', 1)
+    if not extra.get('shared_volume', False) and worker_count > 1:
+        nbytes = fourier_volume_nbytes(image_size, npad, True)*worker_count
+        limit = max_memory*1024**3 if max_memory > 0 else _physical_memory()
+        if limit > 0 and nbytes > limit:
+            _logger.warn("Half volumes of %d workers need %.1f GB (limit %.1f GB) - threads share a single pair of half volumes"%(worker_count, nbytes/1024.0**3, limit/1024.0**3))
+            extra['shared_volume']=True
+    _logger.info("Started back projection of %d even and %d odd projections with %d threads on node %s"%(numpy.sum(half==0), numpy.sum(half==1), extra['thread_count'], mpi_utility.hostname()))
+    fftvol, weight = reconstruct_fft(backproject, make_array, gen, image_size, align, npad, half=half, reduce=False, **extra)
+    if mpi_utility.get_size(**extra) > 1:
+        return finalize_scatter(finalize, fftvol, weight, image_size, cleanup_fft, **extra)
+    if mpi_utility.is_root(**extra):
+        vol = finalize(fftvol[0]+fftvol[1], weight[0]+weight[1], image_size, cleanup_fft)
+        hvol1 = finalize(fftvol[0], weight[0], image_size, cleanup_fft)
+        hvol2 = finalize(fftvol[1], weight[1], image_size, cleanup_fft)
+        return (vol, hvol1, hvol2)
+    else:
+        finalize(None, None, 0, cleanup_fft)
+    return None
+
+def fourier_volume_nbytes(image_size, npad=2, halves=False):
+    ''' Get the memory used by the Fourier and weight volumes of one backprojection worker
+    
+    :Parameters:
+    
+    image_size : int
+                 Image size
+    npad : int
+           Number of times to pad volume
+    halves : bool
+             Worker holds the volumes of both half sets
+    
+    :Returns:
+    
+    nbytes : int
+             Number of bytes
+    '''
+    
+    pad_size = image_size*npad
+    # Complex64 Fourier volume and 32-bit weight volume
+    nbytes = pad_size*pad_size*(image_size+1)*(8+4)
+    return nbytes*2 if halves else nbytes
+
+def _physical_memory():
+    ''' Get the physical memory of this node
+    
+    :Returns:
+    
+    nbytes : int
+             Number of bytes, 0 if unknown
+    '''
+    
+    try: return os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError): return 0
+
+def finalize_scatter(finalize, fftvol, weight, image_size, cleanup_fft, **extra):
+    '''Sum the half volumes over all nodes and finalize each output volume
+    on a different node
+    
+    The sum of each half volume is scattered over the nodes, so each node owns
+    a slab of both sums. The slabs of each output volume (full, first half and
+    second half) are then gathered to a single node (ranks 0, 1 and 2), which
+    finalizes it, and only the real space volumes are sent to the root.
+    
+    :Parameters:
+    
+    finalize : function
+               Finalize a Fourier volume to a real space volume
+    fftvol : array
+             Fourier volumes of both half sets on this node (stacked along the first axis)
+    weight : array
+             Weight volumes of both half sets on this node (stacked along the first axis)
+    image_size : int
+                 Image size
+    cleanup_fft : bool
+                  Cleanup the FFT plans after finalizing
+    extra : dict
+            Keyword arguments including the MPI communicator
+    
+    :Returns:
+    
+    vol : array
+          Reconstruction volume (only to the root, otherwise None)
+    vol1 : array
+          Reconstruction half volume (only to the root, otherwise None)
+    vol2 : array
+          Reconstruction half volume (only to the root, otherwise None)
+    '''
+    
+    rank, size = mpi_utility.get_rank(**extra), mpi_utility.get_size(**extra)
+    shape = fftvol.shape[1:]
+    total = fftvol[0].size
+    parts = []
+    for h in xrange(2):
+        parts.append((mpi_utility.reduce_scatter(fftvol[h].ravel(), **extra), mpi_utility.reduce_scatter(weight[h].ravel(), **extra)))
+    del fftvol, weight
+    parts.insert(0, (parts[0][0]+parts[1][0], parts[0][1]+parts[1][1]))
+    owners = [0, 1 % size, 2 % size]
+    vols = [None, None, None]
+    for i in xrange(3):
+        f = mpi_utility.gather_to(parts[i][0], total, owners[i], **extra)
+        w = mpi_utility.gather_to(parts[i][1], total, owners[i], **extra)
+        parts[i] = None
+        if rank == owners[i]:
+            vols[i] = finalize(f.reshape(shape), w.reshape(shape), image_size, cleanup_fft)
+        del f, w
+    if rank not in owners: finalize(None, None, 0, cleanup_fft)
+    for i in xrange(1, 3):
+        if owners[i] == 0: continue
+        if rank == owners[i]: buf = numpy.ascontiguousarray(vols[i].T)
+        elif rank == 0: buf = numpy.empty(vols[0].T.shape, dtype=vols[0].dtype)
+        else: buf = None
+        mpi_utility.send_to_root(buf, owners[i], **extra)
+        if rank == 0: vols[i] = buf.T
+    if rank == 0: return tuple(vols)
+    return None
+
+def backproject_shared(backproject, gen, image_size, align, thread_count=1, **extra):
+    '''Backproject all images in this process with OpenMP threads sharing
+    a single Fourier volume
+    
+    :Parameters:
+    
+    backproject : function
+                  Backprojection function, e.g. :py:func:`backproject_bp3f`
+    gen : array generator
+          Generate a sequence of images in the array format
+    image_size : int
+                 Image size
+    align : array
+            Alignment parameters for each image
+    thread_count : int
+                   Number of threads
+    extra : dict
+            Keyword arguments for the backprojection function
+    
+    :Returns:
+    
+    fftvol : array
+             Fourier volume
+    weight : array
+             Weight volume
+    '''
+    
+    if not openmp.is_openmp_enabled():
+        _logger.warn("OpenMP is not enabled - backprojecting with a single thread")
+        return backproject(enumerate(gen), image_size, align, process_number=0, **extra)
+    max_threads = openmp.get_max_threads()
+    openmp.set_thread_count(thread_count if thread_count > 0 else openmp.get_num_procs())
+    try:
+        return backproject(enumerate(gen), image_size, align, process_number=0, shared_volume=True, **extra)
+    finally: openmp.set_thread_count(max_threads)
 
-def reconstruct_fft(backproject, backproject_array, gen, image_size, align, npad=2, shared=True, **extra):
+def reconstruct_fft(backproject, backproject_array, gen, image_size, align, npad=2, shared=True, half=None, shared_volume=False, reduce=True, **extra):
     '''Reconstruct a single volume with the given image generator and alignment file.
     
+    By default, each worker process backprojects into its own Fourier volume
+    and the volumes are summed at the end. If `shared_volume` is True, then the
+    images are backprojected in this process into a single Fourier volume
+    shared by `thread_count` OpenMP threads, each thread updating its own
+    z-planes, so the memory does not grow with the number of threads.
+    
     :Parameters:
     
     gen : array generator
@@ -308,6 +567,13 @@ def reconstruct_fft(backproject, backproject_array, gen, image_size, align, npad
             Input alignment file
     npad : int
            Number of times to pad volume
+    half : array, optional
+           Half set (0 or 1) of each image, if given the volumes of both
+           half sets are stacked along the first axis
+    shared_volume : bool
+                    Backproject with threads sharing a single Fourier volume
+    reduce : bool
+             Sum the volumes over all nodes (MPI), otherwise return the volumes of this node
     extra : dict
             Unused keyword arguments
     
@@ -320,8 +586,13 @@ def reconstruct_fft(backproject, backproject_array, gen, image_size, align, npad
     '''
     
     fftvol, weight = None, None
-    shmem_array_info=backproject_array(image_size, npad) if shared else None
-    for val in process_tasks.iterate_reduce(gen, backproject, align=align, npad=npad, image_size=image_size, shmem_array_info=shmem_array_info, **extra):
+    if shared_volume:
+        results = [backproject_shared(backproject, gen, image_size, align, npad=npad, half=half, **extra)]
+        shared = False
+    else:
+        shmem_array_info=backproject_array(image_size, npad, half is not None) if shared else None
+        results = process_tasks.iterate_reduce(gen, backproject, align=align, npad=npad, image_size=image_size, shmem_array_info=shmem_array_info, half=half, **extra)
+    for val in results:
         if isinstance(val, tuple): v, w = val
         elif isinstance(val, dict):
             v, w = val['forvol'], val['weight']
@@ -338,6 +609,7 @@ def reconstruct_fft(backproject, backproject_array, gen, image_size, align, npad
             weight += w
     assert(fftvol is not None)
     assert(weight is not None)
+    if not reduce: return fftvol, weight
     #_logger.info("begin-block_reduce1: %f"%numpy.sum(fftvol.real))
     order = 'F' if fftvol.flags.f_contiguous else 'C'
     mpi_utility.block_reduce(fftvol.ravel(order=order), **extra)
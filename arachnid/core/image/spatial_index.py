@@ -0,0 +1,231 @@
+''' Spatial index for radius queries over particle coordinates
+
+This module defines a grid hash over (x,y) coordinates, which replaces the dense
+comparison of every coordinate against every other. Each point is assigned
+to a square cell and a radius query only compares points in the neighboring cells,
+so the cost grows with the number of points rather than its square.
+
+.. sourcecode:: py
+    
+    >>> from arachnid.core.image.spatial_index import *
+    >>> coords = numpy.asarray([(10, 10), (12, 10), (50, 50)])
+    >>> pairs_within(coords, 5)
+    (array([0]), array([1]), array([ 4.]))
+    >>> non_maximum_suppression(coords, numpy.asarray([1.0, 2.0, 0.5]), 5)
+    array([False,  True,  True], dtype=bool)
+
+.. Created on Oct 17, 2026
+'''
+import numpy
+import logging
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+class GridIndex(object):
+    ''' Grid hash of 2D coordinates supporting radius queries
+    
+    :Parameters:
+    
+    coords : array
+             Coordinates (n,2) as x, y
+    cell_size : float
+                Width of each cell of the grid, should be close to the query radius
+    '''
+    
+    def __init__(self, coords, cell_size):
+        '''Assign each coordinate to a cell and sort by cell
+        '''
+        
+        self.coords = numpy.asarray(coords, dtype=numpy.float).reshape((len(coords), 2))
+        self.cell_size = float(cell_size) if cell_size > 0 else 1.0
+        cells = numpy.floor(self.coords/self.cell_size).astype(numpy.int64)
+        self.origin = cells.min(axis=0) if len(cells) > 0 else numpy.zeros(2, dtype=numpy.int64)
+        # One empty cell on each side, so neighbors of a boundary cell do not wrap to the next row
+        self.width = (cells[:, 0].max()-self.origin[0]+3) if len(cells) > 0 else 3
+        keys = self._keys(cells-self.origin)
+        self.order = numpy.argsort(keys, kind='mergesort')
+        self.keys = keys[self.order]
+    
+    def _keys(self, cells):
+        ''' Get the key of each cell
+        
+        :Parameters:
+        
+        cells : array
+                Cell indices (n,2) relative to the origin
+        
+        :Returns:
+        
+        keys : array
+               Key of each cell
+        '''
+        
+        return (cells[:, 1]+1)*self.width + (cells[:, 0]+1)
+    
+    def query(self, points, radius):
+        ''' Find all pairs of query points and indexed coordinates within the radius
+        
+        :Parameters:
+        
+        points : array
+                 Query points (m,2) as x, y
+        radius : float
+                 Maximum distance (inclusive)
+        
+        :Returns:
+        
+        qi : array
+             Index of the query point
+        j : array
+            Index of the coordinate
+        d2 : array
+             Squared distance
+        '''
+        
+        points = numpy.asarray(points, dtype=numpy.float).reshape((len(points), 2))
+        empty = (numpy.zeros(0, dtype=numpy.int), numpy.zeros(0, dtype=numpy.int), numpy.zeros(0))
+        if len(points) == 0 or len(self.coords) == 0: return empty
+        cells = numpy.floor(points/self.cell_size).astype(numpy.int64)-self.origin
+        reach = max(1, int(numpy.ceil(radius/self.cell_size)))
+        qis, js = [], []
+        for dy in xrange(-reach, reach+1):
+            for dx in xrange(-reach, reach+1):
+                cx = cells[:, 0]+dx
+                valid = numpy.logical_and(cx >= 0, cx < self.width-2)
+                keys = self._keys(numpy.column_stack((cx, cells[:, 1]+dy)))
+                beg = numpy.searchsorted(self.keys, keys, 'left')
+                cnt = numpy.searchsorted(self.keys, keys, 'right')-beg
+                cnt[numpy.logical_not(valid)] = 0
+                total = cnt.sum()
+                if total == 0: continue
+                qi = numpy.repeat(numpy.arange(len(points)), cnt)
+                off = numpy.arange(total)-numpy.repeat(numpy.cumsum(cnt)-cnt, cnt)
+                qis.append(qi)
+                js.append(self.order[numpy.repeat(beg, cnt)+off])
+        if len(qis) == 0: return empty
+        qi = numpy.concatenate(qis)
+        j = numpy.concatenate(js)
+        dist = points[qi]-self.coords[j]
+        numpy.square(dist, dist)
+        d2 = numpy.sum(dist, axis=1)
+        sel = d2 <= radius*radius
+        return qi[sel], j[sel], d2[sel]
+
+def pairs_within(coords, radius):
+    ''' Find all pairs of coordinates within the radius of each other
+    
+    :Parameters:
+    
+    coords : array
+             Coordinates (n,2) as x, y
+    radius : float
+             Maximum distance (inclusive)
+    
+    :Returns:
+    
+    i : array
+        Index of the first coordinate
+    j : array
+        Index of the second coordinate (i < j)
+    d2 : array
+         Squared distance
+    '''
+    
+    index = GridIndex(coords, radius)
+    i, j, d2 = index.query(index.coords, radius)
+    sel = i < j
+    return i[sel], j[sel], d2[sel]
+
+def neighbors_within(points, coords, radius):
+    ''' Find all pairs of points and coordinates within the radius of each other
+    
+    :Parameters:
+    
+    points : array
+             Query points (m,2) as x, y
+    coords : array
+             Coordinates (n,2) as x, y
+    radius : float
+             Maximum distance (inclusive)
+    
+    :Returns:
+    
+    qi : array
+         Index of the query point
+    j : array
+        Index of the coordinate
+    d2 : array
+         Squared distance
+    '''
+    
+    return GridIndex(coords, radius).query(points, radius)
+
+def non_maximum_suppression(coords, scores, radius):
+    ''' Greedily select coordinates in order of decreasing score, removing
+    every coordinate closer than the radius to one already selected
+    
+    :Parameters:
+    
+    coords : array
+             Coordinates (n,2) as x, y
+    scores : array
+             Score of each coordinate
+    radius : float
+             Minimum distance between selected coordinates
+    
+    :Returns:
+    
+    sel : array
+          Boolean array of selected coordinates
+    '''
+    
+    n = len(coords)
+    i, j, d2 = pairs_within(coords, radius)
+    close = d2 < radius*radius
+    i, j = numpy.concatenate((i[close], j[close])), numpy.concatenate((j[close], i[close]))
+    order = numpy.argsort(i, kind='mergesort')
+    i, j = i[order], j[order]
+    beg = numpy.searchsorted(i, numpy.arange(n+1))
+    sel = numpy.zeros(n, dtype=numpy.bool)
+    removed = numpy.zeros(n, dtype=numpy.bool)
+    for k in numpy.argsort(-numpy.asarray(scores), kind='mergesort'):
+        if removed[k]: continue
+        sel[k] = True
+        removed[j[beg[k]:beg[k+1]]] = True
+    return sel
+
+def match_nearest(points, coords, radius):
+    ''' Greedily match each point, in order, to the nearest unmatched coordinate
+    closer than the radius
+    
+    :Parameters:
+    
+    points : array
+             Query points (m,2) as x, y
+    coords : array
+             Coordinates (n,2) as x, y
+    radius : float
+             Maximum distance of a match (exclusive)
+    
+    :Returns:
+    
+    matches : list
+              List of (point index, coordinate index) tuples
+    '''
+    
+    qi, j, d2 = neighbors_within(points, coords, radius)
+    close = d2 < radius*radius
+    qi, j, d2 = qi[close], j[close], d2[close]
+    order = numpy.lexsort((j, d2, qi))
+    qi, j = qi[order], j[order]
+    beg = numpy.searchsorted(qi, numpy.arange(len(points)+1))
+    used = numpy.zeros(len(coords), dtype=numpy.bool)
+    matches = []
+    for k in numpy.flatnonzero(beg[1:] > beg[:-1]):
+        for c in j[beg[k]:beg[k+1]]:
+            if not used[c]:
+                used[c] = True
+                matches.append((k, c))
+                break
+    return matches
@@ -89,6 +89,9 @@
 		REAL      	  			   :: TABI(L)
 		REAL					   :: PSI,THE,PHI
 		INTEGER					   :: NS,N,N2,L
+		INTEGER					   :: ITH,NTH
+!$		INTEGER					   :: OMP_GET_THREAD_NUM
+!$		INTEGER					   :: OMP_GET_NUM_THREADS
 
         COMPLEX, ALLOCATABLE, DIMENSION(:,:)   :: BI
 !f2py threadsafe
@@ -129,9 +132,16 @@
 !              ELSE
 !                 DMS = DM
 !              ENDIF
+!            EACH THREAD UPDATES ITS OWN Z-PLANES OF THE SHARED VOLUME
+!$omp        parallel private(j,ith,nth)
+             ITH = 0
+             NTH = 1
+!$           ITH = OMP_GET_THREAD_NUM()
+!$           NTH = OMP_GET_NUM_THREADS()
              DO J=-N2+1,N2
-               CALL ONELINE(J,N,N2,X,NR,BI,DMS,LN2,FLTB,L,TABI)
+               CALL ONELINE(J,N,N2,X,NR,BI,DMS,LN2,FLTB,L,TABI,ITH,NTH)
              ENDDO
+!$omp        end parallel
 !           ENDDO   ! END OF SYMMETRIES LOOP
 
 
@@ -81,6 +81,9 @@ C        REAL                  	   :: SM(3,3,MAXSYM)
         REAL                  	   :: SS(6)
 		REAL					   :: PSI,THETA,PHI
 		INTEGER					   :: NS,N,N2
+		INTEGER					   :: ITH,NTH
+c$		INTEGER					   :: OMP_GET_THREAD_NUM
+c$		INTEGER					   :: OMP_GET_NUM_THREADS
 
         COMPLEX, ALLOCATABLE, DIMENSION(:,:)   :: BI
 cf2py threadsafe
@@ -117,10 +120,18 @@ C              ELSE
 C                 DMS = DM
 C              ENDIF
 C,schedule(static)
-c$omp         parallel do private(j),shared(N,N2,JT,X,NR,BI,DMS)
+C             EACH THREAD UPDATES ITS OWN Z-PLANES OF THE SHARED VOLUME
+C             EVERY THREAD STILL COMPUTES EVERY POINT OF THE LINE, SO
+C             THIS ONLY SAVES MEMORY, IT DOES NOT SCALE WITH THREADS
+c$omp         parallel private(j,ith,nth),shared(N,N2,X,NR,BI,DMS)
+              ITH = 0
+              NTH = 1
+c$            ITH = OMP_GET_THREAD_NUM()
+c$            NTH = OMP_GET_NUM_THREADS()
               DO J=-N2+1,N2
-                 CALL ONELINENN(J,N,N2,X,NR,BI,DMS)
+                 CALL ONELINENN(J,N,N2,X,NR,BI,DMS,ITH,NTH)
               ENDDO
+c$omp         end parallel
 C           ENDDO   ! END OF SYMMETRIES LOOP
 
 
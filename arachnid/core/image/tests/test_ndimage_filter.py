@@ -4,6 +4,7 @@
 '''
 from .. import ndimage_filter, eman2_utility, ndimage_utility
 import numpy, numpy.testing
+import scipy.fftpack
 
 full_test=False
 
@@ -16,6 +17,17 @@ def test_filter_gaussian_highpass_2d_new():
     img = eman2_utility.gaussian_high_pass(img, sigma, 0)
     numpy.testing.assert_allclose(fimg, img, rtol=1.0, atol=1.0e-5)
 
+def test_gaussian_lowpass_cached():
+    width = 78
+    sigma = 0.1
+    img = numpy.random.normal(8, 4, (width,width)).astype(numpy.float32)
+    cimg = img.astype(numpy.complex64)
+    fimg = scipy.fftpack.fftshift(scipy.fftpack.fft2(cimg))
+    fimg *= ndimage_filter.gaussian_lowpass_kernel(cimg.shape, sigma, cimg.dtype)
+    simg = scipy.fftpack.ifft2(scipy.fftpack.ifftshift(fimg)).real
+    numpy.testing.assert_allclose(ndimage_filter.gaussian_lowpass(img, sigma), simg, rtol=1e-5, atol=1e-5)
+    numpy.testing.assert_allclose(ndimage_filter.gaussian_lowpass(img, sigma), simg, rtol=1e-5, atol=1e-5)
+
 def test_ramp(): # Big difference with this function!
     '''
     '''
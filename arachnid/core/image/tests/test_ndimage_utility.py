@@ -145,6 +145,26 @@ def test_powerspec_avg():
     avg = ndimage_utility.powerspec_avg(orig, 6)
     avg;
 
+def test_powerspec_batch():
+    '''
+    '''
+    
+    orig = numpy.random.rand(5,10,10).astype(numpy.float32)
+    avg1, total1 = ndimage_utility.powerspec_sum(orig.astype(numpy.float), 3)
+    avg2, total2 = ndimage_utility.powerspec_batch(orig, 3, batch_size=2)
+    numpy.testing.assert_equal(total1, total2)
+    numpy.testing.assert_allclose(numpy.abs(avg1), avg2, rtol=1e-4, atol=1e-4)
+
+def test_crop_windows():
+    '''
+    '''
+    
+    img = numpy.random.rand(50,60)
+    coords = [(0, 30, 25), (0, 3, 20), (0, 58, 25), (0, 30, 48)]
+    wins = ndimage_utility.crop_windows(img, coords, 10)
+    for i, c in enumerate(coords):
+        numpy.testing.assert_equal(ndimage_utility.crop_window(img, c[1], c[2], 5), wins[i])
+
 def test_biggest_object():
     '''
     '''
@@ -0,0 +1,81 @@
+'''
+.. Created on Oct 17, 2026
+'''
+from .. import projection_match
+import numpy, numpy.testing
+import scipy.ndimage
+
+def test_align_to_references():
+    '''
+    '''
+    
+    refs, angs = _references()
+    rng = numpy.random.RandomState(0)
+    for i in xrange(4):
+        r, ang, shift = rng.randint(len(refs)), rng.uniform(-180, 180), rng.randint(-4, 5, size=2)
+        img = _rotate_shift(refs[r], -ang, shift[0], shift[1])
+        vals = projection_match.align_to_references([img], refs, angs, trans_range=5, ring_last=24, test_mirror=False)[0]
+        rad = numpy.deg2rad(ang)
+        ca, sa = numpy.cos(rad), numpy.sin(rad)
+        numpy.testing.assert_equal(int(vals[3]), r+1)
+        numpy.testing.assert_allclose(vals[1:3], angs[r, 1:])
+        numpy.testing.assert_allclose(numpy.mod(vals[5]-ang+180, 360)-180, 0, atol=0.5)
+        numpy.testing.assert_allclose(vals[6:8], (-(ca*shift[0]+sa*shift[1]), sa*shift[0]-ca*shift[1]), atol=0.1)
+        assert(vals[10] > 0.99)
+
+def test_align_to_references_mirror():
+    '''
+    '''
+    
+    refs, angs = _references()
+    mirror = numpy.roll(refs[3][:, ::-1], 1, axis=1)
+    img = _rotate_shift(mirror, 40.0, 2, -3)
+    vals = projection_match.align_to_references([img], refs, angs, trans_range=5, ring_last=24)[0]
+    numpy.testing.assert_equal(int(vals[3]), -4)
+    numpy.testing.assert_equal(vals[14], 1)
+    numpy.testing.assert_allclose(vals[1:3], (180.0-angs[3, 1], angs[3, 2]+180.0))
+    ali = _rotate_shift(img, vals[5], vals[6], vals[7])
+    sel = numpy.hypot(*numpy.mgrid[-32:32, -32:32]) < 24
+    assert(numpy.corrcoef(ali[sel], mirror[sel])[0, 1] > 0.99)
+
+def test_polar_reference_bank():
+    '''
+    '''
+    
+    refs = _references()[0]
+    bank = projection_match.PolarReferenceBank(refs.shape[1:], ring_last=24)
+    numpy.testing.assert_equal(bank.add(refs[:3]), numpy.arange(3))
+    numpy.testing.assert_equal(bank.add(refs[3:]), numpy.arange(3, len(refs)))
+    full = projection_match.PolarReferenceBank(refs.shape[1:], len(refs), ring_last=24)
+    full.add(refs)
+    numpy.testing.assert_allclose(bank.spectra, full.spectra)
+    img = _rotate_shift(refs[5], -30.0, 0, 0)
+    angle, score, index = bank.score(img)
+    numpy.testing.assert_equal(numpy.argmax(score), 5)
+    numpy.testing.assert_allclose(angle[5], 30.0, atol=0.5)
+    numpy.testing.assert_equal(index, 0)
+
+def _references(n=64, count=8):
+    '''
+    '''
+    
+    rng = numpy.random.RandomState(1)
+    refs = numpy.zeros((count, n, n), dtype=numpy.float32)
+    for i in xrange(count):
+        img = numpy.zeros((n, n))
+        img[rng.randint(20, 44, size=6), rng.randint(20, 44, size=6)] = rng.rand(6)+0.5
+        refs[i] = scipy.ndimage.gaussian_filter(img, 2)
+    angs = numpy.column_stack((numpy.zeros(count), numpy.arange(count)*10.0, numpy.arange(count)*30.0))
+    return refs, angs
+
+def _rotate_shift(img, ang, tx, ty):
+    ''' Rotate then translate an image, following SPIDER's RT SQ
+    '''
+    
+    ny, nx = img.shape
+    y, x = numpy.mgrid[0:ny, 0:nx].astype(numpy.float)
+    x -= nx/2 + tx
+    y -= ny/2 + ty
+    rad = numpy.deg2rad(ang)
+    ca, sa = numpy.cos(rad), numpy.sin(rad)
+    return scipy.ndimage.map_coordinates(img, [ny/2 + sa*x + ca*y, nx/2 + ca*x - sa*y], order=3)
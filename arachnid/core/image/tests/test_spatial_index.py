@@ -0,0 +1,29 @@
+'''
+.. Created on Oct 17, 2026
+'''
+from .. import spatial_index
+import numpy, numpy.testing
+import scipy.spatial
+
+def test_pairs_within():
+    '''
+    '''
+    
+    coords = numpy.round(numpy.random.rand(200, 2)*300)
+    i, j, d2 = spatial_index.pairs_within(coords, 25)
+    dist = scipy.spatial.distance.squareform(scipy.spatial.distance.pdist(coords, 'sqeuclidean'))
+    ei, ej = numpy.nonzero(numpy.triu(dist <= 25*25, 1))
+    numpy.testing.assert_equal(sorted(zip(i, j)), sorted(zip(ei, ej)))
+    numpy.testing.assert_allclose(d2, dist[i, j])
+
+def test_non_maximum_suppression():
+    '''
+    '''
+    
+    coords = numpy.round(numpy.random.rand(200, 2)*300)
+    scores = numpy.random.rand(200)
+    sel = spatial_index.non_maximum_suppression(coords, scores, 25)
+    keep = []
+    for i in numpy.argsort(-scores):
+        if all([numpy.sum(numpy.square(coords[i]-coords[k])) >= 25*25 for k in keep]): keep.append(i)
+    numpy.testing.assert_equal(numpy.flatnonzero(sel), sorted(keep))
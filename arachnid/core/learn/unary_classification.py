@@ -256,6 +256,66 @@ def otsu(data, bins=0):
     else: index_high = index+1
     return (thresholds[index_low]+thresholds[index_high]) / 2
 
+def otsu_batch(data, bins=0):
+    ''' Otsu's threshold selection algorithm applied to each row of the data
+    
+    This gives the same threshold as :py:func:`otsu` for each row.
+    
+    :Parameters:
+        
+        data : numpy.ndarray
+               Data to find threshold, one set per row (or per first index)
+        bins : int
+               Number of bins [if 0, use sqrt(len(data))]
+    
+    :Returns:
+        
+        th : numpy.ndarray
+             Optimal threshold to divide classes for each row
+    '''
+    
+    data = numpy.sort(numpy.asarray(data).reshape((len(data), -1)), axis=1)
+    n = data.shape[1]
+    if bins <= 0: bins = int(numpy.sqrt(n))
+    if bins > n: bins = n
+    var = _running_variance_rows(data)
+    rvar = numpy.fliplr(_running_variance_rows(numpy.fliplr(data)))
+    
+    rng = n/bins
+    thresholds = data[:, 1:n:rng]
+    idx = numpy.arange(0,n-1,rng, dtype=numpy.int)
+    score_low = (var[:, idx] * idx)
+    idx = numpy.arange(1,n,rng, dtype=numpy.int)
+    score_high = (rvar[:, idx] * (n - idx))
+    scores = score_low + score_high
+    if scores.shape[1] == 0: return thresholds[:, 0]
+    index = scores.argmin(axis=1)
+    index_low = numpy.maximum(index-1, 0)
+    index_high = numpy.minimum(index+1, thresholds.shape[1]-1)
+    rows = numpy.arange(len(data))
+    return (thresholds[rows, index_low]+thresholds[rows, index_high]) / 2
+
+def _running_variance_rows(x):
+    ''' Compute the running variance of each row, see :py:func:`running_variance`
+    
+    :Parameters:
+        
+        x : numpy.ndarray
+            Data sorted along each row
+    
+    :Returns:
+        
+        var : numpy.ndarray
+              Running variance of each row
+    '''
+    
+    n = x.shape[1]
+    m = x.cumsum(axis=1) / numpy.arange(1,n+1)
+    s = ((x[:, 1:]-m[:, :-1])*(x[:, 1:]-m[:, 1:])).cumsum(axis=1)
+    var = numpy.zeros(x.shape)
+    var[:, 1:] = s / numpy.arange(2,n+1)
+    return var
+
 def running_variance(x, axis=None):
     '''Given a vector x, compute the variance for x[0:i]
     
@@ -78,12 +78,13 @@ from formats import csv, prediction, spiderdoc, spidersel, star #, frealign, mrc
 #from format_utility import ParseFormatError, WriteFormatError
 from factories import namedtuple_factory
 import format_utility, namedtuple_utility,spider_utility
-import os, numpy, logging
+import os, numpy, logging, hashlib
 
 #__formats = [star, spiderdoc, spidersel, frealign, mrccoord, csv, prediction]
 __formats = [star, spiderdoc, spidersel, csv, prediction]
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.INFO)
+_cache_dir = None
 
 def filters(formats=None):
     '''Get a list file filters from a list of supported formats
@@ -447,7 +448,16 @@ def read(filename, columns=None, header=None, ndarray=False, map_ids=None, facto
                List of namedtuples or other container created by the factory
     '''
     
-    if ndarray:extra['numeric']=True
+    if ndarray:
+        table = _read_cached_columns(filename, header, **extra)
+        if table is not None and table[2]: return table_to_numpy(_columns_to_table(*table[:2]))
+        extra['numeric']=True
+    elif _cache_dir is not None and extra.get('numeric') and columns is None:
+        table = _read_cached_columns(filename, header, **extra)
+        if table is not None and table[2]:
+            vals = _columns_to_values(table[0], table[1], factory, table[3], **extra)
+            if map_ids: return format_utility.map_object_list(vals, map_ids)
+            return vals
     
     _logger.debug("read: "+str(filename))
     origheader = [] if header is None else list(header)
@@ -495,6 +505,468 @@ def read(filename, columns=None, header=None, ndarray=False, map_ids=None, facto
     elif map_ids: return format_utility.map_object_list(vals, map_ids)
     return vals
 
+def read_table(filename, header=None, **extra):
+    '''Read a document into a record array with one field for each column
+    
+    Star and Spider document files are tokenized in bulk and the type of each column
+    is inferred once (int, float or string) rather than converting each value
+    and creating a namedtuple for each row. Other formats are read with
+    :py:func:`read` and converted.
+    
+    A string column of Relion identifiers (e.g. `000001@stack_00010.mrcs` in rlnImageName)
+    is split into two additional integer columns: `<name>_index` holding the index
+    in the stack and `<name>_fileid` holding the SPIDER ID of the stack (-1 if
+    the stack does not have one).
+    
+    >>> from arachnid.core.metadata.format import *
+    >>> table = read_table("data.star")
+    >>> table.rlnDefocusU
+    array([13538, 13293, 13626])
+    >>> table.rlnImageName_index
+    array([1, 2, 3])
+    
+    .. note::
+        
+        Only the first table of a Star file with multiple tables is read
+    
+    :Parameters:
+        
+        filename : str
+                  Path of a file
+        header : str, optional
+                 Header to use for read-in list
+        extra : dict
+                Unused extra keyword arguments
+    
+    :Returns:
+        
+        table : numpy.recarray
+                Record array with one field for each column
+    '''
+    
+    table = _read_cached_columns(filename, header, **extra)
+    if table is None:
+        extra['numeric']=True
+        if 'ndarray' in extra: del extra['ndarray']
+        return table_from_values(read(filename, header=header, **extra))
+    return _columns_to_table(*table[:2])
+
+def _read_columns(filename, header=None, chunk_size=65536, **extra):
+    '''Tokenize each column of a Star or Spider document file
+    
+    :Parameters:
+        
+        filename : str
+                  Path of a file
+        header : str, optional
+                 Header to use for read-in list
+        chunk_size : int
+                     Number of lines tokenized together
+        extra : dict
+                Unused extra keyword arguments
+    
+    :Returns:
+        
+        header : list
+                 List of column names
+        columns : list
+                  List of arrays, one for each column, None if the file is
+                  not a Star or Spider document or has mixed types in a column
+        complete : bool
+                   False if the file has more tables than the first
+        missing : list
+                  List of boolean arrays, one for each column, that flag the
+                  missing values (`-`) in a numeric column, or None
+    '''
+    
+    extra['numeric']=False
+    if 'ndarray' in extra: del extra['ndarray']
+    fin, format, header, first_vals = get_format(filename, getformat=False, header=header, **extra)
+    complete = True
+    try:
+        if format != star and format != spiderdoc: return None
+        lines = []
+        for line in fin:
+            line = line.strip()
+            if line == "" or line[0] == ';' or line[0] == '#': continue
+            if line[:5] == 'data_':
+                _logger.warn("Only the first table is read: %s"%filename)
+                complete = False
+                break
+            lines.append(line)
+    finally: fin.close()
+    
+    hlen = len(header)
+    if len(lines) == 0:
+        # The only row (if any) was parsed with the header, without the key and count columns
+        columns, missing = zip(*[_parse_column(list(first_vals[i:i+1])) for i in xrange(hlen)]) if hlen > 0 else ([], [])
+        return header, list(columns), complete, list(missing)
+    ncol = len(lines[0].split())
+    if format == spiderdoc:
+        if ncol == hlen+2: offsets = range(2, ncol)
+        elif ncol == hlen+1: offsets = [0]+range(2, ncol)
+        else: raise format_utility.ParseFormatError, "Header length does not match values: %d != %d"%(hlen, ncol)
+    else:
+        if ncol != hlen: raise format_utility.ParseFormatError, "Header length does not match values: %d != %d"%(hlen, ncol)
+        offsets = range(ncol)
+    
+    chunks = [[] for i in xrange(hlen)]
+    masks = [[] for i in xrange(hlen)]
+    for beg in xrange(0, max(len(lines), 1), chunk_size):
+        tokens = " ".join(lines[beg:beg+chunk_size]).split()
+        nrow = min(chunk_size, len(lines)-beg)
+        if len(tokens) != ncol*nrow:
+            raise format_utility.ParseFormatError, "Number of values does not match the header: %d != %d"%(len(tokens), ncol*nrow)
+        for i, off in enumerate(offsets):
+            col = tokens[off::ncol]
+            if beg == 0: col.insert(0, first_vals[i])
+            vals, mask = _parse_column(col, len(chunks[i]) == 0 or chunks[i][0].dtype.kind == 'f')
+            if len(chunks[i]) > 0 and (vals.dtype.kind == 'f') != (chunks[i][0].dtype.kind == 'f'): return None
+            chunks[i].append(vals)
+            masks[i].append(mask)
+        del tokens
+    missing = []
+    for c, m in zip(chunks, masks):
+        if all([v is None for v in m]): missing.append(None)
+        else: missing.append(numpy.concatenate([numpy.zeros(len(v), dtype=numpy.bool) if k is None else k for v, k in zip(c, m)]))
+    return header, [numpy.concatenate(c) if len(c) > 1 else c[0] for c in chunks], complete, missing
+
+def enable_cache(cache_dir=""):
+    '''Cache the parsed values of Star and Spider document files in binary files
+    
+    Each document file read is cached in a binary sidecar file (numpy `.npz`), which
+    is loaded on subsequent reads as long as the size and modification time of the
+    document file are unchanged.
+    
+    >>> from arachnid.core.metadata import format
+    >>> format.enable_cache()
+    >>> vals = format.read("data.star", numeric=True) # Parse and write .data.star.npz
+    >>> vals = format.read("data.star", numeric=True) # Load .data.star.npz
+    
+    .. note::
+        
+        Only numeric reads (`numeric=True`, `ndarray=True` or :py:func:`read_table`) use the cache
+    
+    :Parameters:
+        
+        cache_dir : str
+                    Directory for the cache files, if empty write each next to its document
+                    file as a hidden file, if None disable the cache
+    '''
+    
+    global _cache_dir
+    
+    _cache_dir = cache_dir
+
+def cache_filename(filename):
+    '''Get the name of the cache file for a document file
+    
+    :Parameters:
+        
+        filename : str
+                  Path of a document file
+    
+    :Returns:
+        
+        cache_file : str
+                     Path of the cache file
+    '''
+    
+    filename = os.path.abspath(filename)
+    if _cache_dir:
+        return os.path.join(_cache_dir, hashlib.md5(filename).hexdigest()+'_'+os.path.basename(filename)+'.npz')
+    return os.path.join(os.path.dirname(filename), '.'+os.path.basename(filename)+'.npz')
+
+def _read_cached_columns(filename, header=None, **extra):
+    '''Tokenize each column of a Star or Spider document file, using the cache
+    if enabled
+    
+    :Parameters:
+        
+        filename : str
+                  Path of a file
+        header : str, optional
+                 Header to use for read-in list
+        extra : dict
+                Unused extra keyword arguments
+    
+    :Returns:
+        
+        header : list
+                 List of column names
+        columns : list
+                  List of arrays, see :py:func:`_read_columns`
+        complete : bool
+                   False if the file has more tables than the first
+        missing : list
+                  List of boolean arrays flagging missing values or None, see :py:func:`_read_columns`
+    '''
+    
+    if _cache_dir is None: return _read_columns(filename, header, **extra)
+    key = repr((filename, header))
+    source, fin = open_file(filename, header=list(header) if isinstance(header, list) else header, **extra)[:2]
+    fin.close()
+    source = os.path.abspath(source)
+    stat = os.stat(source)
+    cache_file = cache_filename(source)
+    try:
+        cache = numpy.load(cache_file)
+        try:
+            if str(cache['source']) == source and int(cache['size']) == stat.st_size and float(cache['mtime']) == stat.st_mtime and str(cache['key']) == key:
+                names = list(cache['header'])
+                missing = [cache['m%d'%i] if 'm%d'%i in cache.files else None for i in xrange(len(names))]
+                return names, [cache['c%d'%i] for i in xrange(len(names))], bool(cache['complete']), missing
+        finally: cache.close()
+    except IOError: pass
+    except:
+        _logger.debug("Cannot load cache file: %s"%cache_file)
+    table = _read_columns(filename, header, **extra)
+    if table is None: return None
+    names, columns, complete, missing = table
+    try:
+        pathname = os.path.dirname(cache_file)
+        if pathname != "" and not os.path.exists(pathname): os.makedirs(pathname)
+        tmp_file = cache_file+'.%d.npz'%os.getpid()
+        arrays = dict([('c%d'%i, col) for i, col in enumerate(columns)])
+        arrays.update([('m%d'%i, mask) for i, mask in enumerate(missing) if mask is not None])
+        numpy.savez(tmp_file, source=source, size=stat.st_size, mtime=stat.st_mtime, key=key, header=numpy.asarray(names), complete=complete, **arrays)
+        os.rename(tmp_file, cache_file)
+    except:
+        _logger.debug("Cannot write cache file: %s"%cache_file)
+    return table
+
+def _columns_to_values(header, columns, factory=namedtuple_factory, missing=None, **extra):
+    '''Create a list of namedtuples from a list of columns
+    
+    Each value has the same type as when converted by :py:func:`format_utility.convert`.
+    
+    :Parameters:
+        
+        header : list
+                 List of column names
+        columns : list
+                  List of arrays, one for each column
+        factory : Factory
+                  Class or module that creates the container for the values
+        missing : list, optional
+                  List of boolean arrays flagging the missing values of each column, which are set to None
+        extra : dict
+                Unused extra keyword arguments
+    
+    :Returns:
+        
+        values : list
+                 List of namedtuples or other container created by the factory
+    '''
+    
+    if missing is None: missing = [None]*len(columns)
+    cols = []
+    for col, mask in zip(columns, missing):
+        if col.dtype.kind == 'f':
+            vals = col.astype(numpy.object)
+            integral = numpy.isfinite(col)
+            integral[integral] = numpy.logical_and(col[integral] == numpy.floor(col[integral]), numpy.abs(col[integral]) < 2**62)
+            if numpy.any(integral): vals[integral] = col[integral].astype(numpy.int64).astype(numpy.object)
+            if mask is not None: vals[mask] = None
+            cols.append(vals.tolist())
+        else:
+            vals = col.astype(numpy.object)
+            # Only values composed of characters found in numbers can be converted
+            numeric = numpy.char.strip(col, '0123456789+-.eEnaifNAIFtyTY') == ''
+            vals[numeric] = map(format_utility.convert, col[numeric].tolist())
+            cols.append(vals.tolist())
+    factory_bldr = factory.create(header, [c[0] for c in cols] if len(columns) > 0 and len(columns[0]) > 0 else [], **extra)
+    return map(factory_bldr, zip(*cols))
+
+def _parse_column(tokens, numeric=True):
+    '''Convert the tokens of a column to an array
+    
+    :Parameters:
+        
+        tokens : list
+                 List of string values
+        numeric : bool
+                  Try to convert the values to float
+    
+    :Returns:
+        
+        vals : numpy.ndarray
+               Array of floats or strings
+        missing : numpy.ndarray
+                  Boolean array flagging the missing values (`-`) of a float column, or None
+    '''
+    
+    if numeric:
+        vals = numpy.fromstring(" ".join(tokens), sep=" ")
+        # Parsing stops at the first invalid value, which may be a partially parsed last token (e.g. 1@stack.spi)
+        if len(vals) == len(tokens) and (len(tokens) == 0 or _is_float(tokens[-1])): return vals, None
+        vals = numpy.asarray(tokens)
+        missing = vals == '-'
+        vals[missing] = 'nan'
+        try: return vals.astype(numpy.float), (missing if numpy.any(missing) else None)
+        except ValueError: pass
+    return numpy.asarray(tokens), None
+
+def _is_float(token):
+    '''Test if a string is a floating point number
+    
+    :Parameters:
+        
+        token : str
+                String value
+    
+    :Returns:
+        
+        valid : bool
+                True if the string can be converted to a float
+    '''
+    
+    try: float(token)
+    except ValueError: return False
+    return True
+
+def _columns_to_table(header, columns):
+    '''Create a record array from a list of columns
+    
+    Integral float columns are converted to integers and string columns
+    of Relion identifiers are split into an index and a SPIDER ID column.
+    
+    :Parameters:
+        
+        header : list
+                 List of column names
+        columns : list
+                  List of arrays, one for each column
+    
+    :Returns:
+        
+        table : numpy.recarray
+                Record array with one field for each column
+    '''
+    
+    names, arrays = [], []
+    for name, col in zip(header, columns):
+        if col.dtype.kind == 'f' and numpy.all(numpy.isfinite(col)) and numpy.all(col == numpy.floor(col)) and (len(col) == 0 or numpy.abs(col).max() < 2**53):
+            col = col.astype(numpy.int64)
+        names.append(name)
+        arrays.append(col)
+        if col.dtype.kind not in ('S', 'U') or len(col) == 0: continue
+        parts = numpy.char.partition(col, '@')
+        if not numpy.all(parts[:, 1] == '@'): continue
+        try: index = parts[:, 0].astype(numpy.int64)
+        except ValueError: continue
+        stacks, inverse = numpy.unique(parts[:, 2], return_inverse=True)
+        fileid = numpy.zeros(len(stacks), dtype=numpy.int64)
+        for i in xrange(len(stacks)):
+            try: fileid[i] = spider_utility.spider_id(stacks[i])
+            except: fileid[i] = -1
+        names.extend([name+'_index', name+'_fileid'])
+        arrays.extend([index, fileid[inverse]])
+    return numpy.rec.fromarrays(arrays, names=names)
+
+def table_from_values(values):
+    '''Convert a list of namedtuples to a record array
+    
+    :Parameters:
+        
+        values : list
+                 List of namedtuples
+    
+    :Returns:
+        
+        table : numpy.recarray
+                Record array with one field for each column, see :py:func:`read_table`
+    '''
+    
+    if len(values) == 0: raise ValueError, "No values to convert"
+    header = list(values[0]._fields)
+    columns = []
+    for col in zip(*values):
+        col = numpy.asarray(col)
+        if col.dtype.kind not in ('i', 'u', 'b', 'f', 'S', 'U'): col = numpy.asarray(map(str, col))
+        columns.append(col)
+    return _columns_to_table(header, columns)
+
+def table_to_values(table, factory=namedtuple_factory):
+    '''Convert a record array to a list of namedtuples
+    
+    The integer columns created from Relion identifiers by :py:func:`read_table`
+    are not included.
+    
+    :Parameters:
+        
+        table : numpy.recarray
+                Record array with one field for each column
+        factory : Factory
+                  Class or module that creates the container for the values
+    
+    :Returns:
+        
+        values : list
+                 List of namedtuples or other container created by the factory
+    '''
+    
+    header = [name for name in table.dtype.names if not _is_identifier_column(table, name)]
+    factory_bldr = factory.create(header, None)
+    return map(factory_bldr, zip(*[table[name].tolist() for name in header]))
+
+def table_to_numpy(table):
+    '''Convert a record array to a 2D array of floats
+    
+    String columns are dropped, except the first column of Relion identifiers: its
+    stack index replaces the string and its SPIDER ID is added as the first column,
+    `fileid`, as with :py:func:`namedtuple_utility.tuple2numpy`.
+    
+    :Parameters:
+        
+        table : numpy.recarray
+                Record array with one field for each column
+    
+    :Returns:
+        
+        out : array
+              Array containing the numeric values of the table
+        header : list
+                 List of headers for each column of the array
+    '''
+    
+    header, columns = [], []
+    ids = [name for name in table.dtype.names if name+'_fileid' in table.dtype.names and name+'_index' in table.dtype.names]
+    if len(ids) > 0:
+        header.append('fileid')
+        columns.append(table[ids[0]+'_fileid'])
+    for name in table.dtype.names:
+        if len(ids) > 0 and name == ids[0]:
+            header.append(name)
+            columns.append(table[name+'_index'])
+        elif table.dtype[name].kind in ('i', 'u', 'f', 'b') and not _is_identifier_column(table, name):
+            header.append(name)
+            columns.append(table[name])
+    out = numpy.zeros((len(table), len(columns)))
+    for i, col in enumerate(columns): out[:, i] = col
+    return out, header
+
+def _is_identifier_column(table, name):
+    '''Test if the column was created from a column of Relion identifiers
+    
+    :Parameters:
+        
+        table : numpy.recarray
+                Record array with one field for each column
+        name : str
+               Name of the column
+    
+    :Returns:
+        
+        flag : bool
+               True if the column holds the stack index or SPIDER ID of another column
+    '''
+    
+    for suffix in ('_index', '_fileid'):
+        if name.endswith(suffix) and name[:-len(suffix)] in table.dtype.names:
+            return table.dtype[name[:-len(suffix)]].kind in ('S', 'U')
+    return False
+
 def write(filename, values, mode='w', factory=namedtuple_factory, **extra):
     ''' Write a document to some format either specified or determined from extension
 
@@ -559,15 +1031,94 @@ def write(filename, values, mode='w', factory=namedtuple_factory, **extra):
     if format !=  spiderdoc and os.path.splitext(filename)[1][1:] != format.extension():
         filename = os.path.splitext(filename)[0] + "." + format.extension()
     filename, fout = open_file(filename, mode=mode, **extra)
-    values = factory.ensure_container(values, **extra)
-    extra['header'] = factory.get_header(values, **extra)
+    columns = None
+    if factory == namedtuple_factory and hasattr(format, 'write_columns'):
+        columns = _values_to_columns(values, extra.get('header', None))
+    if columns is None:
+        values = factory.ensure_container(values, **extra)
+        extra['header'] = factory.get_header(values, **extra)
+    else: extra['header'], columns = columns
     extra['header'] = format.write_header(fout, values, mode, **extra)
     if hasattr(format, 'float_format'): extra['float_format']=format.float_format()
     if hasattr(format, 'valid_entry'): extra['valid_entry']=format.valid_entry
-    format.write_values(fout, factory.format_iter(values, **extra), **extra)
+    if columns is not None: format.write_columns(fout, columns, **extra)
+    else: format.write_values(fout, factory.format_iter(values, **extra), **extra)
     fout.close()
     return filename
 
+def write_table(filename, table, header=None, **extra):
+    '''Write a record array or dictionary of columns to a document file
+    
+    The Star, Spider document and CSV formats are written a whole column
+    at a time, the other formats are written as a list of namedtuples.
+    
+    .. sourcecode:: py
+        
+        >>> from arachnid.core.metadata.format import *
+        >>> write_table("data.star", dict(id=numpy.arange(1, 4), x=[572, 738, 810], y=[228, 144, 298]), header=['id', 'x', 'y'])
+        'data.star'
+    
+    :Parameters:
+        
+        filename : str
+                  Output filename
+        table : array or dict
+                Record array or dictionary of columns
+        header : list, optional
+                 List of columns to write, required for a dictionary of columns. By
+                 default, the record array columns except those created from Relion
+                 identifiers by :py:func:`read_table`
+        extra : dict
+                Keyword arguments passed to :py:func:`write`
+    
+    :Returns:
+        
+        val : str
+               Path to file created by this function
+    '''
+    
+    if isinstance(table, dict):
+        if header is None: raise ValueError, "A dictionary of columns requires that you specify a header"
+        table = numpy.rec.fromarrays([numpy.asarray(table[h]) for h in header], names=header)
+    elif header is None:
+        header = [name for name in table.dtype.names if not _is_identifier_column(table, name)]
+    return write(filename, table, header=list(header), **extra)
+
+def _values_to_columns(values, header=None):
+    '''Get the columns of a list of namedtuples, a record array or a 2D array
+    
+    :Parameters:
+        
+        values : list or array
+                 List of namedtuples, record array or 2D array of numbers
+        header : list, optional
+                 List of columns to get, required for a 2D array
+    
+    :Returns:
+        
+        header : list
+                 List of column names
+        columns : list
+                  List of columns, None if the values cannot be split into columns
+    '''
+    
+    if header is not None and not isinstance(header, (list, tuple)): return None
+    if hasattr(values, 'dtype') and values.dtype.names is not None:
+        if header is None: header = [name for name in values.dtype.names if not _is_identifier_column(values, name)]
+        if not all([h in values.dtype.names for h in header]): return None
+        return list(header), [values[h] for h in header]
+    if hasattr(values, 'shape'):
+        if header is None or values.ndim != 2 or values.shape[1] != len(header) or values.dtype.kind not in ('b', 'i', 'u', 'f'): return None
+        return list(header), [values[:, i] for i in xrange(len(header))]
+    if not isinstance(values, list) or len(values) == 0 or not hasattr(values[0], '_fields'): return None
+    rowtype = values[0].__class__
+    if not all([v.__class__ is rowtype for v in values]): return None
+    fields = values[0]._fields
+    if header is None: header = fields
+    columns = zip(*values)
+    index = dict([(f, i) for i, f in enumerate(fields)])
+    return list(header), [columns[index[h]] if h in index else [0.0]*len(values) for h in header]
+
 def write_dataset(output, feat, id=None, label=None, good=None, header=None, sort=False, id_len=0, prefix=None, **extra):
     '''Write a set of non-tuple arrays representing a dataset to a file
     
@@ -682,7 +1233,8 @@ def read_alignment(filename, header=None, **extra):
             align = read(filename, numeric=True, header=h, **extra)
         except: pass
         else: 
-            if len(align) == 0 or align[0]._fields[0]=='epsi':
+            fields = align[1] if isinstance(align, tuple) else (align[0]._fields if len(align) > 0 else None)
+            if fields is None or fields[0]=='epsi':
                 break
     if align is None:
         align = read(filename, numeric=True, header=header, **extra)
@@ -4,7 +4,7 @@
 .. codeauthor:: Robert Langlois <rl2528@columbia.edu>
 '''
 
-import format, spider_utility, relion_utility
+import format, spider_utility
 import spider_params
 from ..orient import spider_transforms
 from ..image import ndimage_file
@@ -91,80 +91,50 @@ def read_alignment(filename, image_file, use_3d=False, align_cols=7, force_list=
     supports_spider_id="" if not force_list else None
     if isinstance(filename, list) and len(filename) > 0 and hasattr(filename[0], 'rlnImageName') or (not isinstance(filename, list) and is_relion_star(filename)):
         if isinstance(filename, list):
-            align=filename
+            align = format.table_from_values(filename)
         else:
-            align = format.read(filename, **extra)
+            align = format.read_table(filename, **extra)
+        if 'rlnClassNumber' in align.dtype.names and class_index > 0:
+            align = align[align.rlnClassNumber == class_index]
         param = numpy.zeros((len(align), align_cols))
-        files = []
-        fileset=set()
+        stacks, inverse = numpy.unique(numpy.char.partition(align.rlnImageName, '@')[:, 2], return_inverse=True)
+        stacks = [spider_utility.spider_filename(image_file, f) if image_file != "" else str(f) for f in stacks]
+        index = align.rlnImageName_index
+        files = None
+        fileset=set(stacks)
+        if supports_spider_id is not None:
+            paths = set([spider_utility.spider_filepath(f) for f in fileset if spider_utility.is_spider_filename(f)])
+            if len(paths) > 1: supports_spider_id=None
         if use_3d:
             _logger.info("Standard Relion alignment file - leave 3D")
-            for i in xrange(len(align)):
-                if hasattr(align[i], 'rlnClassNumber') and class_index > 0:
-                    if align[i].rlnClassNumber != class_index: continue
-                filename, index = relion_utility.relion_file(align[i].rlnImageName)
-                if image_file != "":
-                    filename = spider_utility.spider_filename(image_file, filename)
-                    
-                files.append((filename, index))
-                fileset.add(filename)
-                if supports_spider_id is not None and spider_utility.is_spider_filename(files[-1][0]):
-                    if supports_spider_id == "":
-                        supports_spider_id = spider_utility.spider_filepath(files[-1][0])
-                    elif supports_spider_id != spider_utility.spider_filepath(files[-1][0]):
-                        supports_spider_id=None
-                j = len(files)-1
-                param[j, 0] = align[i].rlnAnglePsi
-                param[j, 1] = align[i].rlnAngleTilt
-                param[j, 2] = align[i].rlnAngleRot
-                #param[j, 3] = align[i].
-                param[j, 4] = align[i].rlnOriginX
-                param[j, 5] = align[i].rlnOriginY
-                if hasattr(align[i], 'rlnDefocusV'):
-                    param[j, 6] = (align[i].rlnDefocusU+align[i].rlnDefocusV)/2
-                else:
-                    param[j, 6] = align[i].rlnDefocusU
+            param[:, 0] = align.rlnAnglePsi
+            param[:, 4] = align.rlnOriginX
+            param[:, 5] = align.rlnOriginY
         else:
             _logger.info("Standard Relion alignment file - convert to 2D")
-            for i in xrange(len(align)):
-                if hasattr(align[i], 'rlnClassNumber') and class_index > 0:
-                    if align[i].rlnClassNumber != class_index: continue
-                filename, index = relion_utility.relion_file(align[i].rlnImageName)
-                if image_file != "":
-                    filename = spider_utility.spider_filename(image_file, filename)
-                files.append((filename, index))
-                fileset.add(filename)
-                if supports_spider_id is not None and spider_utility.is_spider_filename(files[-1][0]): 
-                    if supports_spider_id == "":
-                        supports_spider_id = spider_utility.spider_filepath(files[-1][0])
-                    elif supports_spider_id != spider_utility.spider_filepath(files[-1][0]):
-                        supports_spider_id=None
-                j = len(files)-1
-                param[j, 1] = align[i].rlnAngleTilt
-                param[j, 2] = align[i].rlnAngleRot
-                rot, tx, ty = spider_transforms.align_param_3D_to_2D(align[i].rlnAnglePsi, align[i].rlnOriginX, align[i].rlnOriginY)
-                param[j, 3] = rot
-                param[j, 4] = tx
-                param[j, 5] = ty
-                if hasattr(align[i], 'rlnDefocusV'):
-                    param[j, 6] = (align[i].rlnDefocusU+align[i].rlnDefocusV)/2
-                else:
-                    param[j, 6] = align[i].rlnDefocusU
-        param = param[:len(files)]
+            param[:, 3:6] = numpy.column_stack(spider_transforms.align_param_3D_to_2D(align.rlnAnglePsi.astype(numpy.float), align.rlnOriginX, align.rlnOriginY))
+        param[:, 1] = align.rlnAngleTilt
+        param[:, 2] = align.rlnAngleRot
+        if 'rlnDefocusV' in align.dtype.names:
+            param[:, 6] = (align.rlnDefocusU+align.rlnDefocusV)/2.0
+        else:
+            param[:, 6] = align.rlnDefocusU
         assert(numpy.alltrue(param[:, 6]>0.0))
         if supports_spider_id is not None:
             label = numpy.zeros((len(param), 2), dtype=numpy.int)
-            for i in xrange(len(files)): label[i, :] = (spider_utility.spider_id(files[i][0]), files[i][1])
+            label[:, 0] = numpy.asarray([spider_utility.spider_id(f) for f in stacks], dtype=numpy.int)[inverse]
+            label[:, 1] = index
             if len(fileset) == len(numpy.unique(label[:, 0]).squeeze()):
                 label[:, 1]-=1
-                files = (files[0][0], label)
+                files = (stacks[inverse[0]], label)
                 if label[:, 1].min() < 0: raise ValueError, "Cannot have a negative index"
             else:
                 _logger.warn("Input filenames appear to be SPIDER but the ID is not unique")
+        if files is None: files = [(stacks[j], int(i)) for i, j in zip(index, inverse)]
         if ctf_params:
-            ctf_param=dict(cs=align[0].rlnSphericalAberration,
-                           voltage=align[0].rlnVoltage,
-                           ampcont=align[0].rlnAmplitudeContrast) if len(align) > 0 else {}
+            ctf_param=dict(cs=align[0].rlnSphericalAberration.item(),
+                           voltage=align[0].rlnVoltage.item(),
+                           ampcont=align[0].rlnAmplitudeContrast.item()) if len(align) > 0 else {}
     else:
         if ctf_params: 
             ctf_param=spider_params.read(extra['param_file'])
@@ -265,7 +235,8 @@ def read_spider_alignment(filename, header=None, **extra):
             align = format.read(filename, numeric=True, header=h, **extra)
         except: pass
         else: 
-            if len(align) == 0 or align[0]._fields[0]=='epsi':
+            fields = align[1] if isinstance(align, tuple) else (align[0]._fields if len(align) > 0 else None)
+            if fields is None or fields[0]=='epsi':
                 break
     if align is None:
         align = format.read(filename, numeric=True, header=header, **extra)
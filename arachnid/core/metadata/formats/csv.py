@@ -238,6 +238,30 @@ def write_values(filename, values, csv_separtor=',', **extra):
         fout.write(csv_separtor.join(v)+"\n")
     if isinstance(filename, str): fout.close()
         
+def write_columns(filename, columns, float_format="%.8g", csv_separtor=',', **extra):
+    '''Write columns of values in the comma separated value (CSV) format
+    
+    This produces the same output as :py:func:`write_values` but formats
+    whole columns at once.
+    
+    :Parameters:
+    
+    filename : str or stream
+               Output filename or stream
+    columns : list
+              List of columns, each a list or array of values
+    float_format : str
+                   Format for numeric values
+    csv_separtor : str
+                   Seperator for data values
+    extra : dict
+            Unused keyword arguments
+    '''
+    
+    fout = open(filename, 'w') if isinstance(filename, str) else filename
+    fout.write(format_utility.format_columns(columns, float_format, csv_separtor))
+    if isinstance(filename, str): fout.close()
+
 ############################################################################################################
 # Extension and Filters                                                                                    #
 ############################################################################################################
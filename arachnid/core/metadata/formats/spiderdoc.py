@@ -22,6 +22,7 @@ It supports the following attributes:
 '''
 from .. import format_utility
 from ..spider_utility import spider_header_vars
+import numpy
 import logging
 
 _logger = logging.getLogger(__name__)
@@ -311,6 +312,34 @@ def write_values(fout, values, header, write_offset=1, **extra):
         fout.write("\n")
         index += 1
             
+def write_columns(fout, columns, header, float_format="%11g", write_offset=1, **extra):
+    '''Write columns of values in the spider document format
+    
+    This produces the same output as :py:func:`write_values` but formats
+    whole columns at once.
+    
+    :Parameters:
+    
+    fout : stream
+           Output stream
+    columns : list
+              List of columns, each a list or array of values
+    header : list
+             List of string describing the header
+    float_format : str
+                   Format for numeric values
+    write_offset : int, optional
+                   ID offset in SPIDER document
+    extra : dict
+            Unused keyword arguments
+    '''
+    
+    total = len(columns[0])
+    index = numpy.arange(write_offset, write_offset+total)
+    count = numpy.repeat(len(header), total)
+    formats = ["%d", "%2d"]+[None]*len(columns)
+    fout.write(format_utility.format_columns([index, count]+list(columns), float_format, ' ', formats))
+
 def float_format():
     ''' Format for a floating point number
     
@@ -316,6 +316,30 @@ def write_values(filename, values, star_separtor=' ', **extra):
         fout.write(star_separtor.join(v)+"\n")
     if isinstance(filename, str): fout.close()
     
+def write_columns(filename, columns, float_format="%11g", star_separtor=' ', **extra):
+    '''Write columns of values in the comma separated value (Star) format
+    
+    This produces the same output as :py:func:`write_values` but formats
+    whole columns at once.
+    
+    :Parameters:
+        
+        filename : str or stream
+                   Output filename or stream
+        columns : list
+                  List of columns, each a list or array of values
+        float_format : str
+                       Format for numeric values
+        star_separtor : str
+                        Separator for data values
+        extra : dict
+                Unused keyword arguments
+    '''
+    
+    fout = open(filename, 'w') if isinstance(filename, str) else filename
+    fout.write(format_utility.format_columns(columns, float_format, star_separtor))
+    if isinstance(filename, str): fout.close()
+
 def float_format():
     ''' Format for a floating point number
     
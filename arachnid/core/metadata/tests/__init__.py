@@ -0,0 +1,12 @@
+''' Unit testing for each module in :mod:`arachnid.core.metadata`
+
+.. currentmodule:: arachnid.core.metadata.tests
+
+.. autosummary::
+    :nosignatures:
+    :toctree: api_generated/
+    :template: api_module.rst
+    
+    test_format
+
+'''
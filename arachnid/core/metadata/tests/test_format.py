@@ -0,0 +1,185 @@
+'''
+.. Created on Oct 17, 2026
+'''
+from .. import format
+import numpy, numpy.testing
+import tempfile, shutil, os
+
+_spider_one = ''';           psi       theta         phi
+    1 3 1.0 2.5 3.0
+'''
+
+_spider_two = ''';           psi       theta         phi
+    1 3 1.0 2.5 3.0
+    2 3 2.0 3.5 4.0
+'''
+
+_star_one = '''data_
+
+loop_
+_rlnImageName #1
+_rlnDefocusU #2
+000001@stack_00010.mrcs 13538.5
+'''
+
+_star_two = '''data_
+
+loop_
+_rlnImageName #1
+_rlnDefocusU #2
+_rlnVoltage #3
+000001@stack_00010.mrcs 13538.5 -
+000002@stack_00011.mrcs nan 300
+'''
+
+def test_read_spider_one_row():
+    '''
+    '''
+    
+    tmp = tempfile.mkdtemp()
+    try:
+        filename = _write_text(tmp, 'one.spi', _spider_one)
+        table = format.read_table(filename)
+        numpy.testing.assert_equal(table.dtype.names, ('id', 'psi', 'theta', 'phi'))
+        numpy.testing.assert_allclose(table.view(numpy.recarray).tolist(), [(1, 1.0, 2.5, 3.0)])
+        vals = format.read(filename, numeric=True)
+        numpy.testing.assert_equal(len(vals), 1)
+        numpy.testing.assert_equal(tuple(vals[0]), (1, 1, 2.5, 3))
+    finally: shutil.rmtree(tmp)
+
+def test_read_spider_many_rows():
+    '''
+    '''
+    
+    tmp = tempfile.mkdtemp()
+    try:
+        filename = _write_text(tmp, 'two.spi', _spider_two)
+        table = format.read_table(filename)
+        numpy.testing.assert_equal(table['id'], [1, 2])
+        numpy.testing.assert_allclose(table['theta'], [2.5, 3.5])
+        vals = format.read(filename, numeric=True)
+        numpy.testing.assert_equal([tuple(v) for v in vals], [(1, 1, 2.5, 3), (2, 2, 3.5, 4)])
+    finally: shutil.rmtree(tmp)
+
+def test_read_star_one_row():
+    '''
+    '''
+    
+    tmp = tempfile.mkdtemp()
+    try:
+        filename = _write_text(tmp, 'one.star', _star_one)
+        table = format.read_table(filename)
+        numpy.testing.assert_equal(table['rlnImageName'], ['000001@stack_00010.mrcs'])
+        numpy.testing.assert_equal(table['rlnImageName_index'], [1])
+        numpy.testing.assert_equal(table['rlnImageName_fileid'], [10])
+        numpy.testing.assert_allclose(table['rlnDefocusU'], [13538.5])
+        vals = format.read(filename, numeric=True)
+        numpy.testing.assert_equal(tuple(vals[0]), ('000001@stack_00010.mrcs', 13538.5))
+    finally: shutil.rmtree(tmp)
+
+def test_read_star_many_rows():
+    '''
+    '''
+    
+    tmp = tempfile.mkdtemp()
+    try:
+        filename = _write_text(tmp, 'two.star', _star_two)
+        table = format.read_table(filename)
+        numpy.testing.assert_equal(table['rlnImageName_index'], [1, 2])
+        numpy.testing.assert_equal(table['rlnImageName_fileid'], [10, 11])
+        numpy.testing.assert_allclose(table['rlnDefocusU'], [13538.5, numpy.nan])
+        numpy.testing.assert_allclose(table['rlnVoltage'], [numpy.nan, 300])
+        vals = format.read(filename, numeric=True)
+        numpy.testing.assert_equal(vals[0].rlnVoltage, None)
+        numpy.testing.assert_equal(vals[1].rlnVoltage, 300)
+        assert(numpy.isnan(vals[1].rlnDefocusU))
+    finally: shutil.rmtree(tmp)
+
+def test_read_star_many_tables():
+    '''
+    '''
+    
+    tmp = tempfile.mkdtemp()
+    try:
+        filename = _write_text(tmp, 'many.star', _star_one+"\n"+_star_one.replace('data_', 'data_second', 1))
+        numpy.testing.assert_raises(Exception, format.read, filename, ndarray=True)
+    finally: shutil.rmtree(tmp)
+
+def test_read_cache():
+    '''
+    '''
+    
+    tmp = tempfile.mkdtemp()
+    try:
+        format.enable_cache(os.path.join(tmp, 'cache'))
+        for name, text in [('one.spi', _spider_one), ('two.spi', _spider_two), ('one.star', _star_one), ('two.star', _star_two)]:
+            filename = _write_text(tmp, name, text)
+            format.enable_cache(None)
+            expected = format.read(filename, numeric=True)
+            format.enable_cache(os.path.join(tmp, 'cache'))
+            format.read(filename, numeric=True)
+            assert(os.path.exists(format.cache_filename(filename)))
+            vals = format.read(filename, numeric=True)
+            numpy.testing.assert_equal(repr(vals), repr(expected))
+            numpy.testing.assert_equal([map(type, v) for v in vals], [map(type, v) for v in expected])
+    finally:
+        format.enable_cache(None)
+        shutil.rmtree(tmp)
+
+def test_read_cache_modified():
+    '''
+    '''
+    
+    tmp = tempfile.mkdtemp()
+    try:
+        format.enable_cache(os.path.join(tmp, 'cache'))
+        filename = _write_text(tmp, 'two.spi', _spider_two)
+        numpy.testing.assert_allclose(format.read_table(filename)['psi'], [1, 2])
+        _write_text(tmp, 'two.spi', _spider_two.replace('2.0', '5.0'))
+        stat = os.stat(filename)
+        os.utime(filename, (stat.st_atime, stat.st_mtime+10))
+        numpy.testing.assert_allclose(format.read_table(filename)['psi'], [1, 5])
+        numpy.testing.assert_equal([v.psi for v in format.read(filename, numeric=True)], [1, 5])
+    finally:
+        format.enable_cache(None)
+        shutil.rmtree(tmp)
+
+def test_write_columns():
+    '''
+    '''
+    
+    tmp = tempfile.mkdtemp()
+    try:
+        values = format.read(_write_text(tmp, 'input.star', _star_two.replace(' -\n', ' 200\n')), numeric=True)
+        values.append(values[0]._replace(rlnDefocusU=-2.25e-7, rlnVoltage=1e12))
+        for ext in ('star', 'spi', 'csv'):
+            columns = format.write(os.path.join(tmp, 'columns.'+ext), values)
+            rows = _write_values(os.path.join(tmp, 'values.'+ext), values)
+            numpy.testing.assert_equal(open(columns, 'rb').read(), open(rows, 'rb').read())
+    finally: shutil.rmtree(tmp)
+
+def _write_text(path, name, text):
+    ''' Write text to a file in a directory
+    '''
+    
+    filename = os.path.join(path, name)
+    fout = open(filename, 'w')
+    fout.write(text)
+    fout.close()
+    return filename
+
+def _write_values(filename, values, mode='w'):
+    ''' Write a document one row at a time, as format.write does for formats
+    without a write_columns function
+    '''
+    
+    factory = format.namedtuple_factory
+    fmt = format.get_format_by_ext(filename)
+    filename, fout = format.open_file(filename, mode=mode)
+    extra = dict(header=factory.get_header(values))
+    extra['header'] = fmt.write_header(fout, values, mode, **extra)
+    if hasattr(fmt, 'float_format'): extra['float_format']=fmt.float_format()
+    if hasattr(fmt, 'valid_entry'): extra['valid_entry']=fmt.valid_entry
+    fmt.write_values(fout, factory.format_iter(values, **extra), **extra)
+    fout.close()
+    return filename
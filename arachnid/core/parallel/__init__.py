@@ -14,6 +14,7 @@
     parallel_utility
     process_queue
     process_tasks
+    process_pool
     mpi_utility
     openmp
 '''
\ No newline at end of file
@@ -6,7 +6,7 @@
 import numpy, logging
 import parallel_utility
 import process_tasks
-import socket, os
+import socket, os, collections
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
 try:
@@ -302,6 +302,64 @@ def block_reduce_root(data, batch_size=100000, root=0, comm=None, **extra):
             comm.Reduce([data[block_beg:block_end], mpi_type], None, op=MPI.SUM, root=root)
         comm.barrier()
 
+def reduce_scatter(data, comm=None, **extra):
+    ''' Sum a flat array over all nodes, where each node only receives
+    its part of the sum
+    
+    The part of each node is given by :py:func:`mpi_range`.
+    
+    :Parameters:
+    
+    data : array
+           Flat array of data to sum
+    comm : mpi4py.MPI.Intracomm
+           MPI communications object
+    extra : dict
+            Unused keyword arguments
+    
+    :Returns:
+    
+    part : array
+           Part of the sum owned by this node (or `data` if MPI is not used)
+    '''
+    
+    if comm is None: return data
+    mpi_type = MPI.__TypeDict__[data.dtype.char]
+    counts = parallel_utility.partition_size(data.shape[0], comm.Get_size())
+    beg, end = mpi_range(data.shape[0], comm=comm)
+    part = numpy.empty(end-beg, dtype=data.dtype)
+    comm.Reduce_scatter([data, mpi_type], [part, mpi_type], recvcounts=counts, op=MPI.SUM)
+    return part
+
+def gather_to(part, total, dest, comm=None, **extra):
+    ''' Gather the parts of a flat array from every node to a single node
+    
+    :Parameters:
+    
+    part : array
+           Part of the array owned by this node, see :py:func:`reduce_scatter`
+    total : int
+            Total number of elements in the array
+    dest : int
+           Rank of the node receiving the array
+    comm : mpi4py.MPI.Intracomm
+           MPI communications object
+    extra : dict
+            Unused keyword arguments
+    
+    :Returns:
+    
+    data : array
+           Full array on node `dest`, otherwise None (or `part` if MPI is not used)
+    '''
+    
+    if comm is None: return part
+    mpi_type = MPI.__TypeDict__[part.dtype.char]
+    counts = parallel_utility.partition_size(total, comm.Get_size())
+    data = numpy.empty(total, dtype=part.dtype) if comm.Get_rank() == dest else None
+    comm.Gatherv(sendbuf=[part, mpi_type], recvbuf=[data, (counts, None), mpi_type] if data is not None else None, root=dest)
+    return data
+
 def mpi_init(params, use_MPI=False, **extra):
     ''' Setup the parameters for MPI, if enabled
     
@@ -342,7 +400,7 @@ def supports_MPI():
     
     return MPI is not None
 
-def mpi_reduce(process, vals, comm=None, rank=None, **extra):
+def mpi_reduce(process, vals, comm=None, rank=None, dynamic_schedule=False, prefetcher=None, **extra):
     ''' Map a set of values to client nodes and process them in parallel with `process`. If MPI
     is not enabled, it will use multi-process or serial code depending on the parameters.
     
@@ -358,6 +416,11 @@ def mpi_reduce(process, vals, comm=None, rank=None, **extra):
            MPI communications object
     rank : int
            Rank of current node
+    dynamic_schedule : bool
+                       Hand out values to the nodes on demand rather than in fixed blocks, 
+                       see :py:func:`mpi_reduce_dynamic`
+    prefetcher : arachnid.core.app.prefetch.Prefetcher
+                 Read the input values of the current node ahead of processing
     extra : dict
             Unused keyword arguments
     
@@ -371,6 +434,10 @@ def mpi_reduce(process, vals, comm=None, rank=None, **extra):
     
     if rank is None: rank = get_rank(comm)
     size = get_size(comm)
+    if dynamic_schedule and size > 1:
+        for index, res in mpi_reduce_dynamic(process, vals, comm, rank, prefetcher=prefetcher, **extra):
+            yield index, res
+        return
     lenbuf = numpy.zeros((size, 1), dtype=numpy.int32)
     _logger.debug("processing - started: %d - %d"%(len(vals), size))
     mpi_type = MPI.__TypeDict__[lenbuf.dtype.char] if MPI is not None else None
@@ -381,8 +448,10 @@ def mpi_reduce(process, vals, comm=None, rank=None, **extra):
             for v in vals[:rank-1]: offset += len(v) # 
             vals = vals[rank-1]
         _logger.debug("client-processing - started: %d"%len(vals))
+        if prefetcher is not None: prefetcher.add(vals)
         try:
             for index, res in process_tasks.process_mp(process, vals, **extra):
+                if prefetcher is not None: prefetcher.done(vals[index])
                 #_logger.debug("client-processing: %d of %d-%d -- %d"%(index, rank, size-1,offset))
                 if len(vals) == 0: raise ValueError, "An unknown error as occurred"
                 if rank > 0:
@@ -446,6 +515,131 @@ def mpi_reduce(process, vals, comm=None, rank=None, **extra):
         if status < 0: raise ValueError, "Exceptoin raised"
         _logger.debug("Root progress monitor - finished")
 
+def mpi_reduce_dynamic(process, vals, comm, rank=None, schedule_chunk=0, root_process=False, prefetcher=None, **extra):
+    ''' Process a set of values over the MPI nodes, where the root hands out small chunks
+    of values to each client on demand.
+    
+    Unlike the fixed block partition used by :py:func:`mpi_reduce`, a node that finishes
+    early requests more work, so a few slow values (e.g. large micrographs) do not leave the
+    other nodes idle. Each client keeps one extra chunk requested ahead of time to hide the 
+    latency of the root. The root keeps track of the values assigned to each client; if a
+    client fails, then its unfinished values are handed to the next node that asks for work 
+    (or processed by the root once the clients have finished).
+    
+    The caller on the root cancels processing by clearing `vals` (e.g. `del vals[:]`),
+    after which the remaining values are dropped, each client is told that no work
+    remains and no more results are returned.
+    
+    :Parameters:
+    
+    process : function
+              Function for processing each input value
+    vals : list
+           List of input values
+    comm : mpi4py.MPI.Intracomm
+           MPI communications object
+    rank : int
+           Rank of current node
+    schedule_chunk : int
+                     Number of values handed out per request (if less than 1, then the 
+                     number of workers per node)
+    root_process : bool
+                   The root also processes values between serving requests from the clients
+    prefetcher : arachnid.core.app.prefetch.Prefetcher
+                 Read the input values of the current node ahead of processing
+    extra : dict
+            Unused keyword arguments
+    
+    :Returns:
+    
+    index : int
+            Index of the input value in the original list
+    res : object
+          Result from `process`
+    '''
+    
+    if rank is None: rank = get_rank(comm)
+    size = get_size(comm)
+    if schedule_chunk < 1: schedule_chunk = max(1, extra.get('worker_count', 1))
+    # Client to root on tag 7: (code, index, result) where code is 
+    # 0 - request work, 1 - result, 2 - finished, -1 - error
+    # Root to client on tag 8: list of indices or None if no work remains
+    if rank > 0:
+        _logger.debug("client-processing - dynamic - started: %d"%rank)
+        outstanding = 0
+        finished = False
+        chunks = collections.deque()
+        try:
+            for i in xrange(2):
+                comm.send((0, None, None), dest=0, tag=7)
+                outstanding += 1
+            while outstanding > 0 or len(chunks) > 0:
+                while outstanding > 0 and (len(chunks) == 0 or comm.Iprobe(source=0, tag=8)):
+                    chunk = comm.recv(source=0, tag=8)
+                    outstanding -= 1
+                    if chunk is None: finished = True
+                    else:
+                        chunks.append(chunk)
+                        if prefetcher is not None: prefetcher.add([vals[i] for i in chunk])
+                if len(chunks) == 0: continue
+                chunk = chunks.popleft()
+                for index, res in process_tasks.process_mp(process, [vals[i] for i in chunk], **extra):
+                    index = chunk[index]
+                    if prefetcher is not None: prefetcher.done(vals[index])
+                    comm.send((1, index, res), dest=0, tag=7)
+                    yield index, res
+                if not finished:
+                    comm.send((0, None, None), dest=0, tag=7)
+                    outstanding += 1
+        except:
+            _logger.exception("client-processing - error")
+            comm.send((-1, None, None), dest=0, tag=7)
+            raise
+        else:
+            comm.send((2, None, None), dest=0, tag=7)
+            _logger.debug("client-processing - dynamic - finished: %d"%rank)
+    else:
+        _logger.debug("Root scheduler - started: %d"%(len(vals)))
+        pending = collections.deque(xrange(len(vals)))
+        assigned = dict([(node, set()) for node in xrange(1, size)])
+        active = set(assigned.keys())
+        status = MPI.Status()
+        failed = 0
+        while len(active) > 0:
+            if len(vals) == 0 and len(pending) > 0:
+                _logger.debug("Root scheduler - cancelled: %d"%len(pending))
+                pending.clear()
+            if root_process and len(pending) > 0 and not comm.Iprobe(source=MPI.ANY_SOURCE, tag=7):
+                chunk = [pending.popleft() for i in xrange(min(schedule_chunk, len(pending)))]
+                for index, res in process_tasks.process_mp(process, [vals[i] for i in chunk], **extra):
+                    yield chunk[index], res
+                    if len(vals) == 0: break
+                continue
+            code, index, res = comm.recv(source=MPI.ANY_SOURCE, tag=7, status=status)
+            node = status.Get_source()
+            if code == 1:
+                assigned[node].discard(index)
+                if len(vals) > 0: yield index, res
+            elif code == 0:
+                chunk = [pending.popleft() for i in xrange(min(schedule_chunk, len(pending)))]
+                assigned[node].update(chunk)
+                comm.send(chunk if len(chunk) > 0 else None, dest=node, tag=8)
+            else:
+                active.discard(node)
+                if code < 0:
+                    failed += 1
+                    _logger.warn("Node %d failed - reassigning %d values"%(node, len(assigned[node])))
+                    if len(vals) > 0: pending.extendleft(sorted(assigned[node], reverse=True))
+                    assigned[node].clear()
+        if len(pending) > 0 and len(vals) > 0:
+            _logger.debug("Root processing remaining: %d"%len(pending))
+            chunk = list(pending)
+            for index, res in process_tasks.process_mp(process, [vals[i] for i in chunk], **extra):
+                yield chunk[index], res
+                if len(vals) == 0: break
+        if failed > 0: _logger.warn("%d of %d nodes failed during processing"%(failed, size-1))
+        _logger.debug("Root scheduler - finished")
+
 def is_root(comm=None, **extra):
     ''' Test if node is root
     
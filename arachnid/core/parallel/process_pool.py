@@ -0,0 +1,370 @@
+''' Persistent pool of worker processes
+
+This module defines a pool of long-lived worker processes that is reused
+across parallel calls. Unlike the functions in :py:mod:`process_queue`, which
+create new processes for every call, the pool pays the cost of creating the
+processes and initializing each worker only once.
+
+.. sourcecode:: py
+    
+    >>> from arachnid.core.parallel.process_pool import *
+    >>> def sum(x, factor=10): return x*factor
+    >>> pool = get_pool(4)
+    >>> sorted(pool.imap(sum, range(1,4), factor=2))
+    [(0, 2), (1, 4), (2, 6)]
+
+The function and keyword arguments of each call are pickled once for every
+worker; only keyword arguments that are immutable scalars with the same value
+as when the pool was created are inherited by the workers and not sent again,
+so arrays modified in place between calls are always sent. Each call
+may have its own initialization function, which every worker runs with the
+keyword arguments of that call; it is only run again when the function or
+the value of the keyword arguments change. If the initialization fails, the
+call raises a :py:class:`process_queue.ProcessException` and the pool is
+stopped. A call that cannot be pickled (e.g. a nested function) is refused,
+and the caller falls back to creating new processes.
+
+.. Created on Oct 17, 2026
+'''
+import process_queue
+import openmp
+import multiprocessing
+import Queue
+import cPickle
+import atexit
+import logging
+import errno
+import os
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+_pool = None
+_scalar_types = (int, long, float, complex, bool, str, unicode, type(None))
+
+def get_pool(worker_count, **extra):
+    ''' Get the shared worker pool, creating it if necessary
+    
+    The shared pool is reused as long as the number of workers does
+    not change.
+    
+    :Parameters:
+    
+    worker_count : int
+                   Number of worker processes
+    extra : dict
+            Keyword arguments inherited by each worker process
+    
+    :Returns:
+    
+    pool : WorkerPool
+           Shared worker pool or None if a pool cannot be used
+           (e.g. from a worker process or while the pool is busy)
+    '''
+    
+    global _pool
+    
+    if worker_count < 2 or multiprocessing.current_process().daemon: return None
+    if _pool is not None:
+        if _pool.pid != os.getpid(): _pool = None
+        elif _pool.busy: return None
+        elif _pool.worker_count != worker_count or not _pool.is_alive():
+            _pool.close()
+            _pool = None
+    if _pool is None:
+        _logger.debug("Starting worker pool: %d"%worker_count)
+        _pool = WorkerPool(worker_count, **extra)
+    return _pool
+
+def shutdown():
+    ''' Stop the shared worker pool
+    '''
+    
+    global _pool
+    
+    if _pool is not None and _pool.pid == os.getpid(): _pool.close()
+    _pool = None
+
+atexit.register(shutdown)
+
+def init_single_thread(**extra):
+    ''' Initialize a worker process to use a single OpenMP thread
+    
+    :Parameters:
+    
+    extra : dict
+            Unused keyword arguments
+    
+    :Returns:
+    
+    extra : dict
+            Empty dictionary
+    '''
+    
+    if openmp.is_openmp_enabled(): openmp.set_thread_count(1)
+    return {}
+
+class WorkerPool(object):
+    ''' Pool of persistent worker processes
+    
+    :Parameters:
+    
+    worker_count : int
+                   Number of worker processes
+    extra : dict
+            Keyword arguments inherited by each worker process
+    '''
+    
+    def __init__(self, worker_count, **extra):
+        '''Start the worker processes
+        '''
+        
+        self.worker_count = worker_count
+        self.extra = extra
+        self.init = None
+        self.pid = os.getpid()
+        self.busy = False
+        self.qtask = multiprocessing.Queue()
+        self.qout = multiprocessing.Queue()
+        self.qjobs = []
+        self.processes = []
+        for i in xrange(worker_count):
+            qjob = multiprocessing.Queue()
+            p = multiprocessing.Process(target=pool_worker, args=(qjob, self.qtask, self.qout, i, extra))
+            p.daemon=True
+            p.start()
+            self.qjobs.append(qjob)
+            self.processes.append(p)
+    
+    def __enter__(self):
+        '''Use the pool in a with statement
+        '''
+        
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        '''Stop the worker processes when leaving the with statement
+        '''
+        
+        self.close()
+    
+    def is_alive(self):
+        ''' Test if every worker process is running
+        
+        :Returns:
+        
+        alive : bool
+                True if every worker process is running
+        '''
+        
+        return len(self.processes) > 0 and all([p.is_alive() for p in self.processes])
+    
+    def imap(self, process, vals, queue_limit=None, init_process=None, **extra):
+        ''' Process each value in the worker processes
+        
+        :Parameters:
+        
+        process : function
+                  Function called with each value and keyword arguments
+        vals : iterable
+               Values to process
+        queue_limit : int
+                      Maximum number of values waiting in the pool,
+                      None means no limit
+        init_process : function
+                       Initalize the parameters for each worker process, called
+                       with the keyword arguments of this call, the returned
+                       dictionary is added to the keyword arguments of `process`
+        extra : dict
+                Keyword arguments for `process`
+        
+        :Returns:
+        
+        gen : generator
+              Generator of (index, result) in order of completion, where the
+              result is a :py:class:`process_queue.ProcessException` if
+              `process` raised an exception. None if the pool is busy or
+              the call cannot be sent to the workers. Raises a
+              :py:class:`process_queue.ProcessException` if a worker cannot
+              load the call or `init_process` fails.
+        '''
+        
+        if self.busy or not self.is_alive(): return None
+        # Mutable values may have changed in place since the workers were forked
+        changed = dict([(key, val) for key, val in extra.iteritems() if not _is_inherited(self.extra, key, val)])
+        try:
+            args = cPickle.dumps(changed, cPickle.HIGHEST_PROTOCOL)
+            # The workers keep the parameters initialized for the last call if nothing changed
+            init = (init_process, args, sorted(extra.keys()))
+            reinit = self.init is None or self.init[0] is not init_process or self.init[1:] != init[1:]
+            job = cPickle.dumps((process, init_process, reinit, args, extra.keys()), cPickle.HIGHEST_PROTOCOL)
+        except Exception, e:
+            _logger.debug("Cannot send job to worker pool: %s"%str(e))
+            return None
+        self.init = init
+        self.busy = True
+        for qjob in self.qjobs: qjob.put(job)
+        return self._imap(vals, queue_limit)
+    
+    def _imap(self, vals, queue_limit):
+        ''' Send the values to the workers and collect the results
+        
+        :Parameters:
+        
+        vals : iterable
+               Values to process
+        queue_limit : int
+                      Maximum number of values waiting in the pool
+        
+        :Returns:
+        
+        index : int
+                Index of the value
+        res : object
+              Result of the process
+        '''
+        
+        completed = False
+        try:
+            pending = 0
+            for index, val in enumerate(vals):
+                while queue_limit is not None and pending >= queue_limit:
+                    yield self._get()
+                    pending -= 1
+                self.qtask.put((index, val))
+                pending += 1
+            for i in xrange(self.worker_count): self.qtask.put(None)
+            finished = 0
+            while finished < self.worker_count:
+                index, res = self._get()
+                if index is None:
+                    finished += 1
+                    continue
+                yield index, res
+            completed = True
+        finally:
+            self.busy = False
+            if not completed: self.terminate()
+    
+    def _get(self):
+        ''' Get the next result from the workers
+        
+        :Returns:
+        
+        val : tuple
+              Index and result, the index is None when a worker finished
+        '''
+        
+        while True:
+            try:
+                val = self.qout.get(True, 1)
+                # A worker that cannot run the call sends the error in place of the index
+                if val[0] is None and val[1] is not None: raise val[1]
+                return val
+            except Queue.Empty:
+                if not self.is_alive():
+                    self.terminate()
+                    raise ValueError, "Worker process terminated unexpectedly"
+            except IOError, e:
+                if e.errno != errno.EINTR: raise
+    
+    def close(self):
+        ''' Stop the worker processes after they finish
+        '''
+        
+        for qjob in self.qjobs:
+            try: qjob.put(None)
+            except: pass
+        for p in self.processes: p.join(5)
+        self.terminate()
+    
+    def terminate(self):
+        ''' Stop the worker processes immediately
+        '''
+        
+        for p in self.processes:
+            if p.is_alive(): p.terminate()
+        self.processes = []
+        self.qjobs = []
+
+def pool_worker(qjob, qtask, qout, process_number, extra):
+    ''' Worker in each process of the pool
+    
+    Each job taken from the job queue consists of a pickled function,
+    initialization function and keyword arguments. The worker initializes
+    its parameters if they changed since the last job, then processes values
+    from the shared task queue until it receives None, and then signals the
+    end of the job. If the job cannot be loaded or the initialization fails,
+    the worker sends the error in place of the end of the job and waits to
+    be stopped.
+    
+    :Parameters:
+    
+    qjob : multiprocessing.Queue
+           Queue of jobs for this worker
+    qtask : multiprocessing.Queue
+            Queue of values shared by all workers
+    qout : multiprocessing.Queue
+           Queue of results
+    process_number : int
+                     Process number
+    extra : dict
+            Keyword arguments inherited from the parent process
+    '''
+    
+    # Each call is initialized from the state inherited at fork, e.g. the number of OpenMP threads
+    thread_count = openmp.get_max_threads() if openmp.is_openmp_enabled() else 0
+    local = None
+    while True:
+        job = process_queue.safe_get(qjob.get)
+        if job is None: break
+        try:
+            # A function defined after the pool started cannot be found in the worker
+            process, init_process, reinit, args, keys = cPickle.loads(job)
+            changed = cPickle.loads(args)
+            kwargs = dict([(key, changed[key] if key in changed else extra[key]) for key in keys])
+            kwargs['process_number'] = process_number
+            if reinit or local is None:
+                local = None
+                if thread_count > 0: openmp.set_thread_count(thread_count)
+                local = (init_process(**kwargs) if init_process is not None else None) or {}
+        except:
+            _logger.exception("Error initializing worker %d"%process_number)
+            local = None
+            qout.put((None, process_queue.err_msg()))
+            continue
+        kwargs.update(local)
+        while True:
+            val = process_queue.safe_get(qtask.get)
+            if val is None: break
+            index, val = val
+            try:
+                res = process(val, **kwargs)
+            except:
+                _logger.exception("Error in worker %d"%process_number)
+                res = process_queue.err_msg()
+            qout.put((index, res))
+        del process, init_process, changed, kwargs
+        qout.put((None, None))
+
+def _is_inherited(inherited, key, val):
+    ''' Test if a keyword argument was inherited by the workers at fork
+    with the same value
+    
+    :Parameters:
+    
+    inherited : dict
+                Keyword arguments inherited by the workers
+    key : str
+          Name of the keyword argument
+    val : object
+          Value of the keyword argument for the current call
+    
+    :Returns:
+    
+    inherited : bool
+                True if the value is an immutable scalar equal to the inherited value
+    '''
+    
+    if key not in inherited or type(inherited[key]) is not type(val) or not isinstance(val, _scalar_types): return False
+    return inherited[key] == val
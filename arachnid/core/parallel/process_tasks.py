@@ -7,9 +7,12 @@ This module defines a set of common tasks that can be performed in parallel or s
 '''
 
 import process_queue
+import process_pool
 import logging
 import numpy.ctypeslib
 import multiprocessing.sharedctypes
+import tempfile
+import os
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
@@ -39,6 +42,18 @@ def process_mp(process, vals, worker_count, init_process=None, ignored_errors=No
               Return value of process functor
     '''
     
+    pool = process_pool.get_pool(worker_count, **extra) if len(vals) > 1 else None
+    if pool is not None:
+        pool_iter = pool.imap(process, vals, init_process=init_process, **extra)
+        if pool_iter is not None:
+            for index, val in pool_iter:
+                if isinstance(val, process_queue.ProcessException):
+                    if ignored_errors is not None and len(ignored_errors) > 0: ignored_errors[0]+=1
+                    _logger.error("Unexpected error in process - report this problem to the developer")
+                    val = vals[index]
+                yield index, val
+            return
+    
     #_logger.error("worker_count1=%d"%worker_count)
     if len(vals) < worker_count: worker_count = len(vals)
     #_logger.error("worker_count2=%d"%worker_count)
@@ -219,9 +234,13 @@ def iterate_reduce(for_func, worker, thread_count, queue_limit=None, shmem_array
         if val is None: raise ValueError, "Exception in child process"
         yield val
         
-def for_process_mp(for_func, worker, shape, thread_count=0, queue_limit=None, **extra):
+def for_process_mp(for_func, worker, shape, thread_count=0, queue_limit=None, out=None, **extra):
     ''' Generator to process collection of arrays in parallel
     
+    If an output array created with :py:func:`create_shmem_array` is given, then
+    each worker process writes its result directly into the corresponding row
+    of the output array and only the index is sent back to the parent process.
+    
     :Parameters:
     
     for_func : func
@@ -232,6 +251,9 @@ def for_process_mp(for_func, worker, shape, thread_count=0, queue_limit=None, **
                    Number of threads
     shape : int
             Shape of worker result array
+    out : numpy.memmap, optional
+          Output array where row `index` holds the (flattened and truncated) result 
+          for the input at `index`
     extra : dict
             Unused keyword arguments
     
@@ -240,17 +262,33 @@ def for_process_mp(for_func, worker, shape, thread_count=0, queue_limit=None, **
     index : int
             Yields index of output array
     out : array
-          Yields output array of worker
+          Yields output array of worker (row of `out` if given)
     '''
     
+    shmem_extra = extra
+    if out is not None:
+        if thread_count > 1 and not isinstance(out, numpy.memmap): raise ValueError, "Output array must be created with create_shmem_array"
+        shmem_extra = dict(extra, shmem_worker=worker, shmem_out=SharedArray(out.filename, out.dtype.str, out.shape)) if thread_count > 1 else extra
+        worker_func = process_shmem
+    else: worker_func = worker
+    pool = process_pool.get_pool(thread_count, **extra)
+    pool_iter = pool.imap(process_indexed, enumerate(for_func), queue_limit=thread_count*(8 if queue_limit is None else queue_limit), init_process=process_pool.init_single_thread, worker=worker_func, **shmem_extra) if pool is not None else None
     if thread_count < 2:
         for i, val in enumerate(for_func):
             res = worker(val, i, **extra)
+            if out is not None:
+                _write_row(out, i, res)
+                res = out[i]
             yield i, res
+    elif pool_iter is not None:
+        for idx, res in pool_iter:
+            if isinstance(res, process_queue.ProcessException): raise ValueError, "Error occured in process: %d"%idx
+            if out is not None: res = out[idx]
+            yield idx, res
     else:
         if queue_limit is None: queue_limit = thread_count*8
         else: queue_limit *= thread_count
-        qin, qout = process_queue.start_raw_enum_workers(process_worker2, thread_count, queue_limit, -1, worker, extra)
+        qin, qout = process_queue.start_raw_enum_workers(process_worker2, thread_count, queue_limit, -1, worker_func, shmem_extra)
         
         try:
             total = 0
@@ -259,6 +297,7 @@ def for_process_mp(for_func, worker, shape, thread_count=0, queue_limit=None, **
                     pos = process_queue.safe_get(qout.get) #if i > thread_count else i
                     if pos is None or pos == -1: raise ValueError, "Error occured in process: %d"%pos
                     res, idx = pos
+                    if out is not None: res = out[idx]
                     yield idx, res
                 else: 
                     pos = i
@@ -268,6 +307,7 @@ def for_process_mp(for_func, worker, shape, thread_count=0, queue_limit=None, **
                 pos = process_queue.safe_get(qout.get)
                 if pos is None or pos == -1: raise ValueError, "Error occured in process: %d"%pos
                 res, idx = pos
+                if out is not None: res = out[idx]
                 yield idx, res
         finally:
             #_logger.error("Terminating %d workers"%(thread_count))
@@ -279,6 +319,205 @@ def for_process_mp(for_func, worker, shape, thread_count=0, queue_limit=None, **
                 assert(pos==-1)
     raise StopIteration
 
+def create_shmem_array(shape, dtype=numpy.float):
+    ''' Create an array in shared memory that worker processes can open by name
+    
+    The array is backed by a file in `/dev/shm` (or the temporary directory if 
+    `/dev/shm` does not exist or lacks space). Use :py:func:`release_shmem_array`
+    to remove the file once the workers are finished.
+    
+    :Parameters:
+    
+    shape : tuple
+            Shape of the array
+    dtype : numpy.dtype
+            Data type of the array
+    
+    :Returns:
+    
+    out : numpy.memmap
+          Array initialized to zero
+    '''
+    
+    dtype = numpy.dtype(dtype)
+    nbytes = int(numpy.prod(shape))*dtype.itemsize
+    tmpdir = None
+    shm = os.path.join('/', 'dev', 'shm')
+    if os.path.exists(shm):
+        stat = os.statvfs(shm)
+        if stat.f_bavail*stat.f_frsize > nbytes: tmpdir = shm
+    fd, filename = tempfile.mkstemp(suffix='.dat', dir=tmpdir)
+    os.close(fd)
+    return numpy.memmap(filename, dtype=dtype, mode='w+', shape=shape)
+
+def release_shmem_array(out):
+    ''' Remove the file backing an array created with :py:func:`create_shmem_array`
+    
+    The contents of the array remain valid after the file is removed.
+    
+    :Parameters:
+    
+    out : numpy.memmap
+          Array created with :py:func:`create_shmem_array`
+    
+    :Returns:
+    
+    out : array
+          Array without the file
+    '''
+    
+    if isinstance(out, numpy.memmap):
+        if out.filename is not None and os.path.exists(out.filename): os.unlink(out.filename)
+        out = out.view(numpy.ndarray)
+    return out
+
+def open_shmem_array(filename, dtype, shape):
+    ''' Open an array created with :py:func:`create_shmem_array` in a worker process
+    
+    :Parameters:
+    
+    filename : str
+               Name of the file backing the array
+    dtype : str
+            Data type of the array
+    shape : tuple
+            Shape of the array
+    
+    :Returns:
+    
+    out : numpy.memmap
+          Writable shared array
+    '''
+    
+    return numpy.memmap(filename, dtype=numpy.dtype(dtype), mode='r+', shape=shape)
+
+class SharedArray(object):
+    ''' Reference to an array created with :py:func:`create_shmem_array` that
+    is opened in a worker process on first use
+    
+    Only the file name, data type and shape are pickled, so each worker opens
+    the array once for a call and unmaps it when the keyword arguments of
+    that call are released. A persistent worker thus does not keep the file
+    of a released array mapped.
+    
+    :Parameters:
+    
+    filename : str
+               Name of the file backing the array
+    dtype : str
+            Data type of the array
+    shape : tuple
+            Shape of the array
+    '''
+    
+    def __init__(self, filename, dtype, shape):
+        '''Create a reference to a shared array
+        '''
+        
+        self.filename = filename
+        self.dtype = dtype
+        self.shape = shape
+        self.array = None
+    
+    def __getstate__(self):
+        '''Get the state to pickle, without the opened array
+        
+        :Returns:
+        
+        state : tuple
+                Filename, data type and shape of the array
+        '''
+        
+        return (self.filename, self.dtype, self.shape)
+    
+    def __setstate__(self, state):
+        '''Restore a pickled reference
+        
+        :Parameters:
+        
+        state : tuple
+                Filename, data type and shape of the array
+        '''
+        
+        self.__init__(*state)
+    
+    def open(self):
+        '''Open the array, if not already open
+        
+        :Returns:
+        
+        out : numpy.memmap
+              Writable shared array
+        '''
+        
+        if self.array is None: self.array = open_shmem_array(self.filename, self.dtype, self.shape)
+        return self.array
+
+def process_shmem(val, idx, shmem_worker, shmem_out, **extra):
+    ''' Call the worker of :py:func:`for_process_mp` and write the result into 
+    the shared output array
+    
+    :Parameters:
+    
+    val : array
+          Input array
+    idx : int
+          Index of the input array
+    shmem_worker : function
+                   Function to preprocess the images
+    shmem_out : SharedArray
+                Reference to the shared output array
+    extra : dict
+            Keyword arguments
+    
+    :Returns:
+    
+    out : None
+          Result is written to the output array
+    '''
+    
+    _write_row(shmem_out.open(), idx, shmem_worker(val, idx, **extra))
+    return None
+
+def _write_row(out, idx, res):
+    ''' Write a (flattened and truncated) result into a row of the output array
+    
+    :Parameters:
+    
+    out : array
+          Output array
+    idx : int
+          Row index
+    res : array
+          Result of the worker
+    '''
+    
+    row = out[idx]
+    row.reshape(row.size)[:] = res.ravel()[:row.size]
+
+def process_indexed(val, worker, process_number=0, **extra):
+    ''' Call the worker of :py:func:`for_process_mp` with a value and its index
+    
+    :Parameters:
+    
+    val : tuple
+          Index and value
+    worker : function
+             Function to preprocess the images
+    process_number : int
+                     Process number (unused)
+    extra : dict
+            Keyword arguments
+    
+    :Returns:
+    
+    out : array
+          Output array of worker
+    '''
+    
+    idx, val = val
+    return worker(val, idx, **extra)
+
 def process_worker2(qin, qout, process_number, process_limit, worker, extra):
     ''' Worker in each process that preprocesses the images
     
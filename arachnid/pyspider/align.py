@@ -78,6 +78,10 @@ Useful Options
 .. option:: --use-flip <BOOL>
     
     Use the phase flipped stack for alignment (Default: False)
+
+.. option:: --native-align <BOOL>
+    
+    Align with the in-process projection matching engine rather than SPIDER's AP SH, requires --use-flip (Default: False)
     
 .. option:: --prep-thread <INT>
     
@@ -296,7 +300,7 @@ def write_alignment(output, alignvals, apix=None, defocus_old=None):
     else: tmp = alignvals
     format.write(output, tmp, header=header.split(','), format=format.spiderdoc)
 
-def align_to_reference(spi, align, curr_slice, reference, use_flip, use_apsh, shuffle_angles=False, **extra):
+def align_to_reference(spi, align, curr_slice, reference, use_flip, use_apsh, shuffle_angles=False, native_align=False, **extra):
     ''' Align a set of projections to the given reference
     
     :Parameters:
@@ -315,6 +319,8 @@ def align_to_reference(spi, align, curr_slice, reference, use_flip, use_apsh, sh
                Set true to use AP SH rather than the faster, yet less accurate AP REF
     shuffle_angles : bool
                      Shuffle the angular distribution
+    native_align : bool
+                   Align with the in-process projection matching engine rather than SPIDER
     extra : dict
             Unused keyword arguments
     '''
@@ -325,7 +331,8 @@ def align_to_reference(spi, align, curr_slice, reference, use_flip, use_apsh, sh
     extra['dec_level']=dec_level
     extra.update(spider.scale_parameters(**extra))
     angle_rot = format_utility.add_prefix(extra['cache_file'], "rot_")
-    extra.update(prealign_input(spi, align[curr_slice], use_flip=use_flip, **extra))
+    extra.update(prealign_input(spi, align[curr_slice], use_flip=use_flip, native_align=native_align, **extra))
+    reference_file = reference
     reference = spider.copy_safe(spi, reference, **extra)
     angle_cache = format_utility.add_prefix(extra['cache_file'], "angles_")
     align[curr_slice, 10] = 0.0
@@ -361,7 +368,11 @@ def align_to_reference(spi, align, curr_slice, reference, use_flip, use_apsh, sh
         angle_off = parallel_utility.partition_offsets(angle_num, int(numpy.ceil(float(angle_num)/max_ref_proj)))
         angles = numpy.asarray(format.read(spi.replace_ext(angle_doc), numeric=True, header="id,psi,theta,phi".split(',')))
         #spi.spider_results(True, False)
-        if use_flip:
+        if native_align:
+            if mpi_utility.is_root(**extra): _logger.info("Native alignment on CTF-corrected stacks - started")
+            align_projections_native(spi, align[curr_slice], reference_file, angles, **extra)
+            if mpi_utility.is_root(**extra): _logger.info("Native alignment on CTF-corrected stacks - finished")
+        elif use_flip:
             if mpi_utility.is_root(**extra): _logger.info("Alignment on CTF-corrected stacks - started")
             align_projections(spi, ap_sel, None, align[curr_slice], reference, angles, angle_doc, angle_off, **extra)
             if mpi_utility.is_root(**extra): _logger.info("Alignment on CTF-corrected stacks - finished")
@@ -560,33 +571,80 @@ def align_projections(spi, ap_sel, inputselect, align, reference, angles, angle_
             align[i, 14]=val[0] if len(val)>0 else -1
         _logger.info("Testing best reference(%d): %d - %s"%(int(align[0, 4]), int(align[0, 14]), str(inputselect)))
 
-def fast_projection_search_test(input_file, inputselect, reference_file, align_file, angle_doc, best, ref_offset, **extra):
-    '''ang_diff
+def align_projections_native(spi, align, reference, angles, input_stack, window, inputangles=None, apix=None, **extra):
+    ''' Align a set of projections to the given reference with the in-process
+    projection matching engine
+    
+    Unlike :py:func:`align_projections`, the reference projections and the
+    alignment results stay in memory and are never written to SPIDER files.
+    
+    :Parameters:
+    
+    spi : spider.Session
+          Current SPIDER session
+    align : array
+            Output array of alignment values
+    reference : str
+                Input filename for reference used in alignment
+    angles : array
+             Array of Euler angles (id,psi,theta,phi) for each reference projection
+    input_stack : str
+                  Input filename for projection stack
+    window : int
+             Size of the projection window
+    inputangles : str
+                  Document file with the previous alignment already applied to the input stack
+    apix : float
+           Pixel size
+    extra : dict
+            Unused keyword arguments
     '''
-    from ..core.image import ndimage_file, rotate, ndimage_utility
-    
-    angs = numpy.asarray(format.read(align_file, numeric=True, header="psi,theta,phi".split(',')))
-    vals = numpy.asarray(format.read(align_file, numeric=True, header="epsi,theta,phi,ref_num,id,psi,tx,ty,nproj,ang_diff,cc_rot,spsi,sx,sy,mirror".split(',')))
-    ref = ndimage_file.read_image(reference_file)
-    refs = numpy.zeros((ndimage_file.count_images(reference_file), ref.shape[0], ref.shape[1]))
-    for i, img in enumerate(ndimage_file.iter_images(reference_file)): refs[i, :, :] = img
-    cx = ref.shape[0]/2
+    from ..core.image import ndimage_file, ndimage_interpolate, projection_match
+    
+    vol = ndimage_file.read_image(spi.replace_ext(reference))
+    if vol.shape[0] != window: vol = ndimage_interpolate.interpolate(vol, (window, window, window), 'bilinear')
+    prev = None
+    if inputangles is not None: prev = numpy.column_stack((align[:, 5], align[:, 6]/apix, align[:, 7]/apix))
+    _logger.debug("Aligning particle projections to %d references"%len(angles))
+    projection_match.align_to_volume(vol, angles[:, 1:], ndimage_file.iter_images(spi.replace_ext(input_stack)), align, prev=prev, **extra)
+    _logger.debug("Aligning particle projections - finished")
+
+def fast_projection_search_test(input_file, inputselect, reference_file, align_file, angle_doc, best, ref_offset, trans_range=5, **extra):
+    ''' Score each projection against every reference over all in-plane rotations
+    and small translations
+    
+    :Parameters:
+    
+    input_file : str
+                 Input filename for projection stack
+    inputselect : tuple
+                  Range of projections in the stack
+    reference_file : str
+                     Input filename for reference projection stack
+    align_file : str
+                 Document file with the previous alignment (unused)
+    angle_doc : str
+                Document file with the Euler angles of the references (unused)
+    best : array
+           Output array of negative scores for each projection and reference
+    ref_offset : int
+                 Offset of the references in the output array
+    trans_range : int
+                  Maximum translation
+    extra : dict
+            Unused keyword arguments
+    '''
+    from ..core.image import ndimage_file, projection_match
+    
+    refs = numpy.asarray([img for img in ndimage_file.iter_images(reference_file)])
+    bank = projection_match.PolarReferenceBank(refs.shape[1:], len(refs), ring_last=refs.shape[1]/2-2-trans_range)
+    bank.add(refs)
+    shifts = projection_match.shift_grid(trans_range)
     if inputselect is None:
         inputselect = (1, ndimage_file.count_images(input_file)+1)
     for i in xrange(inputselect[0], inputselect[1]):
         img = ndimage_file.read_image(input_file, i-1)
-        if i == 0:
-            _logger.error("Old angle: %d,%d -- %d"%(vals[i-1, 1], vals[i-1, 2], vals[i-1, 4]))
-        for j in xrange(len(refs)):
-            psi = rotate.optimal_inplane(numpy.asarray((0, angs[j, 1], angs[j, 2])), numpy.asarray((0, vals[i-1, 1], vals[i-1, 2])))
-            rimg = rotate.rotate_image(img, psi)
-            ref = refs[j]
-            try:
-                best[i-inputselect[0], ref_offset+j] = -numpy.max(ndimage_utility.cross_correlate(rimg, ref)[cx-5:cx+5, cx-5:cx+5])
-                #best[i-inputselect[0], ref_offset+j] = numpy.sum(numpy.square((rimg-ref)))
-            except:
-                _logger.error("range: %d < %d - %d"%(ref_offset+j, best.shape[1], ref_offset))
-                raise
+        best[i-inputselect[0], ref_offset:ref_offset+len(refs)] = -bank.score(img, shifts)[1]
     
 def use_small_angle_alignment(spi, curr_slice, use_flip, defocus_offset, theta_end, angle_range=0, **extra):
     ''' Test if small angle refinement should be used
@@ -629,7 +687,7 @@ def use_small_angle_alignment(spi, curr_slice, use_flip, defocus_offset, theta_e
         return part_count < full_count
     return False
 
-def prealign_input(spi, align, input_stack, use_flip, flip_stack, dala_stack, inputangles, cache_file, **extra):
+def prealign_input(spi, align, input_stack, use_flip, flip_stack, dala_stack, inputangles, cache_file, native_align=False, **extra):
     ''' Select and pre align the proper input stack
     
     :Parameters:
@@ -650,6 +708,8 @@ def prealign_input(spi, align, input_stack, use_flip, flip_stack, dala_stack, in
                  Document file with euler angles for each experimental projection (previous alignment)
     cache_file : str
                  Local cache file
+    native_align : bool
+                   Pre align the stack for the in-process projection matching engine
     extra : dict
             Unused keyword arguments
             
@@ -664,7 +724,7 @@ def prealign_input(spi, align, input_stack, use_flip, flip_stack, dala_stack, in
     input_stack = spider.interpolate_stack(spi, input_stack, outputfile=format_utility.add_prefix(cache_file, "data_ip_"), **extra)
     if inputangles is not None:
         write_alignment(spi.replace_ext(inputangles), align, extra['apix'])
-        if not spider.supports_internal_rtsq(spi):
+        if native_align or not spider.supports_internal_rtsq(spi):
             if mpi_utility.is_root(**extra): _logger.info("Generating pre-align dala stack: %f - %s"%(extra['apix'], input_stack))
             input_stack = spi.rt_sq(input_stack, inputangles, outputfile=dala_stack)
     return dict(input_stack=input_stack)
@@ -685,6 +745,7 @@ def setup_options(parser, pgroup=None, main_option=False):
     group.add_option("",   max_ref_proj=300,       help="Maximum number of reference projections in memory", gui=dict(minimum=10))
     group.add_option("",   use_apsh=False,         help="Set True to use AP SH instead of AP REF (trade speed for accuracy)")
     group.add_option("",   use_flip=False,         help="Use the phase flipped stack for alignment")
+    group.add_option("",   native_align=False,     help="Align with the in-process projection matching engine rather than SPIDER's AP SH, requires --use-flip")
     group.add_option("",   defocus_groups=0,       help="Reorganize into defocus groups")
     group.add_option("",   fast_align_test=False,  help="Test the fast alignment algorithm")
     
@@ -702,6 +763,7 @@ def check_options(options, main_option=False):
     from ..core.app.settings import OptionValueError
     
     if options.max_ref_proj < 1: raise OptionValueError, "Maximum number of reference projections must at least be 1, --max-ref-proj"
+    if options.native_align and not options.use_flip: raise OptionValueError, "Native alignment requires a CTF-corrected stack, --native-align requires --use-flip"
     spider_params.check_options(options)
 
 def main():
@@ -341,7 +341,10 @@ def create_powerspectra(filename, spi, use_powerspec=False, use_8bit=None, pad=2
             except:
                 _logger.error("%d, %d - %s --- %s"%(window_size, step, str(mic.shape), rwin.shape))
                 raise
-        npowerspec = ndimage_utility.powerspec_avg(rwin, pad)
+        if isinstance(rwin, numpy.ndarray):
+            npowerspec = ndimage_utility.powerspec_fin(*ndimage_utility.powerspec_batch(rwin, pad, thread_count=extra.get('thread_count', 1)))
+        else:
+            npowerspec = ndimage_utility.powerspec_avg(rwin, pad)
         mpowerspec = npowerspec.copy()
         
         #remove_line(npowerspec)
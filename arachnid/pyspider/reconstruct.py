@@ -533,13 +533,7 @@ def reconstruct_MPI(spi, input_stack, align, selection, curr_slice, vol_output,
     dala_stack = format_utility.add_prefix(local_scratch, "dala_recon_")#even_dala_stack
     align_file = format_utility.add_prefix(local_scratch, "align_")
     
-    if selection is not None and 1 == 0:
-        sel = numpy.argwhere(selection[curr_slice]).squeeze()
-        even = sel[numpy.arange(0, len(sel), 2, dtype=numpy.int)]
-        odd = sel[numpy.arange(1, len(sel), 2, dtype=numpy.int)]
-    else:
-        even = numpy.arange(0, len(align[curr_slice]), 2, dtype=numpy.int)
-        odd = numpy.arange(1, len(align[curr_slice]), 2, dtype=numpy.int)
+    index = numpy.arange(len(align[curr_slice]), dtype=numpy.int)
         
     if mpi_utility.is_root(**extra): _logger.info("Writing alignment file")
     format.write(spi.replace_ext(align_file), align[curr_slice, :15], header="epsi,theta,phi,ref_num,id,psi,tx,ty,nproj,ang_diff,cc_rot,spsi,sx,sy,mirror".split(','), format=format.spiderdoc)
@@ -553,21 +547,19 @@ def reconstruct_MPI(spi, input_stack, align, selection, curr_slice, vol_output,
     dala_stack = spi.replace_ext(dala_stack)
     if thread_count > 1 or thread_count == 0: spi.md('SET MP', 1)
     
-    gen1 = ndimage_file.iter_images(dala_stack, even)
-    gen2 = ndimage_file.iter_images(dala_stack, odd)
+    gen = ndimage_file.iter_images(dala_stack, index)
     #vol = reconstruct_engine.reconstruct3_nn4_mp(image_size, gen1, gen2, align1, align2)
     
     if boost:
         weights = reweight(align)[curr_slice]
-        gen1 = itertools.imap(functools.partial(reweight_image, weights=weights[even]), enumerate(gen1))
-        gen2 = itertools.imap(functools.partial(reweight_image, weights=weights[odd]), enumerate(gen2))
+        gen = itertools.imap(functools.partial(reweight_image, weights=weights), enumerate(gen))
     else: weights=None
     # boost
     # exp weight based on -cc
     # try different modes - defocus based - view based
     align = align[curr_slice]
     image_size = ndimage_file.read_image(dala_stack).shape[0]
-    vol = reconstruct_engine.reconstruct3_bp3f_mp(image_size, gen1, gen2, align[even], align[odd], thread_count=1, shared=False, **extra)
+    vol = reconstruct_engine.reconstruct3_bp3f_split_mp(image_size, gen, align, index%2, thread_count=1, shared=False, **extra)
 
     header={'apix':extra['apix']}
     if isinstance(vol, tuple):
@@ -102,6 +102,7 @@ This is not a complete list of options available to this script, for additional
 from ..core.app import program
 from ..core.metadata import format_utility, format, spider_utility
 from ..core.parallel import mpi_utility
+from ..core.image import spatial_index
 import os, logging
 import numpy
 
@@ -236,19 +237,8 @@ def find_overlap(coords, benchmark, pixel_radius, bench_mult=1.2, **extra):
     '''
     
     assert(benchmark.shape[1] == 2)
-    benchmark=benchmark.copy()
     rad = pixel_radius*bench_mult
-    pixel_radius = rad*rad
-    selected = []
-    if len(benchmark) > 0:
-        for i, f in enumerate(coords):
-            dist = f-benchmark
-            numpy.square(dist, dist)
-            dist = numpy.sum(dist, axis=1)
-            if dist.min() < pixel_radius:
-                benchmark[dist.argmin(), :]=(1e20, 1e20)
-                selected.append((i+1, 1))
-    return selected
+    return [(i+1, 1) for i, j in spatial_index.match_nearest(coords, benchmark, rad)]
 
 def precision(tp, fp, tn, fn):
     ''' Estimate the precision from a confusion matrix
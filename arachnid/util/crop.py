@@ -268,25 +268,27 @@ def process(filename, id_len=0, frame_beg=0, frame_end=0, single_stack=False, **
                     mic[:] = ndimage_utility.fourier_shift(mic, -align[i].dx/bin_factor, -align[i].dy/bin_factor)
                 #scp /catalina.F30/frames/13nov23c/rawdata/13*en.frames.mrc.bz2
             _logger.info("Extract %d windows from movie %d frame %d - %d of %d"%(len(coords), fid, frame, i, frame_end))
-            for index, win in enumerate(ndimage_utility.for_each_window(mic, coords, window, bin_factor)):
-                win = enhance_window(win, noise, **extra)
-                if win.min() == win.max():
-                    coord = coords[index]
-                    x, y = (coord.x, coord.y) if hasattr(coord, 'x') else (coord[1], coord[2])
-                    _logger.warn("Window %d at coordinates %d,%d has an issue - clamp_window may need to be increased"%(index+1, x, y))
-                if single_stack:
-                    try:
-                        ndimage_file.write_image(output, win, len(global_selection), header=dict(apix=extra['apix']))
-                    except Exception, exp:
-                        _logger.error("Error writing to image - %s"%str(exp))
-                        raise
-                    global_selection.append((len(global_selection)+1, fid, index+1, ))
-                else:
-                    try:
-                        ndimage_file.write_image(output, win, index, header=dict(apix=extra['apix']))
-                    except Exception, exp:
-                        _logger.error("Error writing to image - %s"%str(exp))
-                        raise
+            count = len(global_selection)+len(coords) if single_stack else len(coords)
+            with ndimage_file.StackWriter(output, count, header=dict(apix=extra['apix'])) as writer:
+                for index, win in enumerate(ndimage_utility.for_each_window(mic, coords, window, bin_factor)):
+                    win = enhance_window(win, noise, **extra)
+                    if win.min() == win.max():
+                        coord = coords[index]
+                        x, y = (coord.x, coord.y) if hasattr(coord, 'x') else (coord[1], coord[2])
+                        _logger.warn("Window %d at coordinates %d,%d has an issue - clamp_window may need to be increased"%(index+1, x, y))
+                    if single_stack:
+                        try:
+                            writer.write(win, len(global_selection))
+                        except Exception, exp:
+                            _logger.error("Error writing to image - %s"%str(exp))
+                            raise
+                        global_selection.append((len(global_selection)+1, fid, index+1, ))
+                    else:
+                        try:
+                            writer.write(win, index)
+                        except Exception, exp:
+                            _logger.error("Error writing to image - %s"%str(exp))
+                            raise
             #_logger.info("Extract %d windows from movie %d frame %d - %d of %d - finished"%(len(coords), fid, frame, i, tot))
     except ndimage_file.InvalidHeaderException:
         _logger.warn("Skipping: %s - invalid header"%filename)
@@ -232,7 +232,7 @@ def batch(files, relion2spider=False, frame_stack_file="", renormalize=0, **extr
         vals = []
         for f in files:
             try:
-                vals.append(format.read(f, numeric=True))
+                vals.append(format.table_to_values(format.read_table(f)))
             except:
                 raise ValueError, "Input not an image or a selection file"
         if len(vals) > 1:
@@ -507,7 +507,7 @@ def read_tilt_pair(tilt_pair, **extra):
     
     if tilt_pair == "": return []
     #mic1          id        mic2         id2
-    return numpy.asarray(format.read(tilt_pair, numeric=True)).astype(numpy.int)
+    return format.read(tilt_pair, ndarray=True)[0].astype(numpy.int)
     
 def read_defocus(defocus_file, defocus_header, min_defocus, max_defocus, **extra):
     ''' Read a defocus file
@@ -874,7 +874,6 @@ def print_stats(vals, column="rlnClassNumber", **extra):
     '''
     
     if len(vals) == 0: raise ValueError, "No values read"
-    tmp = numpy.asarray(vals)
     _logger.info("# of projections: %d"%len(vals))
     # min,max number of groups/micrographs
     
@@ -1320,26 +1319,33 @@ def downsample_images(vals, downsample=1.0, param_file="", phase_flip=False, api
     if downsample > 1.0: _logger.info("Downsampling images")
     if phase_flip: _logger.info("Phase flipping images")
     _logger.info("Stack preprocessing started")
-    for i in xrange(len(vals)):
-        v = vals[i]
-        if (i%1000) == 0:
-            _logger.info("Processed %d of %d"%(i+1, len(vals)))
-        filename, index = relion_utility.relion_file(v.rlnImageName)
-        img = ndimage_file.read_image(filename, index-1).astype(numpy.float32)
-        if phase_flip:
-            ctfimg = ctf_correct.phase_flip_transfer_function(img.shape, v.rlnDefocusU, **extra)
-            img = ctf_correct.correct(img, ctfimg).copy()
-        if ds_kernel is not None:
-            img = ndimage_interpolate.downsample(img, downsample, ds_kernel)
-            #img = ndimage_interpolate.resample_fft(img, downsample, offsets=ds_kernel, pad=pad) # bug - not sure what
-        if mask is None: mask = ndimage_utility.model_disk(pixel_radius, img.shape)
-        ndimage_utility.normalize_standard(img, mask, out=img)
-        if filename not in oindex: oindex[filename]=0
-        oindex[filename] += 1
-        if spider_utility.is_spider_filename(output) and spider_utility.is_spider_filename(filename):
-            output = spider_utility.spider_filename(output, filename)
-        ndimage_file.write_image(output, img, oindex[filename]-1, header=dict(apix=apix))
-        vals[i] = vals[i]._replace(rlnImageName=relion_utility.relion_identifier(output, oindex[filename]))
+    writer = None
+    try:
+        for i in xrange(len(vals)):
+            v = vals[i]
+            if (i%1000) == 0:
+                _logger.info("Processed %d of %d"%(i+1, len(vals)))
+            filename, index = relion_utility.relion_file(v.rlnImageName)
+            img = ndimage_file.read_image(filename, index-1).astype(numpy.float32)
+            if phase_flip:
+                ctfimg = ctf_correct.phase_flip_transfer_function(img.shape, v.rlnDefocusU, **extra)
+                img = ctf_correct.correct(img, ctfimg).copy()
+            if ds_kernel is not None:
+                img = ndimage_interpolate.downsample(img, downsample, ds_kernel)
+                #img = ndimage_interpolate.resample_fft(img, downsample, offsets=ds_kernel, pad=pad) # bug - not sure what
+            if mask is None: mask = ndimage_utility.model_disk(pixel_radius, img.shape)
+            ndimage_utility.normalize_standard(img, mask, out=img)
+            if filename not in oindex: oindex[filename]=0
+            oindex[filename] += 1
+            if spider_utility.is_spider_filename(output) and spider_utility.is_spider_filename(filename):
+                output = spider_utility.spider_filename(output, filename)
+            if writer is None or writer.filename != output:
+                if writer is not None: writer.close()
+                writer = ndimage_file.StackWriter(output, header=dict(apix=apix))
+            writer.write(img, oindex[filename]-1)
+            vals[i] = vals[i]._replace(rlnImageName=relion_utility.relion_identifier(output, oindex[filename]))
+    finally:
+        if writer is not None: writer.close()
     _logger.info("Stack preprocessing finished")
     _logger.info("Reminder - Using %f angstroms as the diameter of the mask in relion"%(pixel_radius*2*apix))
     return vals